@@ -0,0 +1,197 @@
+import json, sqlite3, threading, time
+from collections import OrderedDict
+from pathlib import Path
+from urllib.parse import urlencode
+
+# ---- кэш ответов внешних API (iNaturalist, GBIF): LRU в памяти + SQLite на диске ----
+# Запись свежая, пока возраст < ttl; до ttl + swr отдаём устаревшую и обновляем в фоне
+# (stale-while-revalidate, одно обновление на ключ). Если сеть упала, а запись есть —
+# отдаём её, какой бы старой она ни была (stale-if-error). Одновременные промахи по одному
+# ключу склеиваются: в сеть идёт один запрос, остальные ждут его результат (single-flight).
+
+DISK_PRUNE_EVERY = 500  # записей между чистками просроченного на диске
+
+
+def cache_key(url: str, params: dict | None = None) -> str:
+    """Нормализованный ключ: URL + параметры по алфавиту (None отбрасываем, значения — строки)."""
+    items = sorted((str(k), str(v)) for k, v in (params or {}).items() if v is not None)
+    return f"{url}?{urlencode(items)}" if items else url
+
+
+class _Call:
+    __slots__ = ("done", "value", "exc")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.exc = None
+
+
+class SingleFlight:
+    """Одновременные do(key, fn) с одним ключом — один вызов fn; результат/исключение получают все."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[str, _Call] = {}
+        self.shared = 0
+
+    def do(self, key: str, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.exc is not None:
+                raise call.exc
+            return call.value
+        try:
+            call.value = fn()
+            return call.value
+        except BaseException as e:
+            call.exc = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+
+class ResponseCache:
+    def __init__(self, path: Path | None, mem_items: int = 512, max_age: int = 30 * 86400):
+        self.path = Path(path) if path else None
+        self.mem_items = mem_items
+        self.max_age = max_age  # на диске дольше не храним
+        self._lock = threading.Lock()
+        self._mem: OrderedDict = OrderedDict()  # ключ -> (fetched, value)
+        self._local = threading.local()
+        self._refreshing: set[str] = set()
+        self._puts = 0
+        self._flight = SingleFlight()
+        self.stats = {"mem_hits": 0, "disk_hits": 0, "stale": 0, "misses": 0,
+                      "refreshes": 0, "refresh_errors": 0, "stale_on_error": 0}
+
+    # --- SQLite: соединение на поток ---
+    def _db(self) -> sqlite3.Connection | None:
+        if self.path is None:
+            return None
+        con = getattr(self._local, "con", None)
+        if con is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            con = sqlite3.connect(str(self.path), timeout=10)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, fetched REAL, body TEXT)")
+            self._local.con = con
+        return con
+
+    def _mem_put(self, key: str, entry: tuple):
+        with self._lock:
+            self._mem[key] = entry
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.mem_items:
+                self._mem.popitem(last=False)
+
+    def peek(self, key: str) -> tuple[float, object, str] | None:
+        """(fetched, value, "mem" | "disk") без учёта TTL."""
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None:
+                self._mem.move_to_end(key)
+                return hit + ("mem",)
+        try:
+            con = self._db()
+            row = con.execute("SELECT fetched, body FROM responses WHERE key=?", (key,)).fetchone() if con else None
+        except sqlite3.Error:
+            row = None
+        if row is None:
+            return None
+        entry = (row[0], json.loads(row[1]))
+        self._mem_put(key, entry)
+        return entry + ("disk",)
+
+    def put(self, key: str, value, fetched: float | None = None):
+        entry = (fetched or time.time(), value)
+        self._mem_put(key, entry)
+        try:
+            con = self._db()
+            if con is None: return
+            with con:
+                con.execute("INSERT OR REPLACE INTO responses (key, fetched, body) VALUES (?, ?, ?)",
+                            (key, entry[0], json.dumps(value, ensure_ascii=False, separators=(",", ":"))))
+            with self._lock:
+                self._puts += 1
+                prune = self._puts % DISK_PRUNE_EVERY == 0
+            if prune:
+                with con:
+                    con.execute("DELETE FROM responses WHERE fetched < ?", (time.time() - self.max_age,))
+        except sqlite3.Error:
+            pass
+
+    def get_or_fetch(self, key: str, fetch, ttl: int, swr: int = 0):
+        """fetch() -> значение (JSON-совместимое); исключения fetch пробрасываются, если отдать нечего."""
+        hit = self.peek(key)
+        now = time.time()
+        if hit is not None:
+            age = now - hit[0]
+            if age < ttl:
+                with self._lock:
+                    self.stats[f"{hit[2]}_hits"] += 1
+                return hit[1]
+            if age < ttl + swr:
+                with self._lock:
+                    self.stats["stale"] += 1
+                    start = key not in self._refreshing
+                    if start: self._refreshing.add(key)
+                if start:
+                    threading.Thread(target=self._refresh, args=(key, fetch), name="api-cache-refresh",
+                                     daemon=True).start()
+                return hit[1]
+        with self._lock:
+            self.stats["misses"] += 1
+        try:
+            return self._flight.do(key, lambda: self._fetch_put(key, fetch))
+        except Exception:
+            if hit is None:
+                raise
+            with self._lock:
+                self.stats["stale_on_error"] += 1
+            return hit[1]
+
+    def _fetch_put(self, key: str, fetch):
+        value = fetch()
+        self.put(key, value)
+        return value
+
+    def _refresh(self, key: str, fetch):
+        try:
+            self._flight.do(key, lambda: self._fetch_put(key, fetch))
+            with self._lock:
+                self.stats["refreshes"] += 1
+        except Exception:
+            with self._lock:
+                self.stats["refresh_errors"] += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def clear_memory(self):
+        with self._lock:
+            self._mem.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            out = dict(self.stats, mem_items=len(self._mem), coalesced=self._flight.shared)
+        served = out["mem_hits"] + out["disk_hits"] + out["stale"]
+        total = served + out["misses"]
+        served += out["coalesced"]  # дождались чужого запроса — в сеть не ходили
+        out["hit_ratio"] = round(served / total, 3) if total else 0.0
+        try:
+            con = self._db()
+            out["disk_items"] = con.execute("SELECT COUNT(*) FROM responses").fetchone()[0] if con else 0
+        except sqlite3.Error:
+            pass
+        return out
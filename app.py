@@ -1,23 +1,30 @@
-import os, re, json, time, shutil, zipfile, threading, logging
+import os, re, json, time, shutil, zipfile, threading, logging, mimetypes
 from pathlib import Path
-from flask import Flask, request, jsonify, render_template, send_from_directory, abort
+from flask import Flask, Response, request, jsonify, render_template, send_from_directory, abort, redirect
 from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.serving import WSGIRequestHandler
 
 from threed import (
-    CFG, _load_port, UPLOAD_PASSWORD,
+    CFG, _load_port, UPLOAD_PASSWORD, SLOW_REQUEST_MS,
     DATA_DIR, UPLOADS_DIR, CACHE_DIR,
     ALLOWED_IMAGE_EXT, ALLOWED_MODEL_EXT, ORIGINAL_IMAGE_EXT, MAX_ZIP_MB, CLEAN_DELAY_SEC,
     safe_rel_path, safe_join_under,
     read_meta_title, write_meta,
-    list_cached_webp, list_cached_webp_raw, resolve_leaf_rel, ensure_spin_cache,
-    find_datasets,
+    list_cached_webp_raw, spin_cache_state, resolve_leaf_rel, ensure_spin_cache,
+    zip_stream_supported, ensure_spin_cache_from_zip,
+    find_datasets, FRAME_CACHE, export_zip, cache_store, data_store, STORAGE_REDIRECT, PRESIGN_TTL,
     _safe_unlink, sweep_uploads, delete_originals_recursively, cleanup_empty_dirs,
-    _start_background_sweeper, _leafs_under
+    _start_background_sweeper, _leafs_under, ensure_dirs, encoders,
+    SPIN_BUILDER, PRIO_ON_DEMAND, PRIO_WARM, find_uncached_leafs, warm_uncached
 )
 
 from datetime import timedelta
 from picker_profile import profile_bp
+import timing
+from timing import span
+from logsetup import log_stats
+from diagnostics import PROFILER
+from static_export import schedule_export
 
 # ---- Flask ----
 BASE_DIR = Path(__file__).resolve().parent
@@ -33,6 +40,58 @@ app.register_blueprint(profile_bp)
 app.secret_key = app.secret_key or "change-me"
 app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(days=30)
 
+SPIN_RETRY_AFTER_SEC = 1  # подсказка клиенту, пока кэш собирается в фоне
+PROFILER.install(app)  # постоянная обёртка wsgi_app; без правил — одна проверка
+
+# статическая выгрузка (static_export.py): если задан каталог — перевыгружаем после изменений
+STATIC_EXPORT_DIR = CFG.get("static_export_dir") or ""
+
+
+def _static_changed(_key: str = ""):
+    if STATIC_EXPORT_DIR:
+        schedule_export(Path(STATIC_EXPORT_DIR))
+
+
+SPIN_BUILDER.on_built.append(_static_changed)
+
+
+# ---- Server-Timing / медленные запросы ----
+@app.before_request
+def _timing_begin():
+    timing.begin()
+
+
+access_log = logging.getLogger("access")
+
+
+def _request_dataset() -> str:
+    va = request.view_args or {}
+    if "dataset_rel" in va:
+        return va["dataset_rel"]
+    if "subpath" in va:
+        return va["subpath"].rpartition("/")[0]
+    return ",".join(request.values.getlist("dataset_id"))
+
+
+@app.after_request
+def _timing_emit(resp):
+    spans, total_ms = timing.end()
+    resp.headers["Server-Timing"] = timing.server_timing_header(spans, total_ms)
+    # запись уходит в очередь логгера — диск трогает поток-писатель; частые кадры прореживаются
+    access_log.info("%s %s %s", request.method, request.path, resp.status_code, extra={
+        "sample": "frame" if request.endpoint == "serve_from_cache" else "access",
+        "route": request.url_rule.rule if request.url_rule else "", "method": request.method,
+        "path": request.path, "status": resp.status_code, "ms": round(total_ms, 1),
+        "dataset": _request_dataset(), "ip": request.remote_addr,
+        "spans": {name: round(ms, 1) for name, (ms, _n) in spans.items()},
+    })
+    if SLOW_REQUEST_MS and total_ms >= SLOW_REQUEST_MS:
+        timing.log_slow({
+            "ts": round(time.time(), 3), "method": request.method, "path": request.path,
+            "endpoint": request.endpoint or "", "status": resp.status_code, "ms": round(total_ms, 1),
+        }, spans)
+    return resp
+
 
 @app.errorhandler(RequestEntityTooLarge)
 def handle_413(_e):
@@ -45,6 +104,27 @@ def index():
     return render_template("index.html")
 
 
+def _send_object(store, key: str, info):
+    """Объект хранилища: presign-редирект, файл с диска или поток через приложение."""
+    if STORAGE_REDIRECT:
+        url = store.presign(key, PRESIGN_TTL)
+        if url:
+            return redirect(url, code=302)
+    full = store.local_path(key)
+    if full is not None:
+        return send_from_directory(full.parent, full.name)
+    try:
+        body = store.open(key)
+    except FileNotFoundError:
+        abort(404)
+    resp = Response(body, mimetype=mimetypes.guess_type(key)[0] or "application/octet-stream",
+                    direct_passthrough=True)
+    resp.content_length = info.size
+    resp.last_modified = int(info.mtime)
+    resp.call_on_close(body.close)
+    return resp
+
+
 @app.route("/files/<path:subpath>")
 def serve_from_data(subpath):
     try:
@@ -52,24 +132,50 @@ def serve_from_data(subpath):
         full = safe_join_under(DATA_DIR, rel)
     except Exception:
         abort(404)
-    if not full.exists() or not full.is_file(): abort(404)
-    return send_from_directory(full.parent, full.name)
+    # оригиналы до сборки кэша лежат только на локальном диске
+    if full.is_file():
+        return send_from_directory(full.parent, full.name)
+    store = data_store()
+    info = store.stat(rel.as_posix())
+    if info is None: abort(404)
+    return _send_object(store, rel.as_posix(), info)
 
 
 @app.route("/spin-cache/<path:subpath>")
 def serve_from_cache(subpath):
     try:
-        rel = safe_rel_path(subpath)
-        full = safe_join_under(CACHE_DIR, rel)
+        leaf, frame, key = FRAME_CACHE.resolve(subpath)
     except Exception:
         abort(404)
-    if not full.exists() or not full.is_file(): abort(404)
-    return send_from_directory(full.parent, full.name)
+    entry = FRAME_CACHE.get(leaf, frame) if FRAME_CACHE.enabled else None
+    if entry is None:
+        store = cache_store()
+        info = store.stat(key)
+        if info is None: abort(404)
+        if FRAME_CACHE.enabled and key.endswith(".webp") and not (STORAGE_REDIRECT and store.can_presign):
+            try:
+                entry = FRAME_CACHE.load(leaf, frame, key, info)
+            except OSError:
+                abort(404)
+        if entry is None:
+            return _send_object(store, key, info)
+    resp = Response(entry["data"], mimetype="image/webp")
+    resp.set_etag(entry["etag"])
+    resp.last_modified = entry["mtime"]
+    resp.cache_control.no_cache = True
+    return resp.make_conditional(request)
+
+
+@app.route("/api/frame_cache/stats")
+def api_frame_cache_stats():
+    return jsonify(FRAME_CACHE.stats())
 
 
 @app.route("/api/datasets")
 def api_datasets():
-    return jsonify(find_datasets())
+    items = find_datasets()
+    with span("json"):
+        return jsonify(items)
 
 
 def _numeric_from_url(u: str) -> tuple:
@@ -89,23 +195,73 @@ def api_spin(dataset_rel):
     max_frames = int(request.args.get("max", CFG.get("spin_max_frames", 90)))
 
     urls_rel = []
+    building = None
     if data_node.exists():
         leaf = resolve_leaf_rel(rel)
-        urls_rel = list_cached_webp(leaf)
-        if not urls_rel:
-            urls_rel = ensure_spin_cache(leaf, max_w=max_w, max_frames=max_frames)
+        building = SPIN_BUILDER.status(leaf)
+        urls_rel, complete = spin_cache_state(leaf)  # при сборке — кадры, готовые на данный момент
+        if not complete and (building is None or building["status"] == "failed"):
+            # сборку не ждём: ставим в очередь с наивысшим приоритетом
+            building = SPIN_BUILDER.submit(leaf, PRIO_ON_DEMAND, max_w=max_w, max_frames=max_frames)
     else:
         urls_rel = list_cached_webp_raw(rel)
 
-    if urls_rel:
-        urls = [f"/spin-cache/{rp}" for rp in urls_rel]
-        urls.sort(key=_numeric_from_url)
-        return jsonify(urls)
+    urls = [f"/spin-cache/{rp}" for rp in urls_rel]
+    urls.sort(key=_numeric_from_url)
+
+    if building and building["status"] in ("queued", "building"):
+        body = {
+            "ok": False, "status": "building", "frames": urls,
+            "done": building["done"], "total": building["total"], "retry_after": SPIN_RETRY_AFTER_SEC,
+        }
+        with span("json"):
+            resp = jsonify(body)
+        resp.status_code = 202
+        resp.headers["Retry-After"] = str(SPIN_RETRY_AFTER_SEC)
+        return resp
+
+    if urls:
+        with span("json"):
+            return jsonify(urls)
 
     return jsonify({"ok": False, "error": "no frames found"}), 404
 
 
+@app.route("/api/spin_warm", methods=["POST"])
+def api_spin_warm():
+    """Явный прогрев кэша: dataset_id (можно несколько) или all=1 — все наборы без кэша."""
+    if request.form.get("password", "") != UPLOAD_PASSWORD:
+        return jsonify({"ok": False, "error": "unauthorized"}), 401
+    max_w = int(CFG.get("spin_max_w", 1280))
+    max_frames = int(CFG.get("spin_max_frames", 90))
+    if request.form.get("all"):
+        leafs = find_uncached_leafs()
+    else:
+        try:
+            leafs = [resolve_leaf_rel(safe_rel_path(ds)) for ds in request.form.getlist("dataset_id")]
+        except Exception:
+            return jsonify({"ok": False, "error": "bad dataset path"}), 400
+    queued = {}
+    for leaf in leafs:
+        if spin_cache_state(leaf)[1]:
+            continue
+        queued[leaf.as_posix()] = SPIN_BUILDER.submit(leaf, PRIO_WARM, max_w=max_w, max_frames=max_frames)["status"]
+    return jsonify({"ok": True, "queued": queued, "builder": SPIN_BUILDER.stats()})
+
+
 # ---- Upload ZIP ----
+def _extract_member(zf: zipfile.ZipFile, m: zipfile.ZipInfo, rel: Path):
+    out = safe_join_under(DATA_DIR, rel)
+    if rel.suffix.lower() in ALLOWED_MODEL_EXT:
+        # модели публикуются сразу в хранилище (для local — тот же путь под DATA_DIR)
+        with zf.open(m) as src:
+            data_store().put(rel.as_posix(), src)
+        return
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with zf.open(m) as src, open(out, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+
+
 @app.route("/api/upload_zip", methods=["POST"])
 def api_upload_zip():
     if request.form.get("password", "") != UPLOAD_PASSWORD:
@@ -120,6 +276,10 @@ def api_upload_zip():
     zip_stem = Path(file.filename).stem
     dataset_rel_raw = request.form.get("dataset_id") or zip_stem
     display_name = (request.form.get("display_name") or "").strip()
+    try:
+        target_kb = float(request.form["target_kb"]) if request.form.get("target_kb") else None
+    except ValueError:
+        return jsonify({"ok": False, "error": "bad target_kb"}), 400
 
     try:
         dataset_rel = safe_rel_path(dataset_rel_raw)
@@ -127,6 +287,7 @@ def api_upload_zip():
     except Exception:
         return jsonify({"ok": False, "error": "bad dataset path"}), 400
 
+    ensure_dirs()
     up_path = UPLOADS_DIR / f"{dataset_rel.name}_{int(time.time())}.zip"
     try:
         file.save(str(up_path))
@@ -135,6 +296,9 @@ def api_upload_zip():
 
     target_dir.mkdir(parents=True, exist_ok=True)
 
+    # потоковый режим: оригиналы не распаковываем — кадры кодируются прямо из архива
+    stream = bool(CFG.get("upload_stream_ingest", True)) and zip_stream_supported()
+
     try:
         with zipfile.ZipFile(str(up_path), "r") as zf:
             top_levels = set()
@@ -147,34 +311,45 @@ def api_upload_zip():
                 file_members.append((m, parts))
             strip_depth = 1 if len(top_levels) == 1 else 0
 
+            streamed = {}  # лист (rel под DATA_DIR) -> [(member, имя)]
             for m, parts in file_members:
                 rel_path = Path(*parts[strip_depth:])
                 if not rel_path.parts:
                     continue
                 ext = rel_path.suffix.lower()
-                if ext in (ALLOWED_IMAGE_EXT | ALLOWED_MODEL_EXT):
-                    out = safe_join_under(DATA_DIR, dataset_rel / rel_path)
-                    out.parent.mkdir(parents=True, exist_ok=True)
-                    with zf.open(m) as src, open(out, "wb") as dst:
-                        shutil.copyfileobj(src, dst)
-
-        write_meta(target_dir, display_name)
-
-        try:
-            cache_sub = safe_join_under(CACHE_DIR, dataset_rel)
-            if cache_sub.exists(): shutil.rmtree(cache_sub)
-        except Exception:
-            pass
-
-        spin_max_w = int(CFG.get("spin_max_w", 1280))
-        spin_max_frames = int(CFG.get("spin_max_frames", 90))
+                if stream and ext in ORIGINAL_IMAGE_EXT:
+                    streamed.setdefault(dataset_rel / rel_path.parent, []).append((m, rel_path.name))
+                elif ext in (ALLOWED_IMAGE_EXT | ALLOWED_MODEL_EXT):
+                    _extract_member(zf, m, dataset_rel / rel_path)
+
+            write_meta(target_dir, display_name, target_kb=target_kb)
+
+            try:
+                cache_store().delete_prefix(dataset_rel.as_posix())
+            except Exception:
+                pass
+            FRAME_CACHE.invalidate(dataset_rel)
+
+            spin_max_w = int(CFG.get("spin_max_w", 1280))
+            spin_max_frames = int(CFG.get("spin_max_frames", 90))
+
+            built_for = []
+            for rel in sorted(streamed, key=lambda r: (len(r.parts), r.as_posix())):
+                members = streamed[rel]
+                if ensure_spin_cache_from_zip(zf, rel, members, max_w=spin_max_w, max_frames=spin_max_frames):
+                    built_for.append(rel.as_posix())
+                else:
+                    # не вышло закодировать — сохраняем оригиналы как в обычном режиме
+                    for m, name in members:
+                        _extract_member(zf, m, rel / name)
 
         leafs = _leafs_under(target_dir)
         if not leafs:
             leafs = [resolve_leaf_rel(dataset_rel)]
 
-        built_for = []
         for rel in leafs:
+            if rel.as_posix() in built_for:
+                continue
             urls_rel = ensure_spin_cache(rel, max_w=spin_max_w, max_frames=spin_max_frames)
             if urls_rel:
                 built_for.append(rel.as_posix())
@@ -183,6 +358,7 @@ def api_upload_zip():
                 cleanup_empty_dirs(abs_leaf, stop_at=target_dir)
 
         _safe_unlink(up_path)
+        _static_changed()
 
         return jsonify({
             "ok": True,
@@ -214,24 +390,112 @@ def api_delete_dataset():
             shutil.rmtree(target)
         except Exception:
             pass
-        try:
-            shutil.rmtree(safe_join_under(CACHE_DIR, rel))
-        except Exception:
-            pass
+        for store in (data_store(), cache_store()):
+            try:
+                store.delete_prefix(rel.as_posix())
+            except Exception:
+                pass
+        FRAME_CACHE.invalidate(rel)
+        _static_changed()
         return jsonify({"ok": True})
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 400
 
 
+# ---- Экспорт наборов (ZIP потоком, с докачкой) ----
+@app.route("/api/export_zip")
+def api_export_zip():
+    """?dataset_id=a&dataset_id=b — кадры, модели и .meta.json; Range/If-Range поддерживаются."""
+    ids = request.args.getlist("dataset_id")
+    if not ids:
+        return jsonify({"ok": False, "error": "no dataset_id"}), 400
+    try:
+        with span("export_list"):
+            zs = export_zip(ids)
+    except KeyError as e:
+        return jsonify({"ok": False, "error": "dataset not found", "dataset_id": e.args[0]}), 404
+    except ValueError:
+        return jsonify({"ok": False, "error": "bad dataset path"}), 400
+
+    start, stop, status = 0, zs.size, 200
+    rng = request.range
+    if rng is not None and (request.if_range.etag in (None, zs.etag)) and request.if_range.date is None:
+        bounds = rng.range_for_length(zs.size)
+        if bounds is None:
+            resp = Response(status=416)
+            resp.headers["Content-Range"] = f"bytes */{zs.size}"
+            return resp
+        (start, stop), status = bounds, 206
+
+    fname = Path(ids[0]).name if len(ids) == 1 else "datasets"
+    resp = Response(zs.iter_range(start, stop), status=status, mimetype="application/zip",
+                    direct_passthrough=True)
+    resp.content_length = stop - start
+    if status == 206:
+        resp.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{zs.size}"
+    resp.set_etag(zs.etag)
+    resp.accept_ranges = "bytes"
+    resp.headers.set("Content-Disposition", "attachment", filename=f"{fname}.zip")
+    return resp
+
+
+# ---- Диагностика: профиль следующих N запросов / фоновых задач ----
+def _admin_ok() -> bool:
+    pwd = request.headers.get("X-Admin-Password") or request.values.get("password", "")
+    return pwd == UPLOAD_PASSWORD
+
+
+@app.route("/api/diag/profile", methods=["GET", "POST"])
+def api_diag_profile():
+    """
+    POST kind=request|job, match=<префикс пути / шаблон маршрута / имя[:метка]>, n=1 — взвести;
+    POST cancel=<id> — снять; GET — правила и снятые дампы.
+    """
+    if not _admin_ok():
+        return jsonify({"ok": False, "error": "unauthorized"}), 401
+    if request.method == "POST":
+        if request.form.get("cancel"):
+            try:
+                rule_id = int(request.form["cancel"])
+            except ValueError:
+                return jsonify({"ok": False, "error": "cancel must be an integer rule id"}), 400
+            return jsonify({"ok": PROFILER.cancel(rule_id)})
+        match = (request.form.get("match") or "").strip()
+        if not match:
+            return jsonify({"ok": False, "error": "match required"}), 400
+        try:
+            rule = PROFILER.arm(request.form.get("kind", "request"), match, int(request.form.get("n", 1)))
+        except ValueError as e:
+            return jsonify({"ok": False, "error": str(e)}), 400
+        return jsonify({"ok": True, "rule": rule})
+    return jsonify({"ok": True, "rules": PROFILER.rules(), "dumps": PROFILER.dumps()})
+
+
+@app.route("/api/diag/dumps/<name>")
+def api_diag_dump(name):
+    if not _admin_ok():
+        return jsonify({"ok": False, "error": "unauthorized"}), 401
+    p = PROFILER.dump_path(name)
+    if p is None: abort(404)
+    return send_from_directory(p.parent, p.name, as_attachment=p.suffix == ".prof")
+
+
 # ---- Подключаем Plant Picker (страница + API) ----
-from picker import picker_page_bp, picker_api_bp, init_picker
+from picker import picker_page_bp, picker_api_bp, init_picker, warm_picker
 
 app.register_blueprint(picker_page_bp)  # /picker
 app.register_blueprint(picker_api_bp, url_prefix="/api")  # /api/resolve_taxon, /api/inat/*, /api/collect/*
-init_picker(app)
 
-# ---- Entrypoint / фоновые задачи ----
-try:
+
+# ---- Прогрев / фоновые задачи (после fork, не при импорте) ----
+BOOT_TS = time.time()
+_ready = {"encoders": False, "catalog": False, "picker": False}
+_ready_info = {}
+_warm_lock = threading.Lock()
+_warm_started = False
+
+
+def _sweep_stale_uploads():
     now = time.time()
     for p in UPLOADS_DIR.glob("*.zip"):
         try:
@@ -239,13 +503,80 @@ try:
                 _safe_unlink(p)
         except FileNotFoundError:
             pass
-except Exception:
-    pass
 
-_start_background_sweeper()
+
+def _warm_spin_cache() -> int:
+    if not CFG.get("spin_warm_on_start", True):
+        return 0
+    return warm_uncached(max_w=int(CFG.get("spin_max_w", 1280)),
+                         max_frames=int(CFG.get("spin_max_frames", 90)))
+
+
+def _warmup():
+    t0 = time.time()
+    steps = [
+        ("dirs", lambda: (ensure_dirs(), init_picker(app))),
+        ("storage", lambda: (data_store(), cache_store())),
+        ("uploads", _sweep_stale_uploads),
+        ("sweeper", _start_background_sweeper),
+        ("encoders", encoders),
+        ("picker", warm_picker),
+        ("catalog", lambda: len(find_datasets())),
+        ("spin_scan", _warm_spin_cache),
+    ]
+    for name, fn in steps:
+        try:
+            res = fn()
+            if name == "catalog":
+                _ready_info["datasets"] = res
+            elif name == "spin_scan":
+                _ready_info["spin_scan_queued"] = res
+            if name in _ready:
+                _ready[name] = True
+        except Exception as e:
+            _ready_info[f"{name}_error"] = str(e)
+            app.logger.exception("warmup step %s failed", name)
+    _ready_info["warmup_s"] = round(time.time() - t0, 3)
+
+
+def start_background():
+    """Запуск прогрева один раз на процесс (для WSGI-серверов — вызывать в post_fork)."""
+    global _warm_started
+    with _warm_lock:
+        if _warm_started:
+            return
+        _warm_started = True
+    threading.Thread(target=_warmup, name="warmup", daemon=True).start()
+
+
+@app.before_request
+def _ensure_warmup():
+    if not _warm_started:
+        start_background()
+
+
+@app.route("/healthz")
+def healthz():
+    return jsonify({"ok": True, "uptime_s": round(time.time() - BOOT_TS, 3)})
+
+
+@app.route("/readyz")
+def readyz():
+    ready = all(_ready.values())
+    enc = encoders() if _ready["encoders"] else {}
+    body = {
+        "ok": ready, **_ready, **_ready_info,
+        "webp": bool(enc.get("webp")), "cwebp": bool(enc.get("cwebp")),
+        "spin_builder": SPIN_BUILDER.stats(),
+        "storage": (CFG.get("storage") or {}).get("backend", "local"),
+        "log": log_stats(),
+    }
+    return jsonify(body), (200 if ready else 503)
+
 
 if __name__ == "__main__":
     WSGIRequestHandler.protocol_version = "HTTP/1.1"
+    start_background()
 
     app.run(
         host="0.0.0.0",
@@ -0,0 +1,275 @@
+import csv, os, re, sqlite3, threading, time
+from datetime import datetime
+from pathlib import Path
+
+# ---- хранилище сборщика: таксоны, выбранные фото и состояние файлов (SQLite, WAL) ----
+# Источник истины для /api/collect/*. selected.csv / species.csv больше не переписываются
+# на каждый клик — это выгрузка (export_csv) после каждого sync и по запросу, для внешних инструментов.
+# Изменения — короткими транзакциями по фото; WAL + busy_timeout позволяют писать из
+# нескольких процессов (gunicorn-воркеры, скрипты) без порчи данных.
+
+SELECTED_FIELDS = ["taxon_id", "latin", "gbif_id", "photo_id", "observation_id", "license", "attribution",
+                   "best_url", "local_path", "md5", "width", "height", "observed_on", "time_observed_at",
+                   "user_login", "place_guess", "quality_grade", "saved_at", "src_md5"]
+SPECIES_FIELDS = ["taxon_id", "latin", "common_en", "common_ru", "gbif_id", "updated_at"]
+# поля фото, которые приходят с фронта (остальное — состояние файла)
+META_FIELDS = ["observation_id", "license", "attribution", "best_url", "width", "height", "observed_on",
+               "time_observed_at", "user_login", "place_guess", "quality_grade", "thumb_url"]
+FILE_FIELDS = ["local_path", "md5", "src_md5", "saved_at", "file_idx"]
+# колонки, добавленные после первой версии схемы: (таблица, колонка, определение)
+_ADDED_COLUMNS = [
+    ("taxa", "last_sync", "TEXT NOT NULL DEFAULT ''"),
+    ("taxa", "last_failed", "INTEGER NOT NULL DEFAULT 0"),
+    ("selections", "bytes", "INTEGER NOT NULL DEFAULT 0"),
+    ("selections", "thumb_url", "TEXT NOT NULL DEFAULT ''"),
+    ("selections", "dhash", "TEXT NOT NULL DEFAULT ''"),  # dHash, 16 hex-цифр
+    ("selections", "dup_of", "TEXT NOT NULL DEFAULT ''"),  # "<taxon_id>/<photo_id>" похожего фото
+]
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS taxa (
+    taxon_id INTEGER PRIMARY KEY, latin TEXT, common_en TEXT, common_ru TEXT, gbif_id TEXT,
+    dir TEXT, version INTEGER NOT NULL DEFAULT 0, updated_at TEXT,
+    last_sync TEXT NOT NULL DEFAULT '', last_failed INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS selections (
+    taxon_id INTEGER NOT NULL, photo_id TEXT NOT NULL,
+    {", ".join(f"{f} TEXT NOT NULL DEFAULT ''" for f in META_FIELDS + FILE_FIELDS[:-1])},
+    file_idx INTEGER, bytes INTEGER NOT NULL DEFAULT 0,
+    dhash TEXT NOT NULL DEFAULT '', dup_of TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (taxon_id, photo_id));
+CREATE INDEX IF NOT EXISTS selections_idx ON selections(taxon_id, file_idx);
+"""
+
+_IDX_RE = re.compile(r"^(\d{6})_")
+
+
+def file_idx_of(local_path: str) -> int | None:
+    m = _IDX_RE.match(Path(local_path or "").name)
+    return int(m.group(1)) if m else None
+
+
+class CollectDB:
+    def __init__(self, path: Path, legacy_root: Path | None = None):
+        self.path = Path(path)
+        self.legacy_root = legacy_root
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._ready = False
+
+    def _db(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            con = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)  # транзакции — явно
+            con.row_factory = sqlite3.Row
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.execute("PRAGMA busy_timeout=30000")
+            self._local.con = con
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    con.executescript(_SCHEMA)
+                    self._migrate(con)
+                    self._ready = True
+                    if self.legacy_root is not None:
+                        self.import_legacy(self.legacy_root)
+        return con
+
+    def _migrate(self, con: sqlite3.Connection):
+        for table, col, decl in _ADDED_COLUMNS:
+            have = {r[1] for r in con.execute(f"PRAGMA table_info({table})")}
+            if col in have:
+                continue
+            con.execute(f"ALTER TABLE {table} ADD COLUMN {col} {decl}")
+            if (table, col) == ("selections", "bytes"):  # размеры уже сохранённых файлов
+                rows = con.execute("SELECT taxon_id, photo_id, local_path FROM selections"
+                                   " WHERE local_path != ''").fetchall()
+                con.execute("BEGIN IMMEDIATE")
+                for tid, pid, lp in rows:
+                    con.execute("UPDATE selections SET bytes=? WHERE taxon_id=? AND photo_id=?",
+                                (_size(lp), tid, pid))
+                con.execute("COMMIT")
+
+    def tx(self):
+        """with db.tx() as con: ... — BEGIN IMMEDIATE (писатель сразу берёт блокировку)."""
+        return _Tx(self._db())
+
+    # --- таксоны ---
+    def upsert_taxon(self, taxon_id: int, latin: str, common_en: str = "", common_ru: str = "",
+                     gbif_id: str = "", dir: str = ""):
+        with self.tx() as con:
+            con.execute("""
+                INSERT INTO taxa (taxon_id, latin, common_en, common_ru, gbif_id, dir, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(taxon_id) DO UPDATE SET latin=COALESCE(NULLIF(excluded.latin, ''), taxa.latin),
+                    common_en=COALESCE(NULLIF(excluded.common_en, ''), taxa.common_en),
+                    common_ru=COALESCE(NULLIF(excluded.common_ru, ''), taxa.common_ru),
+                    gbif_id=COALESCE(NULLIF(excluded.gbif_id, ''), taxa.gbif_id),
+                    dir=COALESCE(NULLIF(taxa.dir, ''), excluded.dir), updated_at=excluded.updated_at
+            """, (int(taxon_id), latin, common_en, common_ru, str(gbif_id or ""), dir,
+                  datetime.utcnow().isoformat()))
+
+    def taxon(self, taxon_id: int) -> dict | None:
+        row = self._db().execute("SELECT * FROM taxa WHERE taxon_id=?", (int(taxon_id),)).fetchone()
+        return dict(row) if row else None
+
+    def taxa(self) -> list[dict]:
+        return [dict(r) for r in self._db().execute("SELECT * FROM taxa ORDER BY taxon_id")]
+
+    def version(self, taxon_id: int) -> int:
+        row = self._db().execute("SELECT version FROM taxa WHERE taxon_id=?", (int(taxon_id),)).fetchone()
+        return row[0] if row else 0
+
+    def bump_version(self, con: sqlite3.Connection, taxon_id: int) -> int:
+        con.execute("UPDATE taxa SET version = version + 1 WHERE taxon_id=?", (int(taxon_id),))
+        return con.execute("SELECT version FROM taxa WHERE taxon_id=?", (int(taxon_id),)).fetchone()[0]
+
+    # --- выбранные фото ---
+    def selections(self, taxon_id: int) -> dict[str, dict]:
+        rows = self._db().execute("SELECT * FROM selections WHERE taxon_id=? ORDER BY photo_id", (int(taxon_id),))
+        return {r["photo_id"]: dict(r) for r in rows}
+
+    def upsert_meta(self, con: sqlite3.Connection, taxon_id: int, photo_id: str, meta: dict):
+        """Метаданные фото с фронта; состояние файла не трогаем (у новой строки — пустое)."""
+        vals = [str(meta.get(f) or "") for f in META_FIELDS]
+        con.execute(f"""
+            INSERT INTO selections (taxon_id, photo_id, {", ".join(META_FIELDS)})
+            VALUES (?, ?, {", ".join("?" * len(META_FIELDS))})
+            ON CONFLICT(taxon_id, photo_id) DO UPDATE SET
+                {", ".join(f"{f}=excluded.{f}" for f in META_FIELDS)}
+        """, (int(taxon_id), str(photo_id), *vals))
+
+    def set_file(self, taxon_id: int, photo_id: str, local_path: str = "", md5: str = "", src_md5: str = "",
+                 saved_at: str = "", file_idx: int | None = None, size: int = 0):
+        with self.tx() as con:
+            con.execute("UPDATE selections SET local_path=?, md5=?, src_md5=?, saved_at=?, file_idx=?, bytes=?"
+                        " WHERE taxon_id=? AND photo_id=?",
+                        (local_path, md5, src_md5, saved_at, file_idx, int(size), int(taxon_id), str(photo_id)))
+
+    def set_hash(self, taxon_id: int, photo_id: str, dhash: str, dup_of: str = ""):
+        with self.tx() as con:
+            con.execute("UPDATE selections SET dhash=?, dup_of=? WHERE taxon_id=? AND photo_id=?",
+                        (dhash, dup_of, int(taxon_id), str(photo_id)))
+
+    def hashes(self) -> list[tuple[int, str, str]]:
+        """(taxon_id, photo_id, dhash) фото с файлом — для индекса похожих."""
+        rows = self._db().execute("SELECT taxon_id, photo_id, dhash FROM selections"
+                                  " WHERE dhash != '' AND local_path != ''")
+        return [tuple(r) for r in rows]
+
+    def delete_selection(self, con: sqlite3.Connection, taxon_id: int, photo_id: str):
+        con.execute("DELETE FROM selections WHERE taxon_id=? AND photo_id=?", (int(taxon_id), str(photo_id)))
+
+    def next_file_idx(self, taxon_id: int) -> int:
+        row = self._db().execute("SELECT MAX(file_idx) FROM selections WHERE taxon_id=?", (int(taxon_id),)).fetchone()
+        return (row[0] + 1) if row and row[0] is not None else 0
+
+    def counts(self) -> dict[int, int]:
+        return {r[0]: r[1] for r in self._db().execute("SELECT taxon_id, COUNT(*) FROM selections GROUP BY taxon_id")}
+
+    def record_sync(self, taxon_id: int, failed: int):
+        with self.tx() as con:
+            con.execute("UPDATE taxa SET last_sync=?, last_failed=? WHERE taxon_id=?",
+                        (datetime.utcnow().isoformat(), int(failed), int(taxon_id)))
+
+    def catalog(self) -> list[dict]:
+        """Сводка по таксонам: каталог, латынь, выбрано / с файлом / без файла, байт на диске, последний sync."""
+        rows = self._db().execute("""
+            SELECT t.taxon_id, t.dir, t.latin, t.common_en, t.common_ru, t.version, t.last_sync, t.last_failed,
+                   COUNT(s.photo_id) AS selected,
+                   COALESCE(SUM(s.local_path != ''), 0) AS with_file,
+                   COALESCE(SUM(s.local_path = '' AND s.dup_of = ''), 0) AS missing,
+                   COALESCE(SUM(s.dup_of != ''), 0) AS duplicates,
+                   COALESCE(SUM(s.bytes), 0) AS bytes
+            FROM taxa t LEFT JOIN selections s ON s.taxon_id = t.taxon_id
+            GROUP BY t.taxon_id ORDER BY selected DESC, t.taxon_id
+        """)
+        return [dict(r) for r in rows]
+
+    # --- выгрузка / импорт CSV ---
+    def export_csv(self, taxon_id: int) -> dict | None:
+        """selected.csv + species.csv в каталоге таксона (атомарно). None — таксона нет."""
+        t = self.taxon(taxon_id)
+        if not t or not t["dir"]:
+            return None
+        root = Path(t["dir"])
+        root.mkdir(parents=True, exist_ok=True)
+        rows = []
+        for r in self.selections(taxon_id).values():
+            rows.append({**{f: r.get(f, "") for f in SELECTED_FIELDS}, "taxon_id": str(taxon_id),
+                         "latin": t["latin"], "gbif_id": t["gbif_id"]})
+        _write_csv(root / "selected.csv", SELECTED_FIELDS, rows)
+        _write_csv(root / "species.csv", SPECIES_FIELDS, [{
+            "taxon_id": taxon_id, "latin": t["latin"], "common_en": t["common_en"], "common_ru": t["common_ru"],
+            "gbif_id": t["gbif_id"], "updated_at": t["updated_at"]}])
+        return {"taxon_id": taxon_id, "dir": root.as_posix(), "rows": len(rows), "version": t["version"]}
+
+    def import_legacy(self, root: Path) -> int:
+        """Разовый перенос <root>/<taxon>__<slug>/{species,selected}.csv для таксонов, которых ещё нет в БД."""
+        n = 0
+        for d in sorted(Path(root).glob("*__*")):
+            tid = d.name.split("__", 1)[0]
+            if not d.is_dir() or not tid.isdigit() or self.taxon(int(tid)):
+                continue
+            sp = (_read_csv(d / "species.csv") or [{}])[0]
+            sel = _read_csv(d / "selected.csv")
+            latin = sp.get("latin") or (sel[0].get("latin") if sel else "") or d.name.split("__", 1)[1]
+            with self.tx() as con:
+                con.execute("INSERT OR IGNORE INTO taxa (taxon_id, latin, common_en, common_ru, gbif_id, dir, updated_at)"
+                            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (int(tid), latin, sp.get("common_en") or "", sp.get("common_ru") or "",
+                             sp.get("gbif_id") or "", d.as_posix(), sp.get("updated_at") or ""))
+                for r in sel:
+                    pid = (r.get("photo_id") or "").strip()
+                    if not pid: continue
+                    self.upsert_meta(con, int(tid), pid, r)
+                    lp = r.get("local_path") or ""
+                    con.execute("UPDATE selections SET local_path=?, md5=?, src_md5=?, saved_at=?, file_idx=?, bytes=?"
+                                " WHERE taxon_id=? AND photo_id=?",
+                                (lp, r.get("md5") or "", r.get("src_md5") or "", r.get("saved_at") or "",
+                                 file_idx_of(lp), _size(lp), int(tid), pid))
+            n += 1
+        return n
+
+
+class _Tx:
+    def __init__(self, con: sqlite3.Connection):
+        self.con = con
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.con.execute("BEGIN IMMEDIATE")
+        return self.con
+
+    def __exit__(self, exc_type, *_):
+        self.con.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+def _size(path: str) -> int:
+    try:
+        return os.path.getsize(path) if path else 0
+    except OSError:
+        return 0
+
+
+def _read_csv(path: Path) -> list[dict]:
+    if not path.exists():
+        return []
+    for enc in ("utf-8-sig", "cp1251"):
+        try:
+            with path.open("r", newline="", encoding=enc) as f:
+                return [{(k or "").strip().lstrip("\ufeff").lower(): (v or "") for k, v in raw.items()}
+                        for raw in csv.DictReader(f)]
+        except UnicodeDecodeError:
+            continue
+    return []
+
+
+def _write_csv(path: Path, header: list[str], rows: list[dict]):
+    tmp = path.with_name(f"{path.name}.{threading.get_ident()}.{int(time.time() * 1000)}.tmp")
+    with tmp.open("w", newline="", encoding="utf-8") as f:
+        wr = csv.DictWriter(f, fieldnames=header, extrasaction="ignore")
+        wr.writeheader()
+        for r in rows: wr.writerow(r)
+    tmp.replace(path)
@@ -0,0 +1,237 @@
+import cProfile, io, itertools, json, pstats, re, threading, time
+from contextlib import contextmanager
+from pathlib import Path
+
+# ---- профилирование по запросу (следующие N подходящих запросов / фоновых задач) ----
+# app.wsgi_app оборачивается один раз и навсегда (middleware, навешанные позже, не теряются);
+# пока правил запросов нет, обёртка — одна проверка пустого списка, как и PROFILER.job() для задач.
+# Одновременно профилируется один запрос/задача (cProfile), остальные идут как обычно.
+
+RULE_TTL_SEC = 3600  # невыбранные правила истекают сами
+TOP_LINES = 40
+
+
+class _ProfiledBody:
+    """Тело ответа: профилируем и выдачу (потоковые ответы), дамп — при close()."""
+
+    def __init__(self, body, prof: cProfile.Profile, finish):
+        self._body, self._prof, self._finish = body, prof, finish
+        self._done = False
+
+    def _complete(self):
+        if not self._done:
+            self._done = True
+            self._finish()
+
+    def __iter__(self):
+        it = iter(self._body)
+        while True:
+            self._prof.enable()
+            try:
+                chunk = next(it)
+            except StopIteration:
+                self._prof.disable()
+                self._complete()  # дочитали — дамп сразу, не дожидаясь close()
+                return
+            self._prof.disable()
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self._body, "close"):
+                self._body.close()
+        finally:
+            self._complete()
+
+
+class Profiler:
+    def __init__(self):
+        self.dir: Path | None = None
+        self._lock = threading.Lock()
+        self._busy = threading.Lock()  # cProfile — по одному за раз
+        self._ids = itertools.count(1)
+        self._req_rules: list[dict] = []
+        self._job_rules: list[dict] = []
+        self._app = None
+        self._inner = None  # app.wsgi_app на момент install — то, что вызывает наша обёртка
+
+    # --- правила ---
+    def install(self, app):
+        if self._app is app:
+            return
+        self._app = app
+        self._inner = app.wsgi_app
+        app.wsgi_app = self._wsgi
+
+    def arm(self, kind: str, match: str, n: int = 1, ttl: int = RULE_TTL_SEC) -> dict:
+        """
+        kind="request": match — префикс пути (/api/spin/plants) или шаблон маршрута
+        (/api/spin/<path:dataset_rel>); kind="job": match — префикс «имя:метка»
+        (ensure_spin_cache, ensure_spin_cache:plants/rose, sync:12345).
+        """
+        if kind not in ("request", "job"):
+            raise ValueError("kind must be request or job")
+        if kind == "request" and self._app is None:
+            raise RuntimeError("profiler is not installed")
+        rule = {"id": next(self._ids), "kind": kind, "match": match, "left": max(1, int(n)),
+                "created": time.time(), "expires": time.time() + ttl, "dumps": []}
+        with self._lock:
+            (self._req_rules if kind == "request" else self._job_rules).append(rule)
+        return dict(rule)
+
+    def cancel(self, rule_id: int) -> bool:
+        with self._lock:
+            for rules in (self._req_rules, self._job_rules):
+                for r in rules:
+                    if r["id"] == rule_id:
+                        rules.remove(r)
+                        return True
+        return False
+
+    def rules(self) -> list[dict]:
+        with self._lock:
+            self._expire()
+            return [dict(r) for r in self._req_rules + self._job_rules]
+
+    def _expire(self):
+        now = time.time()
+        for rules in (self._req_rules, self._job_rules):
+            rules[:] = [r for r in rules if r["left"] > 0 and r["expires"] > now]
+
+    def _claim(self, rules: list, pred) -> dict | None:
+        with self._lock:
+            self._expire()
+            for r in rules:
+                if pred(r["match"]):
+                    r["left"] -= 1
+                    if r["left"] <= 0:
+                        self._expire()  # последнее — сразу снимаем правило
+                    return r
+        return None
+
+    def _unclaim(self, rule: dict):
+        with self._lock:
+            rule["left"] += 1
+            if rule not in self._req_rules and rule not in self._job_rules:
+                (self._req_rules if rule["kind"] == "request" else self._job_rules).append(rule)
+
+    # --- запросы ---
+    def _route_of(self, environ) -> str:
+        try:
+            rule, _ = self._app.url_map.bind_to_environ(environ).match(return_rule=True)
+            return rule.rule
+        except Exception:
+            return ""
+
+    def _wsgi(self, environ, start_response):
+        if not self._req_rules:  # выключено — сразу дальше
+            return self._inner(environ, start_response)
+        path = environ.get("PATH_INFO", "")
+        route = None
+
+        def pred(m):
+            nonlocal route
+            if "<" in m:
+                if route is None: route = self._route_of(environ)
+                return route == m
+            return path.startswith(m)
+
+        rule = self._claim(self._req_rules, pred)
+        if rule is None:
+            return self._inner(environ, start_response)
+        if not self._busy.acquire(blocking=False):
+            self._unclaim(rule)
+            return self._inner(environ, start_response)
+
+        status = [""]
+
+        def sr(st, headers, exc_info=None):
+            status[0] = st
+            return start_response(st, headers, exc_info)
+
+        prof = cProfile.Profile()
+        t0 = time.perf_counter()
+        qs = environ.get("QUERY_STRING", "")
+        info = {"kind": "request", "rule": rule["id"], "method": environ.get("REQUEST_METHOD", ""),
+                "path": path + (f"?{qs}" if qs else "")}
+
+        def finish():
+            try:
+                info["status"] = status[0]
+                info["ms"] = round((time.perf_counter() - t0) * 1000.0, 1)
+                self._dump(rule, prof, info, path)
+            finally:
+                self._busy.release()
+
+        try:
+            prof.enable()
+            try:
+                body = self._inner(environ, sr)
+            finally:
+                prof.disable()
+        except BaseException:
+            finish()
+            raise
+        return _ProfiledBody(body, prof, finish)
+
+    # --- фоновые задачи ---
+    @contextmanager
+    def job(self, name: str, tag: str = ""):
+        if not self._job_rules:  # выключено — ничего не делаем
+            yield
+            return
+        ident = f"{name}:{tag}" if tag else name
+        rule = self._claim(self._job_rules, lambda m: ident.startswith(m))
+        if rule is not None and not self._busy.acquire(blocking=False):
+            self._unclaim(rule)
+            rule = None
+        if rule is None:
+            yield
+            return
+        prof = cProfile.Profile()
+        t0 = time.perf_counter()
+        prof.enable()
+        try:
+            yield
+        finally:
+            prof.disable()
+            try:
+                self._dump(rule, prof, {"kind": "job", "rule": rule["id"], "job": ident,
+                                        "ms": round((time.perf_counter() - t0) * 1000.0, 1)}, ident)
+            finally:
+                self._busy.release()
+
+    # --- дампы ---
+    def _dump(self, rule: dict, prof: cProfile.Profile, info: dict, label: str):
+        if self.dir is None: return
+        self.dir.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9._-]+", "_", label).strip("_")[:60] or "root"
+        stem = f"{time.strftime('%Y%m%d-%H%M%S')}_{rule['id']}_{info['kind']}_{slug}_{next(self._ids)}"
+        prof.dump_stats(str(self.dir / f"{stem}.prof"))  # для snakeviz / pstats
+        buf = io.StringIO()
+        pstats.Stats(prof, stream=buf).sort_stats("cumulative").print_stats(TOP_LINES)
+        (self.dir / f"{stem}.txt").write_text(buf.getvalue(), encoding="utf-8")
+        info = dict(info, ts=round(time.time(), 3), files=[f"{stem}.prof", f"{stem}.txt"])
+        (self.dir / f"{stem}.json").write_text(json.dumps(info, ensure_ascii=False, indent=2), encoding="utf-8")
+        with self._lock:
+            rule["dumps"].append(stem)
+
+    def dumps(self) -> list[dict]:
+        if self.dir is None or not self.dir.is_dir(): return []
+        out = []
+        for p in sorted(self.dir.glob("*.json"), reverse=True):
+            try:
+                out.append(dict(json.loads(p.read_text(encoding="utf-8")), id=p.stem))
+            except Exception:
+                continue
+        return out
+
+    def dump_path(self, name: str) -> Path | None:
+        """Файл дампа по имени (только из каталога диагностики)."""
+        if self.dir is None or not re.fullmatch(r"[A-Za-z0-9._-]+\.(prof|txt|json)", name or ""):
+            return None
+        p = self.dir / name
+        return p if p.is_file() else None
+
+
+PROFILER = Profiler()
@@ -0,0 +1,66 @@
+from __future__ import annotations
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Замер в отдельном процессе: импорт app, затем время до /readyz == 200
+PROBE = r"""
+import sys, time, json
+t0 = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import app
+t_import = time.perf_counter()
+heavy = [m for m in ("PIL", "requests", "urllib3") if m in sys.modules]
+c = app.app.test_client()
+c.get("/healthz")
+while c.get("/readyz").status_code != 200 and time.perf_counter() - t0 < 120:
+    time.sleep(0.005)
+t_ready = time.perf_counter()
+print(json.dumps({"import_ms": (t_import - t0) * 1000, "ready_ms": (t_ready - t0) * 1000, "heavy": heavy}))
+"""
+
+
+def make_datasets(data_dir: Path, n: int):
+    """Синтетические наборы: n папок с парой «кадров»-заглушек в кэше."""
+    for i in range(n):
+        d = data_dir / "_cache" / "spin" / f"ds_{i:04d}"
+        d.mkdir(parents=True, exist_ok=True)
+        for k in range(3):
+            (d / f"{k:04d}.webp").write_bytes(b"RIFF\0\0\0\0WEBP")
+
+
+def run_once(work: Path, data_dir: Path) -> dict:
+    env = dict(os.environ, GALLERY_DATA_DIR=str(data_dir))
+    out = subprocess.run([sys.executable, "-c", PROBE, str(ROOT)], cwd=work, env=env,
+                         check=True, capture_output=True, text=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Холодный старт app.py: импорт и время до готовности")
+    ap.add_argument("-n", "--runs", type=int, default=5)
+    ap.add_argument("--datasets", type=int, default=200, help="синтетических наборов в DATA_DIR")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        work = Path(tmp)
+        data_dir = work / "data"
+        make_datasets(data_dir, args.datasets)
+        runs = [run_once(work, data_dir) for _ in range(args.runs)]
+
+    for key in ("import_ms", "ready_ms"):
+        vals = [r[key] for r in runs]
+        print(f"{key:10s} min {min(vals):8.1f}  median {statistics.median(vals):8.1f}  max {max(vals):8.1f}")
+    heavy = sorted({m for r in runs for m in r["heavy"]})
+    print(f"heavy modules at import:  {', '.join(heavy) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+from __future__ import annotations
+import argparse
+import json
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Статическая выгрузка галереи (каталог, манифесты, постеры, кадры) для nginx/CDN")
+    ap.add_argument("out_dir", help="каталог выгрузки (повторный запуск — инкрементальный)")
+    ap.add_argument("--prune", action="store_true", help="удалить файлы, на которые больше нет ссылок")
+    ap.add_argument("--grace", type=int, default=None, help="не удалять файлы моложе N секунд (по умолчанию сутки)")
+    args = ap.parse_args()
+
+    sys.path.insert(0, str(ROOT))
+    from static_export import export_static, PRUNE_GRACE_SEC
+
+    res = export_static(Path(args.out_dir), prune=args.prune,
+                        grace_sec=PRUNE_GRACE_SEC if args.grace is None else args.grace)
+    print(json.dumps(dict(res, out=args.out_dir), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+from __future__ import annotations
+import argparse
+import json
+import os
+import shutil
+import sys
+import urllib.error
+import urllib.parse
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def export_local(ids: list[str], out: str):
+    """Без сервера: читаем хранилище напрямую (GALLERY_DATA_DIR / config.json как у app.py)."""
+    sys.path.insert(0, str(ROOT))
+    from threed import export_zip
+
+    zs = export_zip(ids)
+    dst = sys.stdout.buffer if out == "-" else open(out + ".part", "wb")
+    try:
+        for chunk in zs:
+            dst.write(chunk)
+    finally:
+        if dst is not sys.stdout.buffer:
+            dst.close()
+    if out != "-":
+        os.replace(out + ".part", out)
+    return zs.size
+
+
+def export_remote(url: str, ids: list[str], out: str, resume: bool = True):
+    """
+    Качаем /api/export_zip. Недокачанный файл лежит в <out>.part, его ETag — в <out>.part.etag;
+    при повторном запуске продолжаем с места обрыва (Range + If-Range).
+    """
+    q = urllib.parse.urlencode([("dataset_id", ds) for ds in ids])
+    req = urllib.request.Request(f"{url.rstrip('/')}/api/export_zip?{q}")
+    part, etag_file = Path(out + ".part"), Path(out + ".part.etag")
+    have = part.stat().st_size if (resume and part.exists() and etag_file.exists()) else 0
+    if have:
+        req.add_header("Range", f"bytes={have}-")
+        req.add_header("If-Range", etag_file.read_text().strip())
+    try:
+        resp = urllib.request.urlopen(req)
+    except urllib.error.HTTPError as e:
+        if e.code == 416:  # уже всё скачано
+            os.replace(part, out)
+            etag_file.unlink(missing_ok=True)
+            return have
+        body = e.read().decode("utf-8", "replace")
+        raise SystemExit(f"[err] HTTP {e.code}: {body}")
+    with resp:
+        if resp.status != 206:
+            have = 0  # набор изменился или сервер отдал целиком — начинаем заново
+        etag_file.write_text(resp.headers.get("ETag", ""))
+        with open(part, "ab" if have else "wb") as f:
+            shutil.copyfileobj(resp, f, 256 * 1024)
+    os.replace(part, out)
+    etag_file.unlink(missing_ok=True)
+    return Path(out).stat().st_size
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Выгрузка наборов (кадры, модели, .meta.json) одним ZIP без сжатия")
+    ap.add_argument("dataset_id", nargs="+")
+    ap.add_argument("-o", "--out", default="export.zip", help="файл архива или «-» для stdout")
+    ap.add_argument("--url", help="адрес сервера (иначе — напрямую из хранилища)")
+    ap.add_argument("--no-resume", action="store_true", help="не продолжать недокачанный .part")
+    args = ap.parse_args()
+
+    try:
+        if args.url:
+            if args.out == "-":
+                raise SystemExit("[err] --url требует файл в --out (для докачки)")
+            size = export_remote(args.url, args.dataset_id, args.out, resume=not args.no_resume)
+        else:
+            size = export_local(args.dataset_id, args.out)
+    except KeyError as e:
+        raise SystemExit(f"[err] набор не найден: {e.args[0]}")
+    if args.out != "-":
+        print(json.dumps({"out": args.out, "bytes": size}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,16 @@
 from __future__ import annotations
+import argparse
 import csv
+import json
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from urllib.request import urlopen
 
 DATASET_DIRNAME = "dataset_collect"
+ROOT = Path(__file__).resolve().parent.parent
+RESCAN_WORKERS = 8
 
 
 def find_dataset_root(start: Path) -> Path | None:
@@ -16,55 +23,110 @@ def find_dataset_root(start: Path) -> Path | None:
     return None
 
 
-def count_rows(csv_path: Path) -> int:
-    """Количество строк (без заголовка) в selected.csv."""
+def scan_taxon(sub: Path) -> dict | None:
+    """Запись каталога по selected.csv одного таксона (для пересканирования без БД)."""
+    csv_path = sub / "selected.csv"
+    if not csv_path.is_file():
+        return None
+    selected = missing = size = 0
     try:
-        with csv_path.open("r", newline="", encoding="utf-8") as f:
-            rd = csv.reader(f)
-            # пропускаем заголовок
-            try:
-                header = next(rd)
-            except StopIteration:
-                return 0
-            # считаем оставшиеся
-            return sum(1 for _ in rd)
+        with csv_path.open("r", newline="", encoding="utf-8-sig") as f:
+            for row in csv.DictReader(f):
+                selected += 1
+                lp = (row.get("local_path") or "").strip()
+                try:
+                    size += os.path.getsize(lp) if lp else 0
+                except OSError:
+                    lp = ""
+                missing += 0 if lp else 1
     except Exception as e:
         print(f"[warn] не удалось прочитать {csv_path}: {e}", file=sys.stderr)
-        return 0
+        return None
+    tid, _, slug = sub.name.partition("__")  # каталоги вида <taxon_id>__<latin>
+    return {"taxon_id": int(tid) if tid.isdigit() else None, "dir": sub.as_posix(),
+            "latin": slug.replace("_", " "),
+            "selected": selected, "with_file": selected - missing, "missing": missing, "bytes": size,
+            "version": None, "last_sync": "", "last_failed": None}
+
+
+def rescan(root: Path) -> list[dict]:
+    subs = [p for p in sorted(root.iterdir()) if p.is_dir()]
+    with ThreadPoolExecutor(max_workers=RESCAN_WORKERS) as ex:
+        return [r for r in ex.map(scan_taxon, subs) if r]
+
+
+def from_db(root: Path) -> list[dict] | None:
+    db_path = root / "collect.sqlite"
+    if not db_path.is_file():
+        return None
+    sys.path.insert(0, str(ROOT))
+    from collectdb import CollectDB
+
+    try:
+        return CollectDB(db_path).catalog()
+    except Exception as e:
+        print(f"[warn] каталог {db_path} недоступен ({e}), пересканирую selected.csv", file=sys.stderr)
+        return None
+
+
+def from_server(url: str) -> list[dict]:
+    with urlopen(url.rstrip("/") + "/api/collect/stats", timeout=30) as r:
+        return json.load(r)["taxa"]
+
+
+def fmt_bytes(n: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
 
 
 def main():
-    # точка старта — директория этого файла (helpers/)
-    here = Path(__file__).resolve().parent
-    root = find_dataset_root(here)
-    if not root:
-        print(f"[err] Не найдена папка '{DATASET_DIRNAME}' выше {here}", file=sys.stderr)
-        sys.exit(1)
-
-    rows = []
-    for sub in sorted(root.iterdir()):
-        if not sub.is_dir():
-            continue
-        csv_path = sub / "selected.csv"
-        if not csv_path.is_file():
-            continue
-        n = count_rows(csv_path)
-        if n > 0:
-            rows.append((sub.name, n))
-
-    rows.sort(key=lambda x: x[1], reverse=True)
+    ap = argparse.ArgumentParser(description="Сводка по собранным таксонам (каталог collect.sqlite)")
+    ap.add_argument("--url", help="взять /api/collect/stats у запущенного сервера, напр. http://127.0.0.1:9013")
+    ap.add_argument("--rescan", action="store_true", help="не читать каталог, пересканировать selected.csv")
+    ap.add_argument("--json", action="store_true", help="вывести JSON")
+    ap.add_argument("-l", "--long", action="store_true", help="с объёмом на диске, числом без файла и последним sync")
+    args = ap.parse_args()
+
+    taxa, source = None, "rescan"
+    if args.url:
+        taxa, source = from_server(args.url), "server"
+    else:
+        # точка старта — директория этого файла (helpers/)
+        here = Path(__file__).resolve().parent
+        root = find_dataset_root(here)
+        if not root:
+            print(f"[err] Не найдена папка '{DATASET_DIRNAME}' выше {here}", file=sys.stderr)
+            sys.exit(1)
+        if not args.rescan:
+            taxa = from_db(root)
+            source = "db" if taxa is not None else source
+        if taxa is None:
+            taxa = rescan(root)
+
+    rows = sorted((t for t in taxa if t["selected"] > 0), key=lambda t: t["selected"], reverse=True)
+
+    if args.json:
+        totals = {"taxa": len(rows), **{k: sum(t[k] for t in rows) for k in ("selected", "with_file", "missing", "bytes")}}
+        print(json.dumps({"source": source, "taxa": rows, "totals": totals}, ensure_ascii=False, indent=1))
+        return
 
     if not rows:
         print("Нет таксонов с выбранными фото.")
         return
 
-    for name, n in rows:
-        print(f"{name}\t{n}")
+    for t in rows:
+        name = Path(t["dir"]).name if t["dir"] else str(t["taxon_id"])
+        line = f"{name}\t{t['selected']}"
+        if args.long:
+            line += f"\t{fmt_bytes(t['bytes'])}\tбез файла: {t['missing']}\t{t['last_sync'] or '-'}"
+        print(line)
 
     total_taxa = len(rows)
-    total_photos = sum(n for _, n in rows)
+    total_photos = sum(t["selected"] for t in rows)
     print("-" * 32)
-    print(f"Итог: {total_taxa} таксонов, {total_photos} фото")
+    print(f"Итог: {total_taxa} таксонов, {total_photos} фото, {fmt_bytes(sum(t['bytes'] for t in rows))}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,461 @@
+from __future__ import annotations
+import argparse
+import http.client
+import io
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Нагрузочный прогон «много зрителей»: поднимаем app.py на синтетическом DATA_DIR
+# (или бьём в готовый --url) и гоняем смесь сценариев виртуальными пользователями.
+#   grid   — /api/datasets + превью
+#   spin   — /api/spin/<id> и все кадры набора, по SPIN_CONC соединений на зрителя
+#   upload — загрузка небольшого ZIP, delete — удаление ранее загруженного
+# Итог: p50/p95/p99 по операциям, пропускная способность, ошибки, CPU/RSS сервера по времени.
+# Пороги (--max-p95 op=мс, --max-error-rate, --min-rps) — при нарушении код выхода 1.
+
+SERVER = r"""
+import sys, os
+sys.path.insert(0, sys.argv[1])
+import app
+from werkzeug.serving import make_server
+app.start_background()
+make_server("127.0.0.1", int(sys.argv[2]), app.app, threaded=True).serve_forever()
+"""
+
+DEFAULT_MIX = "grid=3,spin=6,upload=0.5,delete=0.5"
+SPIN_CONC = 6
+
+
+# ---- синтетические данные ----
+def _jpeg(w: int, h: int, seed: int) -> bytes:
+    from PIL import Image, ImageDraw
+
+    rnd = random.Random(seed)
+    im = Image.new("RGB", (w, h), (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)))
+    d = ImageDraw.Draw(im)
+    for _ in range(12):
+        x, y = rnd.randrange(w), rnd.randrange(h)
+        d.ellipse((x, y, x + w // 4, y + h // 4), fill=(rnd.randrange(256), rnd.randrange(256), 60))
+    buf = io.BytesIO()
+    im.save(buf, "JPEG", quality=85)
+    return buf.getvalue()
+
+
+def make_data_dir(data_dir: Path, datasets: int, frames: int, frame_w: int):
+    """Готовые webp-кэши (как после сборки): нагрузка — на отдачу, а не на кодирование."""
+    from PIL import Image
+
+    proto = []
+    for k in range(min(frames, 12)):
+        with Image.open(io.BytesIO(_jpeg(frame_w, frame_w * 3 // 4, k))) as im:
+            buf = io.BytesIO()
+            im.save(buf, "WEBP", quality=80, method=4)
+            proto.append(buf.getvalue())
+    for i in range(datasets):
+        d = data_dir / "_cache" / "spin" / f"ds_{i:04d}"
+        d.mkdir(parents=True, exist_ok=True)
+        for k in range(frames):
+            (d / f"{k:04d}.webp").write_bytes(proto[(i + k) % len(proto)])
+        meta = data_dir / f"ds_{i:04d}"
+        meta.mkdir(parents=True, exist_ok=True)
+        (meta / ".meta.json").write_text(json.dumps({"display_name": f"Набор {i}"}), encoding="utf-8")
+
+
+def make_upload_zip(frames: int) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as z:
+        for k in range(frames):
+            z.writestr(f"plant/{k:03d}.jpg", _jpeg(640, 480, 1000 + k))
+    return buf.getvalue()
+
+
+def _multipart(fields: dict, files: dict) -> tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    out = io.BytesIO()
+    for k, v in fields.items():
+        out.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode())
+    for k, (fname, data) in files.items():
+        out.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"; filename="{fname}"\r\n'
+                  f'Content-Type: application/zip\r\n\r\n'.encode())
+        out.write(data)
+        out.write(b"\r\n")
+    out.write(f"--{boundary}--\r\n".encode())
+    return out.getvalue(), f"multipart/form-data; boundary={boundary}"
+
+
+# ---- сбор метрик ----
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.lat: dict[str, list[float]] = {}
+        self.err: dict[str, int] = {}
+        self.bytes = 0
+        self.requests = 0
+
+    def add(self, op: str, ms: float, ok: bool, nbytes: int = 0, http_requests: int = 1):
+        with self._lock:
+            self.lat.setdefault(op, []).append(ms)
+            if not ok:
+                self.err[op] = self.err.get(op, 0) + 1
+            self.bytes += nbytes
+            self.requests += http_requests
+
+
+def _pct(vals: list[float], p: float) -> float:
+    if not vals: return 0.0
+    s = sorted(vals)
+    return s[min(len(s) - 1, int(round(p / 100.0 * (len(s) - 1))))]
+
+
+class Client:
+    """Keep-alive соединение, переподключение при обрыве."""
+
+    def __init__(self, host: str, port: int, timeout: float = 30.0):
+        self.host, self.port, self.timeout = host, port, timeout
+        self.conn = None
+
+    def request(self, method: str, path: str, body: bytes | None = None, headers: dict | None = None):
+        for attempt in (0, 1):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request(method, path, body=body, headers=headers or {})
+                resp = self.conn.getresponse()
+                data = resp.read()
+                return resp.status, data
+            except (http.client.HTTPException, ConnectionError, socket.timeout, OSError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+        raise RuntimeError("unreachable")
+
+
+class Viewer(threading.Thread):
+    def __init__(self, n: int, args, stats: Stats, stop: threading.Event, upload_zip: bytes, uploaded: list,
+                 up_lock: threading.Lock):
+        super().__init__(name=f"viewer-{n}", daemon=True)
+        self.args, self.stats, self.stop = args, stats, stop
+        self.rnd = random.Random(n)
+        self.main = Client(args.host, args.port)
+        self.frame_clients = [Client(args.host, args.port) for _ in range(SPIN_CONC)]
+        self.pool = ThreadPoolExecutor(SPIN_CONC, thread_name_prefix=f"v{n}-frames")
+        self.upload_zip, self.uploaded, self.up_lock = upload_zip, uploaded, up_lock
+        self.ops, self.weights = zip(*args.mix.items())
+        self.datasets: list[dict] = []
+
+    def _timed(self, op: str, fn):
+        t = time.perf_counter()
+        try:
+            ok, nbytes, n = fn()
+        except Exception:
+            ok, nbytes, n = False, 0, 1
+        self.stats.add(op, (time.perf_counter() - t) * 1000.0, ok, nbytes, n)
+        return ok
+
+    def grid(self):
+        def run():
+            st, body = self.main.request("GET", "/api/datasets")
+            if st != 200: return False, len(body), 1
+            # свои загрузки (lt_*) удаляются параллельно — 404 по ним не ошибка сервера
+            self.datasets = [d for d in json.loads(body) if d.get("mode") == "spin" and not d["id"].startswith("lt_")]
+            n, total = 1, len(body)
+            for d in self.datasets[:self.args.grid_thumbs]:
+                if d.get("thumb"):
+                    st2, b2 = self.main.request("GET", d["thumb"])
+                    n, total = n + 1, total + len(b2)
+                    if st2 != 200: return False, total, n
+            return True, total, n
+
+        self._timed("grid", run)
+
+    def _frame(self, idx: int, url: str):
+        t = time.perf_counter()
+        try:
+            st, body = self.frame_clients[idx % SPIN_CONC].request("GET", url)
+            ok = st == 200
+        except Exception:
+            ok, body = False, b""
+        self.stats.add("frame", (time.perf_counter() - t) * 1000.0, ok, len(body))
+        return ok
+
+    def spin(self):
+        if not self.datasets:
+            self.grid()
+            if not self.datasets: return
+        d = self.rnd.choice(self.datasets)
+
+        def run():
+            st, body = self.main.request("GET", f"/api/spin/{d['id']}")
+            if st != 200: return False, len(body), 1
+            urls = json.loads(body)
+            # каждый клиентский поток — своё keep-alive соединение (как 6 соединений браузера)
+            chunks = [urls[i::SPIN_CONC] for i in range(SPIN_CONC)]
+            futs = [self.pool.submit(lambda i=i, part=part: all([self._frame(i, u) for u in part]))
+                    for i, part in enumerate(chunks)]
+            return all(f.result() for f in futs), len(body), 1
+
+        self._timed("spin", run)
+
+    def upload(self):
+        ds = f"lt_{uuid.uuid4().hex[:10]}"
+        body, ctype = _multipart({"password": self.args.password, "dataset_id": ds},
+                                 {"zipfile": (f"{ds}.zip", self.upload_zip)})
+
+        def run():
+            st, resp = self.main.request("POST", "/api/upload_zip", body, {"Content-Type": ctype})
+            ok = st == 200 and json.loads(resp).get("ok")
+            if ok:
+                with self.up_lock:
+                    self.uploaded.append(ds)
+            return ok, len(body), 1
+
+        self._timed("upload", run)
+
+    def delete(self):
+        with self.up_lock:
+            if not self.uploaded: return
+            ds = self.uploaded.pop(self.rnd.randrange(len(self.uploaded)))
+        body = f"password={self.args.password}&dataset_id={ds}".encode()
+
+        def run():
+            st, resp = self.main.request("POST", "/api/delete_dataset", body,
+                                         {"Content-Type": "application/x-www-form-urlencoded"})
+            return st == 200, len(resp), 1
+
+        self._timed("delete", run)
+
+    def run(self):
+        while not self.stop.is_set():
+            getattr(self, self.rnd.choices(self.ops, self.weights)[0])()
+            if self.args.think_ms:
+                time.sleep(self.rnd.uniform(0, 2 * self.args.think_ms) / 1000.0)
+        self.pool.shutdown(wait=True)
+
+
+# ---- CPU/RSS сервера ----
+def _proc_sample(pid: int) -> tuple[float, int] | None:
+    """(суммарное CPU-время процесса в сек, RSS в байтах) из /proc; psutil — если есть."""
+    try:
+        import psutil
+
+        p = psutil.Process(pid)
+        t = p.cpu_times()
+        return t.user + t.system, p.memory_info().rss
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    try:
+        fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+        tick = os.sysconf("SC_CLK_TCK")
+        cpu = (int(fields[11]) + int(fields[12])) / tick
+        rss = int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+        return cpu, rss
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def sample_server(pid: int, stop: threading.Event, out: list, every: float = 1.0):
+    prev = _proc_sample(pid)
+    t_prev = time.perf_counter()
+    t0 = t_prev
+    while not stop.wait(every):
+        cur = _proc_sample(pid)
+        now = time.perf_counter()
+        if cur is None or prev is None:
+            prev, t_prev = cur, now
+            continue
+        out.append({"t": round(now - t0, 1), "cpu_pct": round(100.0 * (cur[0] - prev[0]) / (now - t_prev), 1),
+                    "rss_mb": round(cur[1] / 1024 / 1024, 1)})
+        prev, t_prev = cur, now
+
+
+# ---- запуск ----
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def boot_server(work: Path, data_dir: Path, port: int) -> subprocess.Popen:
+    env = dict(os.environ, GALLERY_DATA_DIR=str(data_dir))
+    proc = subprocess.Popen([sys.executable, "-c", SERVER, str(ROOT), str(port)], cwd=work, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    c = Client("127.0.0.1", port, timeout=2.0)
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"[err] сервер завершился с кодом {proc.returncode}")
+        try:
+            if c.request("GET", "/readyz")[0] == 200:
+                return proc
+        except OSError:
+            pass
+        time.sleep(0.1)
+    proc.kill()
+    raise SystemExit("[err] сервер не стал готов за 120 с")
+
+
+def _parse_kv(s: str) -> dict[str, float]:
+    out = {}
+    for part in filter(None, (s or "").split(",")):
+        k, _, v = part.partition("=")
+        out[k.strip()] = float(v)
+    return out
+
+
+def report(stats: Stats, elapsed: float, server: list) -> dict:
+    ops = {}
+    for op, vals in sorted(stats.lat.items()):
+        ops[op] = {
+            "n": len(vals), "errors": stats.err.get(op, 0),
+            "error_rate": round(stats.err.get(op, 0) / len(vals), 4),
+            "p50": round(_pct(vals, 50), 1), "p95": round(_pct(vals, 95), 1), "p99": round(_pct(vals, 99), 1),
+            "mean": round(statistics.fmean(vals), 1), "per_s": round(len(vals) / elapsed, 1),
+        }
+    n_ops = sum(len(v) for v in stats.lat.values())
+    n_err = sum(stats.err.values())
+    return {
+        "elapsed_s": round(elapsed, 1),
+        "http_requests": stats.requests, "rps": round(stats.requests / elapsed, 1),
+        "mb_per_s": round(stats.bytes / elapsed / 1024 / 1024, 2),
+        "error_rate": round(n_err / n_ops, 4) if n_ops else 0.0,
+        "ops": ops,
+        "server": {
+            "cpu_pct_max": max((s["cpu_pct"] for s in server), default=None),
+            "cpu_pct_mean": round(statistics.fmean(s["cpu_pct"] for s in server), 1) if server else None,
+            "rss_mb_max": max((s["rss_mb"] for s in server), default=None),
+            "timeline": server,
+        },
+    }
+
+
+def check_thresholds(rep: dict, args) -> list[str]:
+    fails = []
+    for op, limit in _parse_kv(args.max_p95).items():
+        got = rep["ops"].get(op, {}).get("p95")
+        if got is not None and got > limit:
+            fails.append(f"p95 {op}: {got} ms > {limit} ms")
+    for op, limit in _parse_kv(args.max_p99).items():
+        got = rep["ops"].get(op, {}).get("p99")
+        if got is not None and got > limit:
+            fails.append(f"p99 {op}: {got} ms > {limit} ms")
+    if args.max_error_rate is not None and rep["error_rate"] > args.max_error_rate:
+        fails.append(f"error rate {rep['error_rate']} > {args.max_error_rate}")
+    if args.min_rps is not None and rep["rps"] < args.min_rps:
+        fails.append(f"rps {rep['rps']} < {args.min_rps}")
+    if args.max_rss_mb is not None and (rep["server"]["rss_mb_max"] or 0) > args.max_rss_mb:
+        fails.append(f"rss {rep['server']['rss_mb_max']} MB > {args.max_rss_mb} MB")
+    return fails
+
+
+def print_report(rep: dict):
+    print(f"{'op':8s} {'n':>7s} {'err':>5s} {'p50':>8s} {'p95':>8s} {'p99':>8s} {'/s':>7s}")
+    for op, r in rep["ops"].items():
+        print(f"{op:8s} {r['n']:7d} {r['errors']:5d} {r['p50']:8.1f} {r['p95']:8.1f} {r['p99']:8.1f} {r['per_s']:7.1f}")
+    srv = rep["server"]
+    print(f"http: {rep['http_requests']} req, {rep['rps']} req/s, {rep['mb_per_s']} MB/s, errors {rep['error_rate']:.2%}")
+    if srv["timeline"]:
+        print(f"server: cpu mean {srv['cpu_pct_mean']}% max {srv['cpu_pct_max']}%, rss max {srv['rss_mb_max']} MB")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Нагрузочный прогон галереи: смесь зрителей, задержки, CPU/RSS, пороги")
+    ap.add_argument("--url", help="готовый сервер http://host:port (иначе поднимаем свой на синтетике)")
+    ap.add_argument("--pid", type=int, help="PID сервера для CPU/RSS при --url")
+    ap.add_argument("-u", "--users", type=int, default=20, help="одновременных зрителей")
+    ap.add_argument("-d", "--duration", type=float, default=30.0, help="секунд нагрузки")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help=f"веса сценариев (по умолчанию {DEFAULT_MIX})")
+    ap.add_argument("--think-ms", type=float, default=200.0, help="средняя пауза зрителя между действиями")
+    ap.add_argument("--datasets", type=int, default=50, help="синтетических наборов")
+    ap.add_argument("--frames", type=int, default=90, help="кадров в наборе")
+    ap.add_argument("--frame-w", type=int, default=1280)
+    ap.add_argument("--upload-frames", type=int, default=12)
+    ap.add_argument("--grid-thumbs", type=int, default=24, help="превью, которые грузит сетка")
+    ap.add_argument("--password", default="admin67")
+    ap.add_argument("--max-p95", default="", help="пороги p95, мс: frame=50,spin=3000")
+    ap.add_argument("--max-p99", default="", help="пороги p99, мс")
+    ap.add_argument("--max-error-rate", type=float, default=0.01)
+    ap.add_argument("--min-rps", type=float)
+    ap.add_argument("--max-rss-mb", type=float)
+    ap.add_argument("--json", help="записать отчёт в файл")
+    args = ap.parse_args()
+    args.mix = {k: v for k, v in _parse_kv(args.mix).items() if v > 0}
+    unknown = set(args.mix) - {"grid", "spin", "upload", "delete"}
+    if unknown:
+        ap.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        work = Path(tmp)
+        proc = None
+        if args.url:
+            from urllib.parse import urlparse
+
+            u = urlparse(args.url)
+            args.host, args.port = u.hostname, u.port or 80
+            pid = args.pid
+        else:
+            data_dir = work / "data"
+            t = time.perf_counter()
+            make_data_dir(data_dir, args.datasets, args.frames, args.frame_w)
+            print(f"synthetic data: {args.datasets} x {args.frames} frames in {time.perf_counter() - t:.1f}s")
+            args.host, args.port = "127.0.0.1", _free_port()
+            proc = boot_server(work, data_dir, args.port)
+            pid = proc.pid
+
+        stats, stop, server = Stats(), threading.Event(), []
+        sampler = None
+        if pid:
+            sampler = threading.Thread(target=sample_server, args=(pid, stop, server), daemon=True)
+            sampler.start()
+        upload_zip = make_upload_zip(args.upload_frames) if "upload" in args.mix else b""
+        uploaded, up_lock = [], threading.Lock()
+        viewers = [Viewer(i, args, stats, stop, upload_zip, uploaded, up_lock) for i in range(args.users)]
+        t0 = time.perf_counter()
+        for v in viewers:
+            v.start()
+        try:
+            time.sleep(args.duration)
+        except KeyboardInterrupt:
+            pass
+        stop.set()
+        for v in viewers:
+            v.join(timeout=60)
+        elapsed = time.perf_counter() - t0
+        if sampler:
+            sampler.join(timeout=2)
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    rep = report(stats, elapsed, server)
+    print_report(rep)
+    fails = check_thresholds(rep, args)
+    rep["failed"] = fails
+    if args.json:
+        Path(args.json).write_text(json.dumps(rep, ensure_ascii=False, indent=2), encoding="utf-8")
+    for f in fails:
+        print(f"[FAIL] {f}", file=sys.stderr)
+    sys.exit(1 if fails else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import threading
+
+# ---- общий HTTP-клиент: один requests.Session на процесс, keep-alive пулы по хостам ----
+# Соединения (и TLS-сессии) к API и static.inaturalist.org переживают запросы и sync'и.
+# Перед выдачей соединения из пула urllib3 проверяет, не закрыл ли его сервер (is_connection_dropped);
+# гонку «сервер закрыл прямо сейчас» закрывает Retry по connect/read. Счётчики: запросов
+# (попыток), установленных соединений; reused = запросы - соединения.
+
+
+class HttpClient:
+    def __init__(self, user_agent: str, pool_maxsize: int = 10, pool_hosts: int = 8):
+        self.user_agent = user_agent
+        self.pool_maxsize = pool_maxsize  # соединений на хост — не меньше параллельных запросов к нему
+        self.pool_hosts = pool_hosts  # сколько пулов (хостов) держать
+        self._lock = threading.Lock()
+        self._session = None
+        self._adapter = None
+        self.stats = {"requests": 0, "connections": 0}
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _build(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.connection import HTTPConnection, HTTPSConnection
+        from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+        from urllib3.util.retry import Retry
+
+        client = self
+
+        def counted(pool_cls, conn_cls):
+            class Conn(conn_cls):
+                def connect(self):
+                    client._count("connections")
+                    return super().connect()
+
+            class Pool(pool_cls):
+                ConnectionCls = Conn
+
+                def urlopen(self, *a, **k):
+                    client._count("requests")
+                    return super().urlopen(*a, **k)
+
+            return Pool
+
+        class Adapter(HTTPAdapter):
+            def init_poolmanager(self, *a, **k):
+                super().init_poolmanager(*a, **k)
+                self.poolmanager.pool_classes_by_scheme = {
+                    "http": counted(HTTPConnectionPool, HTTPConnection),
+                    "https": counted(HTTPSConnectionPool, HTTPSConnection),
+                }
+
+        s = requests.Session()
+        # только сетевые сбои; 429/5xx разбирает вызывающий вместе с RATE_LIMITER (паузы — общие на хост)
+        retries = Retry(total=3, connect=3, read=2, status=0, backoff_factor=0.5, allowed_methods=["GET"])
+        adapter = Adapter(max_retries=retries, pool_connections=self.pool_hosts, pool_maxsize=self.pool_maxsize)
+        s.mount("https://", adapter)
+        s.mount("http://", adapter)
+        s.headers.update({"User-Agent": self.user_agent})
+        return s, adapter
+
+    @property
+    def session(self):
+        s = self._session
+        if s is None:
+            with self._lock:
+                if self._session is None:
+                    self._session, self._adapter = self._build()
+                s = self._session
+        return s
+
+    def get(self, url: str, **kw):
+        return self.session.get(url, **kw)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            out = dict(self.stats)
+            adapter = self._adapter
+        out["reused"] = max(0, out["requests"] - out["connections"])
+        out["reuse_ratio"] = round(out["reused"] / out["requests"], 3) if out["requests"] else 0.0
+        out["pool_maxsize"] = self.pool_maxsize
+        pools = {}
+        if adapter is not None:
+            for key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                pools[f"{key.key_scheme}://{key.key_host}"] = {
+                    "idle": sum(1 for c in list(pool.pool.queue) if c is not None) if pool.pool is not None else 0,
+                    "opened": pool.num_connections, "requests": pool.num_requests}
+        out["pools"] = pools
+        return out
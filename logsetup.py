@@ -0,0 +1,174 @@
+import atexit, copy, json, logging, os, queue, random, threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+# ---- логирование: очередь + отдельный поток-писатель ----
+# Потоки запросов только кладут запись в очередь (без дисковых операций); файл пишет
+# QueueListener с ротацией. В файл — JSON по строке на запись, в консоль — обычный текст.
+# Поля из extra={...} (route, dataset, ms, status, ...) попадают в JSON как есть.
+# Высокочастотные события помечаются extra={"sample": "<вид>"} и прореживаются по cfg["sample"].
+# Лог медленных запросов (JSONL) — отдельный логгер SLOW_LOGGER со своей очередью и писателем.
+
+SLOW_LOGGER = "slow_requests"
+
+_STD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "sample"}
+_EXC_FMT = logging.Formatter()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        rec = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for k, v in record.__dict__.items():
+            if k not in _STD_ATTRS and not k.startswith("_"):
+                rec[k] = v
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            rec["exc"] = record.exc_text
+        return json.dumps(rec, ensure_ascii=False, default=str)
+
+
+class _RawFormatter(logging.Formatter):
+    """Сообщение как есть: строку JSON собирает вызывающий."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        return record.getMessage()
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускаем долю rates[вид] записей с атрибутом sample; WARNING и выше — всегда."""
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = {k: float(v) for k, v in (rates or {}).items()}
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        kind = getattr(record, "sample", None)
+        if kind is None or record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(kind, 1.0)
+        if rate >= 1.0 or random.random() < rate:
+            if rate < 1.0:
+                record.sample_rate = rate
+            return True
+        self.dropped += 1
+        return False
+
+
+class _AsyncHandler(QueueHandler):
+    """
+    Неблокирующий QueueHandler: очередь ограничена, при переполнении запись теряется
+    (и считается), а не тормозит запрос. Писатель запускается лениво и заново после fork.
+    """
+
+    def __init__(self, q: queue.Queue, handlers: list):
+        super().__init__(q)
+        self._handlers = handlers
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._listener = QueueListener(self.queue, *self._handlers, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # сообщение и трейсбек форматируем в потоке запроса (args могут измениться), extra-поля сохраняем
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = _EXC_FMT.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def stop(self):
+        with self._lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+            self._listener, self._pid = None, None
+
+
+_handler: _AsyncHandler | None = None
+_sampler: SamplingFilter | None = None
+_slow_handler: _AsyncHandler | None = None
+
+
+def setup_logging(cfg: dict | None = None) -> logging.Handler:
+    """
+    cfg — секция "log" из config.json:
+      file ("flask.log"), level ("INFO"), rotate ("size" | "time"), max_mb (20), backups (5),
+      when ("midnight"), queue_size (10000), sample ({"access": 1.0, ...}), access (true).
+    """
+    global _handler, _sampler
+    if _handler is not None:
+        return _handler
+    cfg = cfg or {}
+    path = cfg.get("file", "flask.log")
+    backups = int(cfg.get("backups", 5))
+    if cfg.get("rotate", "size") == "time":
+        fh = TimedRotatingFileHandler(path, when=cfg.get("when", "midnight"), backupCount=backups,
+                                      encoding="utf-8", delay=True)
+    else:
+        fh = RotatingFileHandler(path, maxBytes=int(float(cfg.get("max_mb", 20)) * 1024 * 1024),
+                                 backupCount=backups, encoding="utf-8", delay=True)
+    fh.setFormatter(JsonFormatter())
+    sh = logging.StreamHandler()
+    sh.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+
+    _sampler = SamplingFilter(cfg.get("sample") or {})
+    _handler = _AsyncHandler(queue.Queue(int(cfg.get("queue_size", 10000))), [fh, sh])
+    _handler.addFilter(_sampler)
+
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, str(cfg.get("level", "INFO")).upper(), logging.INFO))
+    root.addHandler(_handler)
+    if cfg.get("access", True):
+        # строки доступа пишет приложение (JSON с route/ms/status) — дубли werkzeug не нужны
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    atexit.register(_handler.stop)
+    return _handler
+
+
+def setup_slow_log(path, queue_size: int = 1000) -> logging.Logger:
+    """Логгер SLOW_LOGGER: строка на запрос в path; файл пишет свой поток, в общий лог не попадает."""
+    global _slow_handler
+    logger = logging.getLogger(SLOW_LOGGER)
+    if _slow_handler is not None:
+        return logger
+    fh = logging.FileHandler(path, encoding="utf-8", delay=True)
+    fh.setFormatter(_RawFormatter())
+    _slow_handler = _AsyncHandler(queue.Queue(queue_size), [fh])
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.addHandler(_slow_handler)
+    atexit.register(_slow_handler.stop)
+    return logger
+
+
+def log_stats() -> dict:
+    if _handler is None:
+        return {}
+    out = {"queued": _handler.queue.qsize(), "dropped_full": _handler.dropped,
+           "dropped_sampled": _sampler.dropped if _sampler else 0}
+    if _slow_handler is not None:
+        out["slow_queued"], out["slow_dropped"] = _slow_handler.queue.qsize(), _slow_handler.dropped
+    return out
@@ -0,0 +1,137 @@
+import threading, time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+# ---- допуск тяжёлой работы по памяти (конверсии изображений) ----
+# Бюджет — доля лимита памяти контейнера (cgroup v2/v1; без cgroup — MemTotal). Каждая конверсия
+# заранее резервирует оценку своих байт (по размерам картинки); не влезает — ждёт в очереди FIFO:
+# допускается только голова очереди, так крупные картинки не голодают за мелкими. Освобождение
+# будит очередь — без опроса и без gc.collect(). Если снаружи (другие процессы/код) памяти в
+# контейнере осталось меньше floor, бюджет сжимается до того, что реально свободно.
+# Картинка больше всего бюджета допускается одна, когда больше никого нет.
+
+_UNLIMITED = 1 << 60
+PRESSURE_RECHECK_SEC = 1.0  # ждём освобождения чужой памяти — перечитываем счётчики не чаще
+
+
+def _read_int(path: str) -> int | None:
+    try:
+        v = Path(path).read_text().strip()
+    except OSError:
+        return None
+    if v == "max":
+        return _UNLIMITED
+    try:
+        return int(v)
+    except ValueError:
+        return None
+
+
+def _meminfo() -> dict[str, int]:
+    out = {}
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                k, _, rest = line.partition(":")
+                parts = rest.split()
+                if parts:
+                    out[k] = int(parts[0]) * 1024  # kB -> байты
+    except (OSError, ValueError):
+        pass
+    return out
+
+
+def memory_limit() -> tuple[int, int]:
+    """(лимит, занято сейчас) в байтах: cgroup v2, cgroup v1, иначе /proc/meminfo."""
+    info = _meminfo()
+    total = info.get("MemTotal", 0)
+    for lim_p, cur_p in (("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current"),
+                         ("/sys/fs/cgroup/memory/memory.limit_in_bytes", "/sys/fs/cgroup/memory/memory.usage_in_bytes")):
+        lim, cur = _read_int(lim_p), _read_int(cur_p)
+        if lim is not None and cur is not None and (not total or lim < total):  # v1 без лимита — огромное число
+            return lim, cur
+    if total:
+        return total, total - info.get("MemAvailable", total)
+    return _UNLIMITED, 0
+
+
+class MemoryAdmission:
+    def __init__(self, fraction: float = 0.5, floor_bytes: int = 300 << 20, min_budget: int = 128 << 20):
+        limit, used = memory_limit()
+        self.limit = limit
+        self.floor = floor_bytes  # столько оставляем свободным в контейнере
+        self.budget = max(min_budget, int(min(limit - used, limit) * fraction))
+        self.reserved = 0
+        self._queue: deque = deque()
+        self._cv = threading.Condition()
+        self._pressure_checked = 0.0
+        self._external_cap = self.budget
+        self.stats = {"admitted": 0, "waited": 0, "wait_ms": 0.0, "max_wait_ms": 0.0, "oversize": 0,
+                      "max_queued": 0, "peak_reserved": 0}
+
+    def _cap(self) -> int:
+        """Бюджет с учётом чужой памяти; счётчики перечитываем не чаще PRESSURE_RECHECK_SEC."""
+        now = time.monotonic()
+        if now - self._pressure_checked >= PRESSURE_RECHECK_SEC:
+            self._pressure_checked = now
+            limit, used = memory_limit()
+            free = limit - used - self.floor
+            # наши резервы уже сидят в used — свободное к ним прибавляем
+            self._external_cap = max(0, min(self.budget, free + self.reserved))
+        return self._external_cap
+
+    def _fits(self, nbytes: int) -> bool:
+        if self.reserved == 0:
+            return True  # одна работа проходит всегда (иначе крупная картинка ждала бы вечно)
+        return self.reserved + nbytes <= self._cap()
+
+    def acquire(self, nbytes: int):
+        t0 = time.perf_counter()
+        waited = False
+        with self._cv:
+            ticket = object()
+            self._queue.append(ticket)
+            self.stats["max_queued"] = max(self.stats["max_queued"], len(self._queue))
+            try:
+                while self._queue[0] is not ticket or not self._fits(nbytes):
+                    waited = True
+                    # свою память отдаст release() и разбудит; чужую — увидим при перепроверке
+                    self._cv.wait(PRESSURE_RECHECK_SEC if self._queue[0] is ticket else None)
+            finally:
+                self._queue.remove(ticket)
+                self._cv.notify_all()  # следующая голова очереди
+            self.reserved += nbytes
+            st = self.stats
+            st["admitted"] += 1
+            st["peak_reserved"] = max(st["peak_reserved"], self.reserved)
+            if nbytes > self.budget:
+                st["oversize"] += 1
+            if waited:
+                ms = (time.perf_counter() - t0) * 1000.0
+                st["waited"] += 1
+                st["wait_ms"] += ms
+                st["max_wait_ms"] = max(st["max_wait_ms"], ms)
+
+    def release(self, nbytes: int):
+        with self._cv:
+            self.reserved -= nbytes
+            self._cv.notify_all()
+
+    @contextmanager
+    def reserve(self, nbytes: int):
+        self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+    def snapshot(self) -> dict:
+        with self._cv:
+            out = dict(self.stats, budget=self.budget, cap=self._external_cap, reserved=self.reserved,
+                       queued=len(self._queue), limit=self.limit if self.limit < _UNLIMITED else None)
+        w = out["waited"]
+        wait_ms = out.pop("wait_ms")
+        out["avg_wait_ms"] = round(wait_ms / w, 1) if w else 0.0
+        out["max_wait_ms"] = round(out["max_wait_ms"], 1)
+        return out
@@ -0,0 +1,148 @@
+import threading
+from io import BytesIO
+
+# ---- перцептивный хеш (dHash, 64 бита) и индекс для поиска по расстоянию Хэмминга ----
+# dHash: картинка -> серое 9x8, бит = «пиксель правее ярче левого». Пересжатие, даунскейл и
+# лёгкая цветокоррекция меняют единицы бит; другое фото — около половины из 64.
+# Индекс делит хеш на 8 полос по 8 бит: если расстояние ≤ 7, хотя бы одна полоса совпадает
+# точно (принцип Дирихле) — кандидаты берём только из корзин совпавших полос.
+
+HASH_BITS = 64
+_BANDS = 8
+_BAND_BITS = HASH_BITS // _BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+MAX_INDEXED_DIST = _BANDS - 1  # дальше индекс может пропустить совпадение
+
+
+def dhash(im) -> int:
+    """dHash картинки Pillow (любой режим/размер)."""
+    from PIL import Image
+
+    g = im.convert("L").resize((9, 8), Image.BOX)
+    try:
+        import numpy as np
+    except ImportError:
+        px = list(g.getdata())
+        h = 0
+        for y in range(8):
+            row = px[y * 9:(y + 1) * 9]
+            for x in range(8):
+                h = (h << 1) | (row[x + 1] > row[x])
+        return h
+    a = np.asarray(g, dtype=np.int16)
+    return int.from_bytes(np.packbits(a[:, 1:] > a[:, :-1]).tobytes(), "big")
+
+
+def dhash_bytes(data: bytes) -> int:
+    from PIL import Image
+
+    with Image.open(BytesIO(data)) as im:
+        im.draft("L", (64, 64))  # JPEG: декодируем сразу в уменьшенном виде
+        return dhash(im)
+
+
+def informative(h: int) -> bool:
+    """Почти однотонная картинка (или плавный градиент) даёт хеш из одних нулей/единиц — такие не сравниваем."""
+    return 4 <= h.bit_count() <= HASH_BITS - 4
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def to_hex(h: int) -> str:
+    return f"{h:016x}"
+
+
+def from_hex(s: str) -> int | None:
+    try:
+        return int(s, 16) if s else None
+    except ValueError:
+        return None
+
+
+class HashIndex:
+    """(taxon_id, photo_id) -> хеш; поиск ближайших по Хэммингу в таксоне или по всей коллекции."""
+
+    def __init__(self, loader=None):
+        self._lock = threading.Lock()
+        self._loader = loader  # loader() -> [(taxon_id, photo_id, хеш)], зовётся при первом обращении
+        self._hashes: dict[tuple[int, str], int] = {}
+        self._bands: list[dict[int, set]] = [{} for _ in range(_BANDS)]
+
+    def _ensure(self):
+        if self._loader is None:
+            return
+        rows = self._loader()
+        self._loader = None
+        for tid, pid, h in rows:
+            self._add(int(tid), str(pid), h)
+
+    def _add(self, tid: int, pid: str, h: int):
+        key = (tid, pid)
+        if key in self._hashes:
+            self._discard(key)
+        self._hashes[key] = h
+        for i in range(_BANDS):
+            self._bands[i].setdefault((h >> (i * _BAND_BITS)) & _BAND_MASK, set()).add(key)
+
+    def _discard(self, key: tuple[int, str]):
+        h = self._hashes.pop(key, None)
+        if h is None:
+            return
+        for i in range(_BANDS):
+            bucket = self._bands[i].get((h >> (i * _BAND_BITS)) & _BAND_MASK)
+            if bucket is not None:
+                bucket.discard(key)
+
+    def _near(self, h: int, max_dist: int, taxon_id: int | None, exclude=None) -> list[tuple[int, int, str]]:
+        seen: set = set()
+        out = []
+        for i in range(_BANDS):
+            for key in self._bands[i].get((h >> (i * _BAND_BITS)) & _BAND_MASK, ()):
+                if key in seen or key == exclude or (taxon_id is not None and key[0] != taxon_id):
+                    continue
+                seen.add(key)
+                d = hamming(h, self._hashes[key])
+                if d <= max_dist:
+                    out.append((d, key[0], key[1]))
+        out.sort()
+        return out
+
+    def add(self, taxon_id: int, photo_id: str, h: int):
+        with self._lock:
+            self._ensure()
+            self._add(int(taxon_id), str(photo_id), h)
+
+    def discard(self, taxon_id: int, photo_id: str):
+        with self._lock:
+            self._ensure()
+            self._discard((int(taxon_id), str(photo_id)))
+
+    def near(self, h: int, max_dist: int, taxon_id: int | None = None, exclude=None) -> list[tuple[int, int, str]]:
+        """[(расстояние, taxon_id, photo_id)] по возрастанию; max_dist не больше MAX_INDEXED_DIST."""
+        with self._lock:
+            self._ensure()
+            return self._near(h, min(max_dist, MAX_INDEXED_DIST), taxon_id, exclude)
+
+    def claim(self, taxon_id: int, photo_id: str, h: int, max_dist: int,
+              skip_same: bool = False) -> tuple[tuple | None, tuple | None]:
+        """
+        Атомарно: ближайший в своём таксоне и ближайший в чужих (каждый — (dist, taxon_id, photo_id)
+        или None) + регистрация хеша. При skip_same дубликат в своём таксоне не регистрируем (файла
+        у него не будет). Из двух одновременно пришедших копий дубликатом окажется ровно одна.
+        """
+        key = (int(taxon_id), str(photo_id))
+        with self._lock:
+            self._ensure()
+            hits = self._near(h, min(max_dist, MAX_INDEXED_DIST), None, exclude=key)
+            same = next((x for x in hits if x[1] == key[0]), None)
+            other = next((x for x in hits if x[1] != key[0]), None)
+            if not (skip_same and same is not None):
+                self._add(key[0], key[1], h)
+        return same, other
+
+    def __len__(self):
+        with self._lock:
+            self._ensure()
+            return len(self._hashes)
@@ -1,54 +1,82 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
-import csv, re, hashlib, os, time, glob, gc, re as _re
+import re, hashlib, json, os, time, glob, gc, uuid
 from io import BytesIO
+from tempfile import SpooledTemporaryFile
 from pathlib import Path
 from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
-from threading import Lock, BoundedSemaphore
+from threading import Lock, BoundedSemaphore, Condition, Thread
+from concurrent.futures import ThreadPoolExecutor, Future
 
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-from PIL import Image, ImageOps, ImageFile
+from flask import Blueprint, Response, jsonify, request, render_template, session
 
-from flask import Blueprint, jsonify, request, render_template
+from apicache import ResponseCache, cache_key
+from collectdb import CollectDB, META_FIELDS
+from diagnostics import PROFILER
+from httpclient import HttpClient
+from memguard import MemoryAdmission
+from phash import HashIndex, dhash, dhash_bytes, from_hex, informative, to_hex
+from ratelimit import RateLimiter
+from taxindex import TaxonIndex
+from timing import timed
 
 try:
-    from picker_profile import record_change_for_request_user
+    from picker_profile import record_change_for_user
 except Exception:
-    def record_change_for_request_user(*_, **__):
+    def record_change_for_user(*_, **__):
         pass
 
-# Pillow: не падать на обрезанных файлах
-ImageFile.LOAD_TRUNCATED_IMAGES = True
-try:
-    # жёсткая защита от гигантских изображений (без ENV)
-    Image.MAX_IMAGE_PIXELS = 30_000_000
-except Exception:
-    pass
-
 # ===================== Константы/пути =====================
 DATASET_OUT_DIR = Path("dataset_collect")
-DATASET_OUT_DIR.mkdir(parents=True, exist_ok=True)
-TMP_DIR = DATASET_OUT_DIR / "_tmp"  # для потоковых загрузок
-TMP_DIR.mkdir(parents=True, exist_ok=True)
+TMP_DIR = DATASET_OUT_DIR / "_tmp"  # сюда сливаются лишь крупные загрузки (SpooledTemporaryFile)
 
 UA = "PlantPicker/1.3 (python-requests)"
 GBIF_SPECIES_API = "https://api.gbif.org/v1/species/{key}"
 INAT_TAXA_API = "https://api.inaturalist.org/v1/taxa"
 INAT_OBS_API = "https://api.inaturalist.org/v1/observations"
 
+# кэш ответов API: префикс URL -> (ttl, stale-while-revalidate), сек
+API_CACHE_TTL = {
+    INAT_OBS_API: (600, 3600),  # выдача наблюдений меняется — 10 мин свежая, ещё час отдаём и обновляем
+    INAT_TAXA_API: (7 * 86400, 30 * 86400),
+    GBIF_SPECIES_API.split("{")[0]: (30 * 86400, 60 * 86400),
+}
+API_CACHE = ResponseCache(DATASET_OUT_DIR / "_cache" / "api.sqlite", mem_items=512)
+COLLECT_DB = CollectDB(DATASET_OUT_DIR / "collect.sqlite", legacy_root=DATASET_OUT_DIR)  # таксоны/выбор/файлы
+TAXON_INDEX = TaxonIndex(DATASET_OUT_DIR / "_cache" / "taxa.sqlite", seed_root=DATASET_OUT_DIR)
+INAT_OBS_WINDOW = 200  # наблюдений за один запрос к iNat (максимум API); страницы клиента — срезы окна
+RESOLVE_CONCURRENCY = 8  # одновременно сетевых резолвов в /resolve_taxa
+RESOLVE_BATCH_MAX = 1000
+DEDUP_MODE = "flag"  # похожие фото: "flag" — только помечаем, "skip" — в своём таксоне не качаем, "off"
+DEDUP_MAX_DIST = 6  # порог расстояния Хэмминга между dHash (из 64 бит)
+PHASH_INDEX = HashIndex(loader=lambda: [(t, p, h) for t, p, x in COLLECT_DB.hashes()
+                                        if (h := from_hex(x)) is not None and informative(h)])
+
 # --------- ЖЁСТКО ЗАДАННЫЕ ЛИМИТЫ (без окружения) ----------
-COLLECT_CONCURRENCY = 1  # одновременно /collect/sync
-WEBP_CONCURRENCY = 1  # одновременно конверсий WebP
+COLLECT_CONCURRENCY = 1  # одновременно выполняемых sync-задач (разные таксоны)
+DOWNLOAD_CONCURRENCY = 6  # одновременно загрузок в одном sync (ждём сеть, CPU почти не тратим)
+WEBP_CONCURRENCY = max(1, min(4, (os.cpu_count() or 2) - 1))  # одновременно конверсий WebP
+PIPELINE_AHEAD = DOWNLOAD_CONCURRENCY + 2 * WEBP_CONCURRENCY  # фото «в полёте» впереди записи
 WEBP_METHOD = 3  # быстрее и экономнее CPU, чем 6
 WEBP_QUALITY = 80  # компромисс качество/размер
 MAX_WEBP_SIDE = 1400  # даунскейл по длинной стороне
-MEM_MIN_FREE_MB = 300  # если свободно меньше — ждём
-MEM_CHECK_EVERY = 5  # каждые N изображений — GC
+MEM_MIN_FREE_MB = 300  # столько памяти контейнера оставляем свободной
+MEM_BUDGET_FRACTION = 0.5  # бюджет конверсий — доля свободной к первой конверсии памяти (лимит cgroup)
+CONVERT_COPIES = 3  # копий декодированной картинки при конверсии: декод, поворот по EXIF, convert
+SPOOL_MAX_BYTES = 8 * 1024 * 1024  # загрузка до стольких байт держится в памяти, больше — во временном файле
+HTTP_ATTEMPTS = 4  # попыток http_json при 429/5xx (ждать между ними — дело RATE_LIMITER)
+# хост -> (запросов в секунду, запас, макс. одновременно). iNat API просит ≤ 60/мин (жёстко — 100/мин);
+# фото с static/open-data они не лимитируют так строго, но просят не качать лавиной.
+RATE_LIMITS = {
+    "api.inaturalist.org": (1.0, 10, 4),
+    "api.gbif.org": (10.0, 20, 8),
+    "static.inaturalist.org": (10.0, 20, DOWNLOAD_CONCURRENCY),
+    "inaturalist-open-data.s3.amazonaws.com": (10.0, 20, DOWNLOAD_CONCURRENCY),
+}
+# ведро общее для всех процессов (несколько воркеров сервера, фоновые скрипты)
+RATE_LIMITER = RateLimiter(RATE_LIMITS, shared_path=DATASET_OUT_DIR / "_cache" / "ratelimit.sqlite")
 
-_collect_sem = BoundedSemaphore(COLLECT_CONCURRENCY)
 _webp_sem = BoundedSemaphore(WEBP_CONCURRENCY)
 
 # ===================== Flask Blueprints ====================
@@ -66,114 +94,114 @@ def _log(*a, **k):
 
 def init_picker(app):
     DATASET_OUT_DIR.mkdir(parents=True, exist_ok=True)
+    TMP_DIR.mkdir(parents=True, exist_ok=True)
 
 
-# ===================== Страница ============================
-@picker_page_bp.route("/picker")
-def picker_page():
-    return render_template("picker.html")
-
+def _pil():
+    """Pillow импортируем лениво — не тянем его при старте приложения."""
+    from PIL import Image, ImageOps, ImageFile
 
-# ===================== HTTP сессии (ротация/сброс) =========
-SESSION_LIMIT = 50
-_session_lock: Lock = Lock()
-_SESSION: Optional[requests.Session] = None
-_SESSION_USES: int = 0
+    # Pillow: не падать на обрезанных файлах
+    ImageFile.LOAD_TRUNCATED_IMAGES = True
+    # жёсткая защита от гигантских изображений (без ENV)
+    Image.MAX_IMAGE_PIXELS = 30_000_000
+    return Image, ImageOps
 
 
-def _build_session() -> requests.Session:
-    s = requests.Session()
-    retries = Retry(
-        total=5,
-        backoff_factor=1.2,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["GET"],
-        respect_retry_after_header=True,
-    )
-    # умеренные пулы: не бурстим сетью и не плодим объекты
-    adapter = HTTPAdapter(max_retries=retries, pool_connections=8, pool_maxsize=16)
-    s.mount("https://", adapter)
-    s.headers.update({"User-Agent": UA})
-    return s
+def warm_picker():
+    """Прогрев тяжёлых импортов (requests/urllib3/Pillow) вне потока запроса."""
+    HTTP.session  # noqa: B018 — импорт requests/urllib3 и сборка пулов
+    _pil()
+    try:
+        TAXON_INDEX.count()  # сидирование индекса из species.csv — тоже здесь, а не в первом резолве
+    except Exception:
+        pass
 
 
-def _get_session() -> requests.Session:
-    global _SESSION, _SESSION_USES
-    with _session_lock:
-        if _SESSION is None or _SESSION_USES >= SESSION_LIMIT:
-            _SESSION = _build_session()
-            _SESSION_USES = 0
-        _SESSION_USES += 1
-        return _SESSION
+# ===================== Страница ============================
+@picker_page_bp.route("/picker")
+def picker_page():
+    return render_template("picker.html")
 
 
-def _reset_http_session():
-    global _SESSION, _SESSION_USES
-    with _session_lock:
-        _SESSION = None
-        _SESSION_USES = 0
+# ===================== HTTP клиент =========================
+# Один на процесс и без сбросов: keep-alive/TLS к хостам переживают запросы и sync'и.
+# Пул на хост — под самый параллельный хост (загрузки фото), чтобы соединения не выбрасывались.
+HTTP = HttpClient(UA, pool_maxsize=max(c for _, _, c in RATE_LIMITS.values()) + 2)
 
 
 # ===================== RAM guard ===========================
-def _mem_available_mb() -> int:
-    """Читаем свободную память из /proc/meminfo (Linux)."""
-    try:
-        with open("/proc/meminfo", "r") as f:
-            for line in f:
-                if line.startswith("MemAvailable:"):
-                    parts = line.split()
-                    return int(parts[1]) // 1024  # kB -> MB
-    except Exception:
-        pass
-    return 1024  # если непонятно — считаем, что достаточно
+# Конверсии резервируют оценку своей памяти в _memory() и ждут в очереди, пока не влезут в бюджет.
+# Бюджет считается при первой конверсии, а не при импорте: к тому времени загружены индексы и кеши
+# процесса, и свободная память — та, что реально останется конверсиям.
+_memory_lock = Lock()
+_MEMORY: Optional[MemoryAdmission] = None
 
 
-def _wait_mem():
-    """Если свободно мало RAM — ждём и пробуем ещё."""
-    tries = 0
-    while _mem_available_mb() < MEM_MIN_FREE_MB and tries < 240:  # до ~60 сек при 250ms шагах
-        gc.collect()
-        time.sleep(0.25)
-        tries += 1
+def _memory() -> MemoryAdmission:
+    global _MEMORY
+    with _memory_lock:
+        if _MEMORY is None:
+            _MEMORY = MemoryAdmission(fraction=MEM_BUDGET_FRACTION, floor_bytes=MEM_MIN_FREE_MB << 20)
+        return _MEMORY
 
 
-# ===================== HTTP helpers ========================
-def http_json(url: str, params: Optional[dict] = None, timeout: int = 60) -> dict:
-    s = _get_session()
-    r = s.get(url, params=params, timeout=timeout)
-    try:
-        r.raise_for_status()
-    except requests.HTTPError:
-        if r.status_code == 429:
-            wait = int(r.headers.get("Retry-After", "1") or 1)
-            time.sleep(max(1, wait))
-            s = _get_session()
-            r = s.get(url, params=params, timeout=timeout)
-            r.raise_for_status()
-        else:
-            raise
-    return r.json()
+def _convert_cost(w: int, h: int) -> int:
+    """Байт на конверсию картинки w×h (после draft): RGB(A) у Pillow — 4 байта на пиксель."""
+    return w * h * 4 * CONVERT_COPIES + MAX_WEBP_SIDE * MAX_WEBP_SIDE * 4
 
 
-def http_download_to_tmp(url: str, stem: str) -> Optional[Path]:
-    """Скачиваем в файл потоком, без хранения всего в памяти. Возвращаем путь или None."""
+# ===================== HTTP helpers ========================
+@timed("http_json")
+def http_json(url: str, params: Optional[dict] = None, timeout: int = 60) -> dict:
+    for attempt in range(HTTP_ATTEMPTS):
+        with RATE_LIMITER.slot(url) as slot:
+            r = HTTP.get(url, params=params, timeout=timeout)
+            slot.status, slot.retry_after = r.status_code, r.headers.get("Retry-After")
+        if r.status_code == 429 or r.status_code >= 500:
+            if attempt + 1 < HTTP_ATTEMPTS:
+                if r.status_code != 429:  # на 429 хост уже на паузе в RATE_LIMITER
+                    time.sleep(0.5 * 2 ** attempt)
+                continue
+        r.raise_for_status()  # последняя попытка с 429/5xx — тоже сюда
+        return r.json()
+
+
+def cached_json(url: str, params: Optional[dict] = None, timeout: int = 60) -> dict:
+    """http_json через API_CACHE (TTL по префиксу URL); неизвестные URL — напрямую."""
+    for prefix, (ttl, swr) in API_CACHE_TTL.items():
+        if url.startswith(prefix):
+            return API_CACHE.get_or_fetch(cache_key(url, params), lambda: http_json(url, params, timeout),
+                                          ttl=ttl, swr=swr)
+    return http_json(url, params=params, timeout=timeout)
+
+
+@timed("download")
+def http_download_spooled(url: str) -> Optional[Tuple[SpooledTemporaryFile, str]]:
+    """
+    Тело ответа потоком в SpooledTemporaryFile (в памяти до SPOOL_MAX_BYTES) с попутным md5
+    исходника. Возвращаем (буфер на позиции 0, md5) или None; буфер закрывает вызывающий.
+    """
+    buf = SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, dir=TMP_DIR)
     try:
-        s = _get_session()
-        with s.get(url, timeout=30, stream=True) as r:
+        h = hashlib.md5()
+        with RATE_LIMITER.slot(url) as slot, HTTP.get(url, timeout=30, stream=True) as r:
+            slot.status, slot.retry_after = r.status_code, r.headers.get("Retry-After")
             r.raise_for_status()
-            tmp = TMP_DIR / f"{stem}_{int(time.time() * 1000)}.bin"
-            with open(tmp, "wb") as out:
-                for chunk in r.iter_content(chunk_size=64 * 1024):
-                    if chunk:
-                        out.write(chunk)
-            return tmp
+            for chunk in r.iter_content(chunk_size=64 * 1024):
+                if chunk:
+                    h.update(chunk)
+                    buf.write(chunk)
+        buf.seek(0)
+        return buf, h.hexdigest()
     except Exception:
+        buf.close()
         return None
 
 
 # ===================== Внешние API =========================
 def gbif_to_latin(gbif_id: str) -> str:
-    js = http_json(GBIF_SPECIES_API.format(key=gbif_id), timeout=30)
+    js = cached_json(GBIF_SPECIES_API.format(key=gbif_id), timeout=30)
     latin = js.get("canonicalName") or js.get("scientificName")
     if not latin:
         raise ValueError("GBIF did not return canonical name")
@@ -181,18 +209,21 @@ def gbif_to_latin(gbif_id: str) -> str:
 
 
 def inat_taxon_by_id(tid: int) -> Optional[dict]:
-    js = http_json(f"{INAT_TAXA_API}/{tid}", timeout=30)
+    js = cached_json(f"{INAT_TAXA_API}/{tid}", timeout=30)
     res = js.get("results", [])
     return res[0] if res else None
 
 
 def inat_taxon_by_query(q: str) -> Optional[dict]:
-    js = http_json(INAT_TAXA_API, params={"q": q, "rank": "species", "per_page": 1}, timeout=30)
+    js = cached_json(INAT_TAXA_API, params={"q": q, "rank": "species", "per_page": 1}, timeout=30)
     res = js.get("results", [])
     return res[0] if res else None
 
 
 def _resolve_species_dir(taxon_id: int) -> Optional[Path]:
+    t = COLLECT_DB.taxon(taxon_id)
+    if t and t["dir"]:
+        return Path(t["dir"])
     pat = str(DATASET_OUT_DIR / f"{taxon_id}__*")
     hits = sorted(glob.glob(pat))
     return Path(hits[0]) if hits else None
@@ -227,23 +258,30 @@ def slugify_latin(name: str) -> str:
 
 
 # -------- WEBP --------
-def file_to_webp_bytes(src: Path) -> bytes:
-    """Открываем файл, даунскейлим, сохраняем в WEBP (в память уже сжатым)."""
+def file_to_webp_bytes(src) -> bytes:
+    """Открываем файл (путь или file-like), даунскейлим, сохраняем в WEBP (в память уже сжатым)."""
+    return _to_webp(src)[0]
+
+
+@timed("convert")
+def _to_webp(src, with_hash: bool = False) -> Tuple[bytes, Optional[int]]:
+    """(webp-байты, dHash уменьшенной картинки | None) — хеш заодно, пока картинка в памяти."""
+    Image, ImageOps = _pil()
     with _webp_sem:  # лимитируем параллелизм
-        _wait_mem()  # дождёмся свободной RAM
         with Image.open(src) as im:
-            im = ImageOps.exif_transpose(im)
-            try:
+            try:  # до декодирования: JPEG сразу в уменьшенном виде
                 im.draft("RGB", (MAX_WEBP_SIDE * 2, MAX_WEBP_SIDE * 2))
             except Exception:
                 pass
-            if im.mode not in ("RGB", "RGBA"):
-                im = im.convert("RGB")
-            # даунскейл по длинной стороне
-            im.thumbnail((MAX_WEBP_SIDE, MAX_WEBP_SIDE))
-            buf = BytesIO()
-            im.save(buf, format="WEBP", quality=WEBP_QUALITY, method=WEBP_METHOD)
-            return buf.getvalue()
+            with _memory().reserve(_convert_cost(*im.size)):  # размеры известны из заголовка
+                im = ImageOps.exif_transpose(im)
+                if im.mode not in ("RGB", "RGBA"):
+                    im = im.convert("RGB")
+                # даунскейл по длинной стороне
+                im.thumbnail((MAX_WEBP_SIDE, MAX_WEBP_SIDE))
+                buf = BytesIO()
+                im.save(buf, format="WEBP", quality=WEBP_QUALITY, method=WEBP_METHOD)
+                return buf.getvalue(), dhash(im) if with_hash else None
 
 
 def convert_file_to_webp(path: Path) -> Tuple[Path, str]:
@@ -262,51 +300,84 @@ def convert_file_to_webp(path: Path) -> Tuple[Path, str]:
         return path, ""
 
 
-def _next_image_index(images_dir: Path) -> int:
-    mx = -1
-    pat = _re.compile(r"^(\d{6})_")
-    for p in images_dir.glob("*.webp"):
-        m = pat.match(p.name)
-        if m:
-            try:
-                mx = max(mx, int(m.group(1)))
-            except ValueError:
-                pass
-    return (mx + 1) if mx >= 0 else 0
+# ===================== Конвейер загрузка → WebP ==========
+# Загрузки идут в своём пуле, конверсия — в пуле размером WEBP_CONCURRENCY; результаты
+# забираются строго в порядке постановки, поэтому индексы файлов и строки CSV те же, что
+# при последовательной обработке. Вперёд ставим не больше PIPELINE_AHEAD фото — в памяти
+# одновременно лишь несколько загрузок (каждая ≤ SPOOL_MAX_BYTES) и готовых WebP; память
+# декодирования каждая конверсия резервирует в _memory().
+_pools_lock = Lock()
+_dl_pool: Optional[ThreadPoolExecutor] = None
+_cv_pool: Optional[ThreadPoolExecutor] = None
 
 
-# ===================== CSV helpers ========================
-def read_selected_csv(csv_path: Path) -> Dict[str, Dict[str, str]]:
-    data: Dict[str, Dict[str, str]] = {}
-    if not csv_path.exists():
-        return data
+def _pipeline_pools() -> Tuple[ThreadPoolExecutor, ThreadPoolExecutor]:
+    global _dl_pool, _cv_pool
+    with _pools_lock:
+        if _dl_pool is None:
+            _dl_pool = ThreadPoolExecutor(DOWNLOAD_CONCURRENCY, thread_name_prefix="pp-dl")
+            _cv_pool = ThreadPoolExecutor(WEBP_CONCURRENCY, thread_name_prefix="pp-webp")
+        return _dl_pool, _cv_pool
 
-    def _read(enc: str):
-        with csv_path.open("r", newline="", encoding=enc, errors="strict" if enc == "utf-8-sig" else "ignore") as f:
-            rd = csv.DictReader(f)
-            for raw in rd:
-                row = {(k or "").strip().lstrip("\ufeff").lower(): (v or "") for k, v in raw.items()}
-                pid = row.get("photo_id")
-                if pid:
-                    data[pid] = row
 
+def _convert_buf(buf: SpooledTemporaryFile, src_md5: str, pid: str, progress, sc) -> Optional[tuple]:
     try:
-        _read("utf-8-sig")
-    except UnicodeDecodeError:
-        _read("cp1251")
-    return data
+        webp, h = _to_webp(buf, with_hash=sc is None)
+        if progress: progress("converted", pid)
+        return (webp, src_md5, h, None) if sc is None else (webp, src_md5, sc[0], sc[1])
+    except Exception:
+        return None
+    finally:
+        buf.close()
+
+
+def _download_stage(url: str, pid: str, cv_pool: ThreadPoolExecutor, progress, screen) -> Optional[Future]:
+    sc = screen(pid) if screen else (None, "", False)  # None — хеш посчитать при конверсии
+    if sc is not None and sc[2]:  # похожее фото уже есть — полноразмерное не качаем
+        done = Future()
+        done.set_result((None, "", sc[0], sc[1]))
+        return done
+    got = http_download_spooled(url)
+    if got is None:
+        return None
+    if progress: progress("downloaded", pid)
+    return cv_pool.submit(_convert_buf, got[0], got[1], pid, progress, sc)
 
 
-def write_selected_csv(csv_path: Path, rows: List[Dict[str, str]]):
-    header = ["taxon_id", "latin", "gbif_id", "photo_id", "observation_id", "license", "attribution", "best_url",
-              "local_path", "md5", "width", "height", "observed_on", "time_observed_at", "user_login",
-              "place_guess", "quality_grade", "saved_at"]
-    tmp = csv_path.with_suffix(".tmp")
-    with tmp.open("w", newline="", encoding="utf-8") as f:
-        wr = csv.DictWriter(f, fieldnames=header);
-        wr.writeheader()
-        for r in rows: wr.writerow(r)
-    tmp.replace(csv_path)
+def fetch_webp_ordered(jobs: List[Tuple[str, str]], progress=None, screen=None):
+    """
+    jobs — [(photo_id, url)]; выдаёт (photo_id, результат | None) в том же порядке, результат —
+    (webp-байты | None, md5 исходника, dHash | None, dup_of | None). Пустой url — сразу None.
+    Генератор можно бросить на середине: остаток доработает и закроет буферы.
+    progress(kind, photo_id) — kind: "downloaded" / "converted" (зовётся из потоков пулов).
+    screen(photo_id) -> (dHash, dup_of, пропустить) | None — проверка до загрузки (по превью);
+    None — хеш считается при конверсии, dup_of в результате тогда None. Без screen хеша нет.
+    """
+    dl_pool, cv_pool = _pipeline_pools()
+    pending: List[Tuple[str, Optional[Future]]] = []
+    it = iter(jobs)
+
+    def fill():
+        while len(pending) < PIPELINE_AHEAD:
+            nxt = next(it, None)
+            if nxt is None:
+                return
+            pid, url = nxt
+            pending.append((pid, dl_pool.submit(_download_stage, url, pid, cv_pool, progress, screen)
+                                if url else None))
+
+    fill()
+    while pending:
+        pid, fut = pending.pop(0)
+        res = None
+        if fut is not None:
+            try:
+                cv = fut.result()
+                res = cv.result() if cv is not None else None
+            except Exception:
+                res = None
+        fill()
+        yield pid, res
 
 
 # ===================== API: прочитать выбранные ===========
@@ -315,39 +386,39 @@ def api_collect_selected():
     taxon_id = request.args.get("taxon_id", type=int)
     if not taxon_id:
         return jsonify({"ok": False, "error": "taxon_id required"}), 400
-    root = _resolve_species_dir(taxon_id)
-    if not root:
-        return jsonify({"ok": True, "items": []})
-    csv_path = root / "selected.csv"
-    if not csv_path.exists():
-        return jsonify({"ok": True, "items": []})
-    rows = []
-    with csv_path.open("r", newline="", encoding="utf-8") as f:
-        rd = csv.DictReader(f)
-        for r in rd:
-            rows.append({
-                "photo_id": r.get("photo_id") or "",
-                "observation_id": r.get("observation_id") or "",
-                "best_url": r.get("best_url") or "",
-                "width": r.get("width") or "",
-                "height": r.get("height") or "",
-                "license": r.get("license") or "",
-                "attribution": r.get("attribution") or "",
-                "observed_on": r.get("observed_on") or "",
-                "time_observed_at": r.get("time_observed_at") or "",
-                "user_login": r.get("user_login") or "",
-                "place_guess": r.get("place_guess") or "",
-                "quality_grade": r.get("quality_grade") or "",
-            })
-    return jsonify({"ok": True, "items": rows})
+    rows = [{"photo_id": r["photo_id"], **{f: r[f] for f in META_FIELDS}, "dup_of": r["dup_of"]}
+            for r in COLLECT_DB.selections(taxon_id).values()]
+    return jsonify({"ok": True, "items": rows, "version": COLLECT_DB.version(taxon_id)})
 
 
 # ===================== API: resolve =======================
-@picker_api_bp.get("/resolve_taxon")
-def api_resolve_taxon():
-    q = (request.args.get("q") or "").strip()
-    if not q:
-        return jsonify({"ok": False, "error": "empty query"}), 400
+def _taxon_record(inat: dict, gbif_id: str = "") -> Dict[str, Any]:
+    latin = inat.get("name") or inat.get("preferred_common_name") or ""
+    common_en = inat.get("english_common_name") or inat.get("preferred_common_name") or ""
+    common_ru = ""
+    for nm in inat.get("names", []) or []:
+        if (nm.get("lexicon") or "").lower() in ("russian", "ru") and nm.get("name"):
+            common_ru = nm["name"];
+            break
+    return {"inat_taxon_id": int(inat["id"]), "latin": latin, "common_en": common_en,
+            "common_ru": common_ru, "gbif_id": gbif_id}
+
+
+def _index_lookup(q: str) -> Optional[Dict[str, Any]]:
+    try:
+        m = re.search(r"/species/(\d+)", q)
+        if m:
+            return TAXON_INDEX.by_gbif(m.group(1))
+        if re.fullmatch(r"\d+", q):
+            # голое число — iNat id; промах индекса -> сеть (там iNat, затем GBIF), а не by_gbif:
+            # совпадение с чужим GBIF id дало бы не тот вид
+            return TAXON_INDEX.by_inat(int(q))
+        return TAXON_INDEX.by_latin(q)
+    except Exception:
+        return None
+
+
+def _network_resolve(q: str) -> Optional[Dict[str, Any]]:
     inat = None
     gbif_id = ""
     m = re.search(r"/species/(\d+)", q)
@@ -358,7 +429,10 @@ def api_resolve_taxon():
             inat = inat_taxon_by_query(latin)
         else:
             if re.fullmatch(r"\d+", q):
-                inat = inat_taxon_by_id(int(q))
+                try:
+                    inat = inat_taxon_by_id(int(q))
+                except Exception:
+                    inat = None
                 if not inat:
                     try:
                         latin = gbif_to_latin(q)
@@ -371,26 +445,108 @@ def api_resolve_taxon():
     except Exception:
         inat = None
     if not inat:
-        return jsonify({"ok": False, "error": "taxon not found"}), 404
+        return None
+    rec = _taxon_record(inat, gbif_id)
+    try:
+        TAXON_INDEX.put(rec)
+    except Exception:
+        pass
+    return rec
 
-    latin = inat.get("name") or inat.get("preferred_common_name") or ""
-    common_en = inat.get("english_common_name") or inat.get("preferred_common_name") or ""
-    common_ru = ""
-    for nm in inat.get("names", []) or []:
-        if (nm.get("lexicon") or "").lower() in ("russian", "ru") and nm.get("name"):
-            common_ru = nm["name"];
-            break
-    return jsonify({
-        "ok": True,
-        "inat_taxon_id": int(inat["id"]),
-        "latin": latin,
-        "common_en": common_en,
-        "common_ru": common_ru,
-        "gbif_id": gbif_id,
-    })
+
+def resolve_taxon(q: str) -> Tuple[Optional[Dict[str, Any]], str]:
+    """Запрос (GBIF URL/id, iNat id, латынь) -> (запись | None, "index" | "network")."""
+    rec = _index_lookup(q)
+    if rec:
+        return rec, "index"
+    return _network_resolve(q), "network"
+
+
+@picker_api_bp.get("/resolve_taxon")
+def api_resolve_taxon():
+    q = (request.args.get("q") or "").strip()
+    if not q:
+        return jsonify({"ok": False, "error": "empty query"}), 400
+    rec, _src = resolve_taxon(q)
+    if not rec:
+        return jsonify({"ok": False, "error": "taxon not found"}), 404
+    return jsonify({"ok": True, **rec})
+
+
+@picker_api_bp.post("/resolve_taxa")
+def api_resolve_taxa():
+    """{"queries": [...]} -> результаты в том же порядке; сначала индекс, сеть — только для промахов."""
+    js = request.get_json(silent=True) or {}
+    queries = js.get("queries") or js.get("names") or []
+    if not isinstance(queries, list) or not queries:
+        return jsonify({"ok": False, "error": "queries required"}), 400
+    if len(queries) > RESOLVE_BATCH_MAX:
+        return jsonify({"ok": False, "error": f"too many queries (max {RESOLVE_BATCH_MAX})"}), 400
+
+    uniq = list(dict.fromkeys(str(q or "").strip() for q in queries))
+    found: Dict[str, Tuple[Optional[Dict[str, Any]], str]] = {}
+    misses = []
+    for q in uniq:
+        rec = _index_lookup(q) if q else None
+        if rec:
+            found[q] = (rec, "index")
+        elif q:
+            misses.append(q)
+    if misses:
+        with ThreadPoolExecutor(min(RESOLVE_CONCURRENCY, len(misses)), thread_name_prefix="pp-resolve") as ex:
+            for q, rec in zip(misses, ex.map(_network_resolve, misses)):
+                found[q] = (rec, "network")
+
+    results, stats = [], {"index": 0, "network": 0, "not_found": 0}
+    for q in (str(q or "").strip() for q in queries):
+        rec, src = found.get(q, (None, "index"))
+        if rec:
+            stats[src] += 1
+            results.append({"q": q, "ok": True, "source": src, **rec})
+        else:
+            stats["not_found"] += 1
+            results.append({"q": q, "ok": False, "error": "taxon not found"})
+    return jsonify({"ok": True, "results": results, "stats": stats})
 
 
 # ===================== API: список фото ===================
+def _slim_obs(obs: dict) -> Dict[str, Any]:
+    """Из наблюдения — только то, что нужно карточке (окно в 200 наблюдений держим в кэше)."""
+    photos = obs.get("photos") or []
+    ph = photos[0] if photos else None
+    return {
+        "id": obs.get("id"),
+        "photos": [{k: ph.get(k) for k in ("id", "url", "original_url", "license_code", "attribution",
+                                           "original_dimensions")}] if ph else [],
+        "observed_on": obs.get("observed_on"),
+        "time_observed_at": obs.get("time_observed_at"),
+        "user": {"login": (obs.get("user") or {}).get("login")},
+        "place_guess": obs.get("place_guess"),
+        "quality_grade": obs.get("quality_grade"),
+    }
+
+
+def _obs_window(taxon_id: int, order_by: str, w: int) -> dict:
+    """Окно w (INAT_OBS_WINDOW наблюдений) выдачи по таксону — через API_CACHE с single-flight."""
+    params = {
+        "taxon_id": taxon_id,
+        "photos": "true",
+        "order": "desc",
+        "order_by": order_by,
+        "per_page": INAT_OBS_WINDOW,
+        "page": w + 1,
+        "quality_grade": "research,needs_id",
+    }
+
+    def fetch():
+        js = http_json(INAT_OBS_API, params=params, timeout=60)
+        return {"total_results": js.get("total_results", 0),
+                "results": [_slim_obs(o) for o in js.get("results", [])]}
+
+    ttl, swr = API_CACHE_TTL[INAT_OBS_API]
+    return API_CACHE.get_or_fetch("window:" + cache_key(INAT_OBS_API, params), fetch, ttl=ttl, swr=swr)
+
+
 @picker_api_bp.get("/inat/photos")
 def api_inat_photos():
     taxon_id = request.args.get("taxon_id", type=int)
@@ -400,19 +556,19 @@ def api_inat_photos():
     per_page = max(1, min(50, request.args.get("per_page", default=10, type=int)))
     sort = request.args.get("sort", default="faves", type=str)
     licenses = "cc0,cc-by,cc-by-nc".split(",")
-    params = {
-        "taxon_id": taxon_id,
-        "photos": "true",
-        "order": "desc",
-        "order_by": "faves" if sort == "faves" else "created_at",
-        "per_page": per_page,
-        "page": page,
-        "quality_grade": "research,needs_id",
-    }
-    js = http_json(INAT_OBS_API, params=params, timeout=60)
-    total = js.get("total_results", 0)
+    order_by = "faves" if sort == "faves" else "created_at"
+    start = (page - 1) * per_page
+    w0, w1 = start // INAT_OBS_WINDOW, (start + per_page - 1) // INAT_OBS_WINDOW
+    total, observations = 0, []
+    for w in range(w0, w1 + 1):
+        win = _obs_window(taxon_id, order_by, w)
+        total = win.get("total_results", 0)
+        observations.extend(win.get("results", []))
+        if len(win.get("results", [])) < INAT_OBS_WINDOW:
+            break  # окно неполное — дальше ничего нет
+    off = start - w0 * INAT_OBS_WINDOW
     items: List[Dict[str, Any]] = []
-    for obs in js.get("results", []):
+    for obs in observations[off:off + per_page]:
         photos = obs.get("photos") or []
         if not photos: continue
         ph = photos[0]
@@ -439,231 +595,528 @@ def api_inat_photos():
     return jsonify({"ok": True, "page": page, "per_page": per_page, "total": total, "items": items})
 
 
+# ===================== Фоновые задачи sync ================
+JOB_KEEP_SEC = 3600  # завершённые задачи держим для опроса прогресса
+JOB_KEEP_MAX = 500
+JOB_SSE_KEEPALIVE_SEC = 15
+
+
+class SyncJobs:
+    """
+    Очередь sync-задач. На таксон — не больше одной выполняющейся и одной ожидающей задачи:
+    повторная отправка, пока задача ждёт, лишь подменяет её выборку (берётся последняя).
+    Задачи одного таксона выполняются строго по очереди, разных — до `workers` одновременно.
+    """
+
+    def __init__(self, workers: int = 1):
+        self.workers = workers
+        self._cv = Condition()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._queued: Dict[str, str] = {}  # таксон -> id ожидающей задачи (в порядке постановки)
+        self._running: set = set()  # таксоны
+        self._threads: List[Thread] = []
+
+    def submit(self, payload: dict, user: str = "") -> Tuple[Dict[str, Any], bool]:
+        taxon = str(payload.get("taxon_id") or "")
+        with self._cv:
+            jid = self._queued.get(taxon)
+            if jid:
+                job = self._jobs[jid]
+                # «докачка» (mode=files) входит в полный sync — ожидающий полный sync не подменяем
+                if payload.get("mode") != "files" or job["_payload"].get("mode") == "files":
+                    job["_payload"] = payload
+                job["_user"] = user or job["_user"]
+                job["coalesced"] += 1
+                job["v"] += 1
+                self._cv.notify_all()
+                return self._public(job), True
+            job = {
+                "id": uuid.uuid4().hex[:12], "taxon_id": taxon, "status": "queued", "coalesced": 0,
+                "created": time.time(), "started": None, "finished": None,
+                "progress": {"total": 0, "downloaded": 0, "converted": 0, "written": 0, "duplicates": 0,
+                             "failed_ids": []},
+                "result": None, "v": 0, "_payload": payload, "_user": user,
+            }
+            self._jobs[job["id"]] = job
+            self._queued[taxon] = job["id"]
+            self._prune()
+            while len(self._threads) < self.workers:  # потоки лениво (после fork)
+                t = Thread(target=self._loop, name=f"pp-sync-{len(self._threads)}", daemon=True)
+                self._threads.append(t)
+                t.start()
+            self._cv.notify_all()
+            return self._public(job), False
+
+    def get(self, jid: str) -> Optional[Dict[str, Any]]:
+        with self._cv:
+            job = self._jobs.get(jid)
+            return self._public(job) if job else None
+
+    def wait(self, jid: str, seen_v: int, timeout: float) -> Optional[Dict[str, Any]]:
+        """Ждём изменения задачи (версия > seen_v) не дольше timeout — для SSE."""
+        with self._cv:
+            self._cv.wait_for(lambda: (self._jobs.get(jid) or {}).get("v", seen_v + 1) > seen_v, timeout)
+            job = self._jobs.get(jid)
+            return self._public(job) if job else None
+
+    def list(self, taxon: str = "") -> List[Dict[str, Any]]:
+        with self._cv:
+            return [self._public(j) for j in self._jobs.values() if not taxon or j["taxon_id"] == taxon]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cv:
+            by: Dict[str, int] = {}
+            for j in self._jobs.values():
+                by[j["status"]] = by.get(j["status"], 0) + 1
+            return {"queued_taxa": len(self._queued), "running_taxa": len(self._running), **by}
+
+    @staticmethod
+    def _public(job: dict) -> Dict[str, Any]:
+        out = {k: v for k, v in job.items() if not k.startswith("_")}
+        out["progress"] = dict(job["progress"], failed_ids=list(job["progress"]["failed_ids"]))
+        return out
+
+    def _prune(self):
+        # под self._cv
+        now = time.time()
+        done = [j for j in self._jobs.values() if j["finished"]]
+        done.sort(key=lambda j: j["finished"])
+        extra = max(0, len(self._jobs) - JOB_KEEP_MAX)
+        for i, j in enumerate(done):
+            if i < extra or now - j["finished"] > JOB_KEEP_SEC:
+                self._jobs.pop(j["id"], None)
+
+    def _progress(self, job: dict):
+        def cb(kind: str, pid: str = "", total: int = 0):
+            with self._cv:
+                pr = job["progress"]
+                if kind == "total":
+                    pr["total"] = total
+                elif kind == "failed":
+                    pr["failed_ids"].append(pid)
+                else:
+                    pr[kind] += 1
+                job["v"] += 1
+                self._cv.notify_all()
+
+        return cb
+
+    def _take(self) -> dict:
+        with self._cv:
+            while True:
+                for taxon, jid in self._queued.items():
+                    if taxon not in self._running:
+                        del self._queued[taxon]
+                        self._running.add(taxon)
+                        job = self._jobs[jid]
+                        job["status"], job["started"] = "running", time.time()
+                        job["v"] += 1
+                        self._cv.notify_all()
+                        return job
+                self._cv.wait()
+
+    def _loop(self):
+        while True:
+            job = self._take()
+            res: Dict[str, Any]
+            try:
+                with PROFILER.job("sync", job["taxon_id"]):
+                    res = _collect_sync(job["_payload"], user=job["_user"], progress=self._progress(job))
+            except Exception as e:  # _collect_sync сам ловит всё; на всякий случай
+                res = {"ok": False, "error": f"sync failed: {e.__class__.__name__}: {e}"}
+            with self._cv:
+                job["result"] = res
+                job["status"] = "done" if "error" not in res else "failed"
+                job["finished"] = time.time()
+                job["_payload"] = None
+                job["v"] += 1
+                self._running.discard(job["taxon_id"])
+                self._cv.notify_all()
+
+
+SYNC_JOBS = SyncJobs(COLLECT_CONCURRENCY)
+
+
 # ===================== API: sync выбранных =================
 @picker_api_bp.post("/collect/sync")
 def api_collect_sync():
     """
-    Истина — текущий список selected с фронта.
+    Истина — текущий список selected с фронта. Ставим фоновую задачу и сразу отвечаем 202
+    с job_id; прогресс — GET /api/collect/jobs/<id> или SSE /api/collect/jobs/<id>/events.
     • Удалённые: запись удаляется, файл пытаемся удалить (если не вышло — ок).
     • Добавленные: запись ВСЕГДА попадает в CSV; если скачать/сконвертировать не удалось — local_path="".
     • Оставленные: если файла нет/пустой путь/не webp — пытаемся восстановить.
     Никогда не шлём 500.
     """
-    acquired = _collect_sem.acquire(timeout=300)  # ограничиваем одновременные sync-запросы
-    if not acquired:
-        return jsonify({"ok": False, "error": "server busy, try again later"}), 503
+    js = request.get_json(silent=True) or {}
+    if not js.get("taxon_id"):
+        return jsonify({"ok": False, "error": "taxon_id required"}), 200
+    job, coalesced = SYNC_JOBS.submit(js, user=session.get("user") or "")
+    return jsonify({"ok": True, "job_id": job["id"], "status": job["status"], "coalesced": coalesced,
+                    "job": job}), 202
+
+
+@picker_api_bp.get("/collect/jobs")
+def api_collect_jobs():
+    taxon = request.args.get("taxon_id", default="", type=str)
+    return jsonify({"ok": True, "jobs": SYNC_JOBS.list(taxon), "stats": SYNC_JOBS.stats()})
+
+
+@picker_api_bp.get("/collect/jobs/<job_id>")
+def api_collect_job(job_id: str):
+    job = SYNC_JOBS.get(job_id)
+    if not job:
+        return jsonify({"ok": False, "error": "job not found"}), 404
+    return jsonify({"ok": True, "job": job})
+
+
+@picker_api_bp.get("/collect/jobs/<job_id>/events")
+def api_collect_job_events(job_id: str):
+    """SSE: событие progress на каждое изменение, done — финальное состояние (с result)."""
+    if not SYNC_JOBS.get(job_id):
+        return jsonify({"ok": False, "error": "job not found"}), 404
+
+    def gen():
+        seen = -1
+        while True:
+            job = SYNC_JOBS.wait(job_id, seen, JOB_SSE_KEEPALIVE_SEC)
+            if job is None:
+                yield "event: gone\ndata: {}\n\n"
+                return
+            if job["v"] == seen:
+                yield ": keepalive\n\n"
+                continue
+            seen = job["v"]
+            final = job["status"] in ("done", "failed")
+            yield f"event: {'done' if final else 'progress'}\ndata: {json.dumps(job, ensure_ascii=False)}\n\n"
+            if final:
+                return
+
+    return Response(gen(), mimetype="text/event-stream", headers={"X-Accel-Buffering": "no"})
+
+
+def _norm_photo(it: dict) -> Dict[str, str]:
+    return {"photo_id": str(it.get("photo_id") or "").strip(), **{f: str(it.get(f) or "") for f in META_FIELDS}}
+
+
+class VersionConflict(Exception):
+    """Выборка таксона изменилась с версии, от которой считал клиент."""
+
+    def __init__(self, version: int):
+        super().__init__(f"version conflict (current {version})")
+        self.version = version
+
+
+def _prepare_taxon(js: dict) -> Tuple[int, Path]:
+    """Таксон из запроса -> (taxon_id, каталог images); запись таксона в БД и индекс."""
+    taxon_id = int(js["taxon_id"])
+    known = COLLECT_DB.taxon(taxon_id)
+    latin = (js.get("latin") or "").strip() or (known or {}).get("latin") or "species"
+    gbif_id = str(js.get("gbif_id") or "")
+    common_en = js.get("common_en") or ""
+    common_ru = js.get("common_ru") or ""
+
+    # каталог таксона закрепляется при первом sync (латынь могла уточниться позже)
+    root = _resolve_species_dir(taxon_id) or DATASET_OUT_DIR / f"{taxon_id}__{slugify_latin(latin)}"
+    images_dir = root / "images"
+    images_dir.mkdir(parents=True, exist_ok=True)
+    COLLECT_DB.upsert_taxon(taxon_id, latin, common_en, common_ru, gbif_id, dir=root.as_posix())
+
     try:
-        try:
-            js = request.get_json(silent=True) or {}
-            _reset_http_session()
-
-            taxon_id = js.get("taxon_id")
-            latin = (js.get("latin") or "").strip() or "species"
-            gbif_id = js.get("gbif_id") or ""
-            common_en = js.get("common_en") or ""
-            common_ru = js.get("common_ru") or ""
-            selected = js.get("selected") or []
-            if not taxon_id:
-                return jsonify({"ok": False, "error": "taxon_id required"}), 200
-
-            latin_slug = slugify_latin(latin)
-            root = DATASET_OUT_DIR / f"{taxon_id}__{latin_slug}"
-            images_dir = root / "images"
-            images_dir.mkdir(parents=True, exist_ok=True)
-            csv_path = root / "selected.csv"
-            species_csv = root / "species.csv"
-
-            # species.csv
-            with species_csv.open("w", newline="", encoding="utf-8") as fsp:
-                wrs = csv.DictWriter(fsp,
-                                     fieldnames=["taxon_id", "latin", "common_en", "common_ru", "gbif_id",
-                                                 "updated_at"])
-                wrs.writeheader()
-                wrs.writerow({
-                    "taxon_id": taxon_id, "latin": latin, "common_en": common_en, "common_ru": common_ru,
-                    "gbif_id": gbif_id, "updated_at": datetime.utcnow().isoformat()
-                })
-
-            # существующее
-            existing = read_selected_csv(csv_path)
-            existing_ids = set(existing.keys())
-
-            # нормализуем приходящий список выбранных
-            selected_map: Dict[str, Dict[str, Any]] = {}
-            for it in selected if isinstance(selected, list) else []:
-                pid = str(it.get("photo_id") or "").strip()
-                if not pid: continue
-                selected_map[pid] = {
-                    "photo_id": pid,
-                    "observation_id": str(it.get("observation_id") or ""),
-                    "best_url": str(it.get("best_url") or ""),
-                    "width": str(it.get("width") or ""),
-                    "height": str(it.get("height") or ""),
-                    "license": str(it.get("license") or ""),
-                    "attribution": str(it.get("attribution") or ""),
-                    "observed_on": str(it.get("observed_on") or ""),
-                    "time_observed_at": str(it.get("time_observed_at") or ""),
-                    "user_login": str(it.get("user_login") or ""),
-                    "place_guess": str(it.get("place_guess") or ""),
-                    "quality_grade": str(it.get("quality_grade") or "")
-                }
-
-            selected_ids = set(selected_map.keys())
-            to_remove = existing_ids - selected_ids
-            to_add = selected_ids - existing_ids
-            kept_ids = selected_ids & existing_ids
-
-            # remove
-            for pid in sorted(to_remove):
-                row = existing.get(pid) or {}
-                lp = (row.get("local_path") or "").strip()
-                if lp:
-                    try:
-                        os.remove(lp)
-                    except OSError:
-                        pass  # файл уже отсутствует — ок
-
-            idx = _next_image_index(images_dir)
-            new_rows: List[Dict[str, str]] = []
-            failed_ids: List[str] = []
-            processed = 0
-
-            # keep + fix
-            for pid in sorted(kept_ids):
-                base = dict(existing.get(pid) or {})
-                meta = selected_map.get(pid) or {}
-                base.update(meta)
-
-                lp = (base.get("local_path") or "").strip()
-                p = Path(lp) if lp else None
-                need = (not lp) or (p and not p.exists())
-
-                if not need and p and p.exists() and p.suffix.lower() != ".webp":
-                    new_p, new_md5 = convert_file_to_webp(p)
-                    base["local_path"] = new_p.as_posix()
-                    base["md5"] = new_md5 or base.get("md5", "")
-
-                if need:
-                    url = (base.get("best_url") or "").strip()
-                    if url:
-                        tmp = http_download_to_tmp(url, f"{pid}")
-                        if tmp and tmp.exists():
-                            try:
-                                webp = file_to_webp_bytes(tmp)
-                                fname = f"{idx:06d}_{pid}.webp";
-                                idx += 1
-                                outp = images_dir / fname
-                                with open(outp, "wb") as fw:
-                                    fw.write(webp)
-                                base["local_path"] = outp.as_posix()
-                                base["md5"] = md5_bytes(webp)
-                                base["saved_at"] = datetime.utcnow().isoformat()
-                            except Exception:
-                                base["local_path"] = "";
-                                base["md5"] = "";
-                                failed_ids.append(pid)
-                            finally:
-                                try:
-                                    os.remove(tmp)
-                                except Exception:
-                                    pass
-                        else:
-                            base["local_path"] = "";
-                            base["md5"] = "";
-                            failed_ids.append(pid)
-                    else:
-                        base["local_path"] = "";
-                        base["md5"] = "";
-                        failed_ids.append(pid)
-
-                new_rows.append({
-                    "taxon_id": str(taxon_id), "latin": latin, "gbif_id": gbif_id,
-                    "photo_id": pid, "observation_id": base.get("observation_id", ""),
-                    "license": base.get("license", ""), "attribution": base.get("attribution", ""),
-                    "best_url": base.get("best_url", ""),
-                    "local_path": base.get("local_path", ""), "md5": base.get("md5", ""),
-                    "width": base.get("width", ""), "height": base.get("height", ""),
-                    "observed_on": base.get("observed_on", ""), "time_observed_at": base.get("time_observed_at", ""),
-                    "user_login": base.get("user_login", ""), "place_guess": base.get("place_guess", ""),
-                    "quality_grade": base.get("quality_grade", ""), "saved_at": base.get("saved_at", "")
-                })
-
-                processed += 1
-                if processed % MEM_CHECK_EVERY == 0:
-                    gc.collect()
-
-            # add (row ALWAYS written)
-            for pid in sorted(to_add):
-                it = selected_map[pid]
-                url = (it.get("best_url") or "").strip()
-                lp = "";
-                md5 = ""
-
-                if url:
-                    tmp = http_download_to_tmp(url, f"{pid}")
-                    if tmp and tmp.exists():
-                        try:
-                            webp = file_to_webp_bytes(tmp)
-                            fname = f"{idx:06d}_{pid}.webp";
-                            idx += 1
-                            outp = images_dir / fname
-                            with open(outp, "wb") as fw:
-                                fw.write(webp)
-                            lp = outp.as_posix();
-                            md5 = md5_bytes(webp)
-                        except Exception:
-                            failed_ids.append(pid)
-                        finally:
-                            try:
-                                os.remove(tmp)
-                            except Exception:
-                                pass
-                    else:
-                        failed_ids.append(pid)
-                else:
-                    failed_ids.append(pid)
-
-                new_rows.append({
-                    "taxon_id": str(taxon_id), "latin": latin, "gbif_id": gbif_id,
-                    "photo_id": pid, "observation_id": it.get("observation_id") or "",
-                    "license": it.get("license") or "", "attribution": it.get("attribution") or "",
-                    "best_url": url, "local_path": lp, "md5": md5,
-                    "width": it.get("width") or "", "height": it.get("height") or "",
-                    "observed_on": it.get("observed_on") or "", "time_observed_at": it.get("time_observed_at") or "",
-                    "user_login": it.get("user_login") or "", "place_guess": it.get("place_guess") or "",
-                    "quality_grade": it.get("quality_grade") or "",
-                    "saved_at": datetime.utcnow().isoformat() if lp else ""
-                })
-
-                processed += 1
-                if processed % MEM_CHECK_EVERY == 0:
-                    gc.collect()
-
-            new_rows.sort(key=lambda r: r.get("photo_id", ""))
-            write_selected_csv(csv_path, new_rows)
-
-            ok_flag = (len(failed_ids) == 0)
+        if (js.get("latin") or "").strip():
+            TAXON_INDEX.put({"inat_taxon_id": taxon_id, "latin": latin, "common_en": common_en,
+                             "common_ru": common_ru, "gbif_id": gbif_id})
+    except Exception:
+        pass
+    return taxon_id, images_dir
+
+
+def _commit_selection(taxon_id: int, upsert: Dict[str, Dict[str, str]], remove: List[str],
+                      base_version: Optional[int] = None) -> Tuple[int, List[str], List[str]]:
+    """
+    Изменение выборки одной транзакцией: удалённые/добавленные/обновлённые строки + версия таксона.
+    upsert — фото, которые должны быть в выборке (с метаданными с фронта). base_version задан и
+    не совпал с текущей — VersionConflict (ничего не меняем). Версия растёт, только если изменился
+    состав выборки. Файлы удалённых стираются после коммита. -> (версия, добавленные, удалённые).
+    """
+    with COLLECT_DB.tx() as con:
+        version = COLLECT_DB.version(taxon_id)
+        if base_version is not None and int(base_version) != version:
+            raise VersionConflict(version)
+        existing = COLLECT_DB.selections(taxon_id)
+        removed = [pid for pid in remove if pid in existing]
+        added = sorted(pid for pid in upsert if pid not in existing)
+        for pid in removed:
+            COLLECT_DB.delete_selection(con, taxon_id, pid)
+        for pid, meta in upsert.items():
+            COLLECT_DB.upsert_meta(con, taxon_id, pid, meta)
+        if removed or added:
+            version = COLLECT_DB.bump_version(con, taxon_id)
+
+    # файлы удалённых — после коммита (если не вышло — ок)
+    for pid in removed:
+        PHASH_INDEX.discard(taxon_id, pid)
+        lp = (existing[pid].get("local_path") or "").strip()
+        if lp:
             try:
-                record_change_for_request_user(added=len(to_add), removed=len(to_remove))
-            except Exception:
+                os.remove(lp)
+            except OSError:
                 pass
+    return version, added, removed
 
-            return jsonify({
-                "ok": ok_flag,
-                "dir": root.as_posix(),
-                "csv": csv_path.as_posix(),
-                "species_csv": species_csv.as_posix(),
-                "added": len(to_add),
-                "removed": len(to_remove),
-                "kept": len(kept_ids),
-                "selected_total": len(selected_ids),
-                "failed_ids": failed_ids
-            }), 200
-
-        except Exception as e:
-            return jsonify({"ok": False, "error": f"sync failed: {e.__class__.__name__}: {e}"}), 200
-    finally:
-        _collect_sem.release()
+
+# -------- похожие фото (dHash) --------
+def _thumb_url(row: dict) -> str:
+    """Превью iNat (small, ~240px) — для хеша хватает; у строк без thumb_url выводим из best_url."""
+    t = (row.get("thumb_url") or "").strip()
+    if t:
+        return t
+    best = (row.get("best_url") or "").strip()
+    t = re.sub(r"/(large|original|medium)\.", "/small.", best)
+    return t if t != best else ""
+
+
+@timed("thumb_hash")
+def _thumb_dhash(url: str) -> int:
+    with RATE_LIMITER.slot(url) as slot:
+        r = HTTP.get(url, timeout=15)
+        slot.status, slot.retry_after = r.status_code, r.headers.get("Retry-After")
+    r.raise_for_status()
+    return dhash_bytes(r.content)
+
+
+def _dedup_claim(taxon_id: int, pid: str, h: int) -> Tuple[int, str, bool]:
+    """-> (хеш, dup_of, пропустить): dup_of — "<taxon_id>/<photo_id>" ближайшего похожего или ""."""
+    same, other = PHASH_INDEX.claim(taxon_id, pid, h, DEDUP_MAX_DIST, skip_same=DEDUP_MODE == "skip")
+    hit = same or other
+    return h, f"{hit[1]}/{hit[2]}" if hit else "", DEDUP_MODE == "skip" and same is not None
+
+
+def _dup_has_file(taxon_id: int, dup_of: str, rows: Dict[str, dict]) -> bool:
+    tid, _, pid = dup_of.partition("/")
+    lp = (rows.get(pid) or {}).get("local_path") or "" if tid == str(taxon_id) else ""
+    return bool(lp) and Path(lp).exists()
+
+
+def _fill_files(taxon_id: int, images_dir: Path, progress) -> Tuple[List[str], Dict[str, str], List[str]]:
+    """
+    Докачка: строки выборки без файла (новые и потерявшие файл); не-webp — конвертируем на месте.
+    Каждое фото — своей транзакцией по мере готовности. Похожие на уже собранные (dHash по превью,
+    иначе по самой картинке) помечаются dup_of, а в режиме "skip" внутри таксона не сохраняются.
+    -> (failed_ids, duplicates {photo_id: dup_of} найденных в этот раз, skipped_ids — не сохранённых).
+    """
+    rows = COLLECT_DB.selections(taxon_id)
+    jobs: List[Tuple[str, str]] = []
+    duplicates: Dict[str, str] = {}
+    skipped_ids: List[str] = []
+    for pid, row in rows.items():
+        lp = (row.get("local_path") or "").strip()
+        p = Path(lp) if lp else None
+        if not p or not p.exists():
+            if DEDUP_MODE == "skip" and row.get("dup_of") and _dup_has_file(taxon_id, row["dup_of"], rows):
+                duplicates[pid] = row["dup_of"]
+                skipped_ids.append(pid)
+                continue  # пропущенный дубликат, оригинал на месте
+            jobs.append((pid, (row.get("best_url") or "").strip()))
+        elif p.suffix.lower() != ".webp":
+            new_p, new_md5 = convert_file_to_webp(p)
+            COLLECT_DB.set_file(taxon_id, pid, new_p.as_posix(), new_md5 or row.get("md5", ""),
+                                row.get("src_md5", ""), row.get("saved_at", ""), row.get("file_idx"),
+                                size=new_p.stat().st_size if new_p.exists() else 0)
+    # порядок как раньше: сначала восстановление ранее сохранённых, затем новые
+    jobs.sort(key=lambda j: (not rows[j[0]].get("saved_at"), j[0]))
+
+    # загрузка и конверсия параллельно, запись и индексы — по порядку jobs
+    idx = COLLECT_DB.next_file_idx(taxon_id)
+    failed_ids: List[str] = []
+
+    def screen(pid: str):
+        h = from_hex(rows[pid].get("dhash") or "")
+        if h is None:
+            turl = _thumb_url(rows[pid])
+            try:
+                h = _thumb_dhash(turl) if turl else None
+            except Exception:
+                h = None
+        if h is None:
+            return None
+        return _dedup_claim(taxon_id, pid, h) if informative(h) else (h, "", False)
+
+    progress("total", total=len(jobs))
+    for pid, got in fetch_webp_ordered(jobs, progress=progress, screen=screen if DEDUP_MODE != "off" else None):
+        if got is not None:
+            webp, src_md5, h, dup_of = got
+            if dup_of is None and h is not None and informative(h):  # хеш получен при конверсии — проверяем сейчас
+                h, dup_of, skip = _dedup_claim(taxon_id, pid, h)
+                webp = None if skip else webp
+            if h is not None:
+                COLLECT_DB.set_hash(taxon_id, pid, to_hex(h), dup_of or "")
+            if dup_of:
+                duplicates[pid] = dup_of
+                progress("duplicates", pid)
+        if got is None:
+            failed_ids.append(pid)
+            PHASH_INDEX.discard(taxon_id, pid)
+            COLLECT_DB.set_file(taxon_id, pid)
+            progress("failed", pid)
+        elif webp is None:
+            COLLECT_DB.set_file(taxon_id, pid)
+            skipped_ids.append(pid)
+        else:
+            fname = f"{idx:06d}_{pid}.webp"
+            outp = images_dir / fname
+            with open(outp, "wb", buffering=0) as fw:  # одна запись, без промежуточного буфера
+                fw.write(webp)
+            COLLECT_DB.set_file(taxon_id, pid, outp.as_posix(), md5_bytes(webp), src_md5,
+                                datetime.utcnow().isoformat(), idx, size=len(webp))
+            idx += 1
+            progress("written", pid)
+    COLLECT_DB.record_sync(taxon_id, len(failed_ids))
+    _export_csv(taxon_id)
+    return failed_ids, duplicates, skipped_ids
+
+
+def _export_csv(taxon_id: int):
+    """selected.csv / species.csv таксона — после каждого sync: их читают сид TAXON_INDEX,
+    пересканирование list_selected.py и внешние потребители папок датасета."""
+    try:
+        COLLECT_DB.export_csv(taxon_id)
+    except Exception as e:
+        _log("csv export failed", taxon_id=taxon_id, error=e)
+
+
+def _collect_sync(js: dict, user: str = "", progress=None) -> Dict[str, Any]:
+    """Выполнение sync (в потоке SyncJobs). Возвращает итог; при ошибке — {"ok": False, "error"}."""
+    progress = progress or (lambda *a, **k: None)
+    try:
+        if not js.get("taxon_id"):
+            return {"ok": False, "error": "taxon_id required"}
+        taxon_id, images_dir = _prepare_taxon(js)
+        if js.get("mode") == "files":  # докачка после /collect/delta
+            failed_ids, duplicates, skipped_ids = _fill_files(taxon_id, images_dir, progress)
+            return {"ok": not failed_ids, "dir": images_dir.parent.as_posix(), "version": COLLECT_DB.version(taxon_id),
+                    "added": 0, "removed": 0, "failed_ids": failed_ids, "duplicates": duplicates,
+                    "skipped_ids": skipped_ids}
+        selected = js.get("selected") or []
+
+        # нормализуем приходящий список выбранных
+        selected_map: Dict[str, Dict[str, str]] = {}
+        for it in selected if isinstance(selected, list) else []:
+            row = _norm_photo(it)
+            if row["photo_id"]:
+                selected_map[row["photo_id"]] = row
+
+        existing_ids = set(COLLECT_DB.selections(taxon_id))
+        selected_ids = set(selected_map.keys())
+        base_version = js.get("base_version")
+        try:
+            version, to_add, to_remove = _commit_selection(
+                taxon_id, selected_map, sorted(existing_ids - selected_ids),
+                None if base_version is None else int(base_version))
+        except VersionConflict as e:
+            # снимок устарел (после него прошла дельта) — не откатываем чужие изменения
+            return {"ok": False, "error": "version conflict", "version": e.version}
+        kept_ids = selected_ids & existing_ids
+        failed_ids, duplicates, skipped_ids = _fill_files(taxon_id, images_dir, progress)
+
+        try:
+            if user:
+                record_change_for_user(user, added=len(to_add), removed=len(to_remove))
+        except Exception:
+            pass
+
+        return {
+            "ok": not failed_ids,
+            "dir": images_dir.parent.as_posix(),
+            "version": version,
+            "added": len(to_add),
+            "removed": len(to_remove),
+            "kept": len(kept_ids),
+            "selected_total": len(selected_ids),
+            "failed_ids": failed_ids,
+            "duplicates": duplicates,  # photo_id -> "<taxon_id>/<photo_id>" похожего
+            "skipped_ids": skipped_ids  # только при DEDUP_MODE="skip": дубликаты без файла
+        }
+
+    except Exception as e:
+        return {"ok": False, "error": f"sync failed: {e.__class__.__name__}: {e}"}
+
+
+@picker_api_bp.post("/collect/delta")
+def api_collect_delta():
+    """
+    {"taxon_id", "base_version", "add": [фото], "remove": [photo_id], latin/...} — применяем сразу
+    (одна транзакция), если версия выборки не ушла вперёд; иначе 409 с текущей версией —
+    клиент сверяется полным /collect/sync. Загрузка новых фото — фоновой задачей (job_id).
+    Возвращаем только изменённые строки.
+    """
+    js = request.get_json(silent=True) or {}
+    if not js.get("taxon_id"):
+        return jsonify({"ok": False, "error": "taxon_id required"}), 400
+    if js.get("base_version") is None:
+        return jsonify({"ok": False, "error": "base_version required"}), 400
+    add = {row["photo_id"]: row for row in map(_norm_photo, js.get("add") or []) if row["photo_id"]}
+    remove = sorted({str(pid).strip() for pid in js.get("remove") or [] if str(pid).strip()} - set(add))
+    try:
+        taxon_id, _images_dir = _prepare_taxon(js)
+        version, added, removed = _commit_selection(taxon_id, add, remove, int(js["base_version"]))
+    except VersionConflict as e:
+        return jsonify({"ok": False, "error": "version conflict", "version": e.version}), 409
+    except (TypeError, ValueError) as e:
+        return jsonify({"ok": False, "error": f"bad request: {e}"}), 400
+
+    user = session.get("user") or ""
+    try:
+        if user:
+            record_change_for_user(user, added=len(added), removed=len(removed))
+    except Exception:
+        pass
+    job = None
+    if added:
+        job, _ = SYNC_JOBS.submit({"taxon_id": taxon_id, "mode": "files"}, user="")  # CSV выгрузит задача
+    elif removed:
+        _export_csv(taxon_id)
+    rows = COLLECT_DB.selections(taxon_id)
+    return jsonify({"ok": True, "version": version, "added": len(added), "removed": len(removed),
+                    "rows": [rows[pid] for pid in add if pid in rows], "removed_ids": removed,
+                    "job_id": job["id"] if job else None, "job": job})
+
+
+@picker_api_bp.get("/collect/stats")
+def api_collect_stats():
+    """Каталог собранного: по таксону — каталог, латынь, выбрано, с файлом / без, байт, последний sync."""
+    taxa = COLLECT_DB.catalog()
+    totals = {"taxa": sum(1 for t in taxa if t["selected"]),
+              **{k: sum(t[k] for t in taxa) for k in ("selected", "with_file", "missing", "duplicates", "bytes")}}
+    return jsonify({"ok": True, "taxa": taxa, "totals": totals})
+
+
+@picker_api_bp.get("/collect/similar")
+def api_collect_similar():
+    """Похожие на фото: ?taxon_id=&photo_id=[&scope=taxon|all][&max_dist=N] -> [{taxon_id, photo_id, dist}]."""
+    taxon_id = request.args.get("taxon_id", type=int)
+    photo_id = (request.args.get("photo_id") or "").strip()
+    row = COLLECT_DB.selections(taxon_id).get(photo_id) if taxon_id and photo_id else None
+    if row is None:
+        return jsonify({"ok": False, "error": "unknown taxon_id/photo_id"}), 404
+    h = from_hex(row["dhash"])
+    if h is None:
+        return jsonify({"ok": True, "dhash": "", "items": []})
+    scope = request.args.get("scope", "all")
+    max_dist = request.args.get("max_dist", DEDUP_MAX_DIST, type=int)
+    hits = PHASH_INDEX.near(h, max_dist, taxon_id=taxon_id if scope == "taxon" else None,
+                            exclude=(taxon_id, photo_id))
+    return jsonify({"ok": True, "dhash": row["dhash"],
+                    "items": [{"taxon_id": t, "photo_id": p, "dist": d} for d, t, p in hits]})
+
+
+@picker_api_bp.post("/collect/export")
+def api_collect_export():
+    """Выгрузка selected.csv / species.csv из БД: {"taxon_id": N} или все таксоны."""
+    js = request.get_json(silent=True) or {}
+    ids = [int(js["taxon_id"])] if js.get("taxon_id") else [t["taxon_id"] for t in COLLECT_DB.taxa()]
+    out = [r for r in (COLLECT_DB.export_csv(tid) for tid in ids) if r]
+    return jsonify({"ok": True, "exported": out})
 
 
 # совместимость
@@ -675,7 +1128,6 @@ def api_collect_save_compat():
 # ===================== Maintenance =========================
 @picker_api_bp.post("/maintenance/flush")
 def api_maintenance_flush():
-    _reset_http_session()
     # подчистим tmp (на всякий случай)
     try:
         for p in TMP_DIR.glob("*"):
@@ -689,6 +1141,30 @@ def api_maintenance_flush():
     return jsonify({"ok": True})
 
 
+@picker_api_bp.get("/maintenance/memory")
+def api_maintenance_memory():
+    """Допуск конверсий по памяти: бюджет, зарезервировано, очередь, ожидание; null — конверсий ещё не было."""
+    mem = _MEMORY
+    return jsonify({"ok": True, "memory": mem.snapshot() if mem is not None else None})
+
+
+@picker_api_bp.get("/maintenance/http")
+def api_maintenance_http():
+    """Пулы соединений: запросов, установлено соединений, переиспользовано; по хостам — простаивающих."""
+    return jsonify({"ok": True, "http": HTTP.snapshot()})
+
+
+@picker_api_bp.get("/maintenance/ratelimit")
+def api_maintenance_ratelimit():
+    """По хостам: лимиты, текущая параллельность, очередь, ожидание (среднее/макс), 429 и ошибки."""
+    return jsonify({"ok": True, "hosts": RATE_LIMITER.snapshot()})
+
+
+@picker_api_bp.get("/maintenance/api_cache")
+def api_maintenance_api_cache():
+    return jsonify({"ok": True, "stats": API_CACHE.snapshot(), "ttl": {k: list(v) for k, v in API_CACHE_TTL.items()}})
+
+
 # ===================== No-cache для /api/* =================
 @picker_api_bp.after_app_request
 def _api_no_cache(resp):
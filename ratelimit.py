@@ -0,0 +1,219 @@
+import sqlite3, threading, time
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urlparse
+
+import timing
+
+# ---- ограничение запросов к внешним хостам: token bucket + адаптивная параллельность ----
+# На хост: ведро токенов (rate в секунду, запас burst) и лимит одновременных запросов, который
+# ведёт себя как AIMD: 429/5xx/обрыв — лимит пополам (не чаще раза в CUT_COOLDOWN_SEC), каждый
+# успех — +1/limit (т.е. +1 за «окно» удачных запросов). Retry-After ставит на паузу весь хост.
+# С shared_path ведро и паузы общие для процессов (SQLite); параллельность — в пределах процесса.
+
+CUT_COOLDOWN_SEC = 5.0  # пачка 429 от одной перегрузки режет лимит один раз
+DEFAULT_PAUSE_SEC = 2.0  # 429 без Retry-After
+MAX_PAUSE_SEC = 300.0
+
+
+class _SharedBuckets:
+    """Состояние вёдер в SQLite: ключ -> (tokens, updated, blocked_until); изменения — BEGIN IMMEDIATE."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._local = threading.local()
+
+    def _db(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            con = sqlite3.connect(str(self.path), timeout=10, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=OFF")  # потеря состояния при сбое безвредна
+            con.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL,"
+                        " updated REAL, blocked_until REAL)")
+            self._local.con = con
+        return con
+
+    def update(self, key: str, fn, default: tuple):
+        con = self._db()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            row = con.execute("SELECT tokens, updated, blocked_until FROM buckets WHERE key=?", (key,)).fetchone()
+            state, result = fn(tuple(row) if row else default)
+            con.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated, blocked_until) VALUES (?, ?, ?, ?)",
+                        (key, *state))
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        return result
+
+
+class TokenBucket:
+    def __init__(self, key: str, rate: float, burst: int, shared: _SharedBuckets | None = None):
+        self.key = key
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._shared = shared
+        self._lock = threading.Lock()
+        self._state = (self.burst, time.time(), 0.0)
+
+    def _apply(self, fn):
+        if self._shared is not None:
+            try:
+                return self._shared.update(self.key, fn, (self.burst, time.time(), 0.0))
+            except (sqlite3.Error, OSError):
+                pass  # общий файл недоступен — ограничиваем хотя бы этот процесс
+        with self._lock:
+            self._state, result = fn(self._state)
+            return result
+
+    def reserve(self) -> float:
+        """Забрать токен (в долг, если нет) -> сколько секунд подождать до запроса."""
+
+        def fn(st):
+            tokens, updated, blocked = st
+            now = time.time()
+            tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate) - 1.0
+            wait = max(blocked - now, -tokens / self.rate if tokens < 0 else 0.0)
+            return (tokens, now, blocked), wait
+
+        return self._apply(fn)
+
+    def pause(self, seconds: float):
+        until = time.time() + min(seconds, MAX_PAUSE_SEC)
+
+        def fn(st):
+            return (st[0], st[1], max(st[2], until)), None
+
+        self._apply(fn)
+
+
+class AdaptiveConcurrency:
+    def __init__(self, max_limit: int, min_limit: int = 1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self.inflight = 0
+        self.waiting = 0
+        self.cuts = 0
+        self._last_cut = 0.0
+        self._cv = threading.Condition()
+
+    def acquire(self) -> bool:
+        """Занять место; True — пришлось ждать."""
+        with self._cv:
+            blocked = False
+            self.waiting += 1
+            try:
+                while self.inflight >= int(self.limit):
+                    blocked = True
+                    self._cv.wait()
+            finally:
+                self.waiting -= 1
+            self.inflight += 1
+            return blocked
+
+    def release(self, overloaded: bool):
+        with self._cv:
+            self.inflight -= 1
+            now = time.monotonic()
+            if overloaded:
+                if now - self._last_cut >= CUT_COOLDOWN_SEC:
+                    self.limit = max(float(self.min_limit), self.limit / 2)
+                    self._last_cut = now
+                    self.cuts += 1
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            self._cv.notify_all()
+
+
+class Slot:
+    """Что вернул хост: вызывающий заполняет status (и retry_after) до выхода из slot(); 0 — ответа не было."""
+    __slots__ = ("status", "retry_after")
+
+    def __init__(self):
+        self.status = 0
+        self.retry_after = None
+
+
+class HostLimiter:
+    def __init__(self, host: str, rate: float, burst: int, max_concurrency: int,
+                 shared: _SharedBuckets | None = None):
+        self.host = host
+        self.bucket = TokenBucket(host, rate, burst, shared)
+        self.conc = AdaptiveConcurrency(max_concurrency)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "waited": 0, "wait_ms": 0.0, "max_wait_ms": 0.0, "max_queued": 0,
+                      "throttled": 0, "errors": 0}
+
+    @contextmanager
+    def slot(self):
+        t0 = time.perf_counter()
+        with self._lock:
+            self.stats["max_queued"] = max(self.stats["max_queued"], self.conc.waiting + 1)
+        blocked = self.conc.acquire()
+        s = Slot()
+        try:
+            wait = self.bucket.reserve()
+            if wait > 0:
+                time.sleep(wait)
+            ms = (time.perf_counter() - t0) * 1000.0
+            timing.add("ratelimit_wait", ms)
+            with self._lock:
+                self.stats["requests"] += 1
+                self.stats["wait_ms"] += ms
+                self.stats["max_wait_ms"] = max(self.stats["max_wait_ms"], ms)
+                if blocked or wait > 0:
+                    self.stats["waited"] += 1
+            yield s
+        finally:
+            overloaded = s.status == 429 or s.status >= 500 or s.status == 0  # 0 — ответа нет (обрыв, таймаут)
+            if s.status == 429:
+                self.bucket.pause(_retry_after(s.retry_after))
+            with self._lock:
+                if s.status == 429:
+                    self.stats["throttled"] += 1
+                elif overloaded:
+                    self.stats["errors"] += 1
+            self.conc.release(overloaded)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            out = dict(self.stats)
+        n = out["requests"]
+        wait_ms = out.pop("wait_ms")
+        out["avg_wait_ms"] = round(wait_ms / n, 1) if n else 0.0
+        out["max_wait_ms"] = round(out["max_wait_ms"], 1)
+        out.update(rate=self.bucket.rate, burst=int(self.bucket.burst), limit=round(self.conc.limit, 2),
+                   max_concurrency=self.conc.max_limit, inflight=self.conc.inflight, queued=self.conc.waiting,
+                   cuts=self.conc.cuts)
+        return out
+
+
+def _retry_after(value) -> float:
+    try:
+        return max(1.0, float(value))
+    except (TypeError, ValueError):
+        return DEFAULT_PAUSE_SEC  # HTTP-дата или пусто
+
+
+class RateLimiter:
+    """limits: хост -> (rate в секунду, burst, макс. параллельно). Прочие хосты — без ограничений."""
+
+    def __init__(self, limits: dict, shared_path: Path | None = None):
+        shared = _SharedBuckets(shared_path) if shared_path else None
+        self._hosts = {h: HostLimiter(h, *cfg, shared=shared) for h, cfg in limits.items()}
+
+    @contextmanager
+    def slot(self, url: str):
+        lim = self._hosts.get(urlparse(url).hostname or "")
+        if lim is None:
+            yield Slot()
+            return
+        with lim.slot() as s:
+            yield s
+
+    def snapshot(self) -> dict:
+        return {h: lim.snapshot() for h, lim in self._hosts.items()}
@@ -21,6 +21,10 @@ const sliderWrap = $("#spinSliderWrap");
 const slider = $("#spinSlider");
 const btnDelete = $("#btnDelete");
 
+// статический режим (выгрузка static_export.py для nginx/CDN): каталог и манифесты — файлы рядом с index.html
+const STATIC_BASE = document.querySelector('meta[name="gallery-static"]')?.content || "";
+const assetUrl = u => (STATIC_BASE && u && !/^(\/|https?:)/.test(u)) ? STATIC_BASE + u : u;
+
 let scene, camera, renderer, controls, mesh;
 let raf = 0;
 let currentDatasetId = null;
@@ -51,7 +55,9 @@ document.addEventListener("DOMContentLoaded", () => fetchDatasets());
 // ---------- Datasets ----------
 async function fetchDatasets() {
     try {
-        const res = await fetch("/api/datasets", {cache: "no-store"});
+        const res = STATIC_BASE
+            ? await fetch(`${STATIC_BASE}catalog.json`, {cache: "no-cache"})
+            : await fetch("/api/datasets", {cache: "no-store"});
         if (!res.ok) throw new Error(`HTTP ${res.status}`);
         const data = await res.json();
         datasetsWrap.innerHTML = "";
@@ -67,6 +73,11 @@ async function fetchDatasets() {
     }
 }
 
+function fmtBytes(n) {
+    if (n < 1024 * 1024) return `${Math.round(n / 1024)} КБ`;
+    return `${(n / 1024 / 1024).toFixed(1)} МБ`;
+}
+
 function card(d) {
     const el = document.createElement("div");
     el.className = "card";
@@ -75,8 +86,8 @@ function card(d) {
       <strong title="${escapeHtml(d.id)}">${escapeHtml(d.title)}</strong>
       <span class="badge ${d.mode === "model" ? "ready" : "processing"}">${d.mode}</span>
     </div>
-    <div class="meta">папка: ${escapeHtml(d.id)} • фото: ${d.images}</div>
-    ${d.thumb ? `<img src="${d.thumb}" alt="" style="width:100%;height:140px;object-fit:cover;border-radius:.6rem;border:1px solid #1a2029" />` : ""}
+    <div class="meta">папка: ${escapeHtml(d.id)} • фото: ${d.images}${d.bytes ? ` • ${fmtBytes(d.bytes)}` : ""}</div>
+    ${d.thumb ? `<img src="${assetUrl(d.thumb)}" alt="" style="width:100%;height:140px;object-fit:cover;border-radius:.6rem;border:1px solid #1a2029" />` : ""}
     <div class="row"><button data-open ${d.mode === "empty" ? "disabled" : ""}>Открыть</button></div>`;
     el.querySelector("[data-open]").onclick = () => openViewer(d);
     return el;
@@ -144,15 +155,16 @@ function openViewer(d) {
     if (d.mode === "model" && d.model_url) {
         viewerMode.textContent = "3D";
         viewerMode.className = "badge ready";
-        initThreeView(d.model_type, d.model_url);
+        initThreeView(d.model_type, assetUrl(d.model_url));
     } else {
         viewerMode.textContent = "spin";
         viewerMode.className = "badge processing";
-        initSpinView(d.id);
+        initSpinView(d.id, d.manifest);
     }
 }
 
 btnHome && (btnHome.onclick = () => {
+    currentDatasetId = null;
     disposeThree();
     disposeSpin();
     pageViewer.style.display = "none";
@@ -180,7 +192,7 @@ btnDelete && (btnDelete.onclick = async () => {
 });
 
 // ---------- Spin (Canvas + ImageBitmap) ----------
-async function initSpinView(datasetRel) {
+async function initSpinView(datasetRel, manifest) {
     disposeThree();
 
     if (!canvasSpin) {
@@ -199,9 +211,25 @@ async function initSpinView(datasetRel) {
     loading.textContent = "Подготовка…";
     resizeSpinCanvas();
 
-    // получаем только webp
-    const res = await fetch(`/api/spin/${encodeURIComponent(datasetRel)}?w=1280&max=90`, {cache: "no-store"});
-    let urls = await res.json();
+    // получаем только webp; 202 — кэш собирается в фоне, опрашиваем по retry_after
+    let urls = null;
+    if (STATIC_BASE && manifest) {
+        // манифест и кадры неизменяемы (имена по хешу) — порядок уже верный, пересортировка не нужна
+        try {
+            const res = await fetch(assetUrl(manifest), {cache: "force-cache"});
+            urls = (await res.json()).frames.map(assetUrl);
+        } catch {
+            urls = null;
+        }
+    }
+    while (!urls && currentDatasetId === datasetRel) {
+        const res = await fetch(`/api/spin/${encodeURIComponent(datasetRel)}?w=1280&max=90`, {cache: "no-store"});
+        urls = await res.json();
+        if (res.status !== 202) break;
+        loading.textContent = urls.total ? `Подготовка кадров… (${urls.done}/${urls.total})` : "Подготовка кадров…";
+        await new Promise(r => setTimeout(r, 1000 * (urls.retry_after || 1)));
+    }
+    if (currentDatasetId !== datasetRel) return;
     if (!Array.isArray(urls)) {
         loading.textContent = "Ошибка: не удалось получить кадры";
         return;
@@ -211,7 +239,7 @@ async function initSpinView(datasetRel) {
         const m = u.match(/(\d+)(?=\.[a-z0-9]+$)/i);
         return m ? parseInt(m[1], 10) : Number.MAX_SAFE_INTEGER;
     };
-    urls = urls.slice().sort((a, b) => num(a) - num(b));
+    if (!manifest) urls = urls.slice().sort((a, b) => num(a) - num(b));
 
     const {bitmaps} = await preloadBitmaps(urls, (done, total) => {
         loading.textContent = `Загрузка кадров… (${done}/${total})`;
@@ -220,6 +220,7 @@
     const totalCount = $("totalCount");
     const queueSizeEl = $("queueSize");
     const queueBadge = queueSizeEl ? queueSizeEl.parentElement : null;
+    const syncStatusEl = $("syncStatus");
     const pageJumpTop = $("pageJump");
     const btnGoPageTop = $("btnGoPage");
     const pageJumpBottom = $("pageJumpBottom");
@@ -244,9 +245,11 @@
         total: 0,
         picked: new Map(),
         cache: new Map(),
-        queue: [],
         inflight: false,
-        snapshotVersion: 0
+        snapshotVersion: 0,
+        delta: {add: new Map(), remove: new Set()}, // ещё не отправленные изменения выборки
+        serverVersion: null, // версия выборки на сервере, от которой считаем дельты
+        jobs: new Map() // job_id -> Promise итога (за одной задачей следим один раз)
     };
 
     // --- сетка
@@ -311,9 +314,9 @@
         if (totalCount) totalCount.textContent = String(state.total || 0);
         if (pageTop) pageTop.textContent = String(state.page);
         if (pageBottom) pageBottom.textContent = String(state.page);
-        if (queueSizeEl) queueSizeEl.textContent = String(state.queue.length);
+        if (queueSizeEl) queueSizeEl.textContent = String(pendingCount());
         if (queueBadge) {
-            const has = state.queue.length > 0;
+            const has = pendingCount() > 0;
             queueBadge.style.background = has ? "#1f1a0a" : "#0f1a13";
             queueBadge.style.borderColor = has ? "#6f5d2b" : "#1f5134";
             queueBadge.style.color = has ? "#ffe3a1" : "#b3ffd8";
@@ -360,6 +363,7 @@
             photo_id: String(it.photo_id),
             observation_id: String(it.observation_id || ""),
             best_url: String(it.best_url || it.thumb_url || ""),
+            thumb_url: String(it.thumb_url || ""),
             width: it.width || "",
             height: it.height || "",
             license: String(it.license || ""),
@@ -456,9 +460,11 @@
             const was = state.picked.has(key);
             if (was) {
                 state.picked.delete(key);
+                if (!state.delta.add.delete(key)) state.delta.remove.add(key);
                 card.style.outline = "1px solid #1a2029";
             } else {
                 state.picked.set(key, it);
+                if (!state.delta.remove.delete(key)) state.delta.add.set(key, it);
                 card.style.outline = "3px solid var(--acc)";
             }
             updateBadges();
@@ -476,6 +482,7 @@
         });
         const js = await r.json();
         if (!js.ok) return;
+        state.serverVersion = Number(js.version || 0);
         state.picked.clear();
         (js.items || []).forEach(it => {
             const pid = String(it.photo_id || "");
@@ -484,6 +491,7 @@
                 photo_id: pid,
                 observation_id: String(it.observation_id || ""),
                 best_url: String(it.best_url || ""),
+                thumb_url: String(it.thumb_url || ""),
                 width: it.width || "",
                 height: it.height || "",
                 license: String(it.license || ""),
@@ -534,130 +542,246 @@
         }
     }
 
-    // ---------- Надёжный POST с таймаутом + fallback ----------
+    // ---------- Sync: POST ставит фоновую задачу (202 + job_id), итог — по SSE ----------
     const SYNC_TIMEOUT_MS = 15000;
+    const JOB_POLL_MS = 1000;
 
     async function postSync(payload) {
         const controller = new AbortController();
         const t = setTimeout(() => controller.abort(), SYNC_TIMEOUT_MS);
-        const bodyStr = JSON.stringify(payload);
         try {
             const resp = await fetch("/api/collect/sync", {
                 method: "POST",
                 headers: {"Content-Type": "application/json", "Cache-Control": "no-store"},
-                body: bodyStr,
+                body: JSON.stringify(payload),
                 signal: controller.signal,
                 credentials: "same-origin",
-                cache: "no-store",
-                keepalive: false
+                cache: "no-store"
             });
-            clearTimeout(t);
             let js = {};
             try {
                 js = await resp.json();
             } catch {
             }
             return {ok: resp.ok, status: resp.status, body: js};
-        } catch (e) {
+        } finally {
             clearTimeout(t);
-            try {
-                const ok = navigator.sendBeacon &&
-                    navigator.sendBeacon("/api/collect/sync", new Blob([bodyStr], {type: "application/json"}));
-                if (!ok) console.error("sendBeacon failed");
-            } catch (e2) {
-                console.error("beacon error", e2);
-            }
-            throw e;
         }
     }
 
-    // ---------- Очередь/воркер ----------
-    function snapshotSelection() {
+    function showJobProgress(job) {
+        if (!syncStatusEl || !job) return;
+        const p = job.progress || {};
+        const failed = (p.failed_ids || []).length;
+        const skipped = ((job.result || {}).skipped_ids || []).length;
+        const dups = (p.duplicates ? `, похожих ${p.duplicates}` : "") + (skipped ? ` (не сохранено ${skipped})` : "");
+        if (job.status === "queued") {
+            syncStatusEl.textContent = job.coalesced ? `в очереди (+${job.coalesced})` : "в очереди";
+        } else if (job.status === "running") {
+            syncStatusEl.textContent = `${p.downloaded || 0}/${p.total || 0}` + (failed ? `, ошибок ${failed}` : "");
+        } else {
+            syncStatusEl.textContent = job.status === "failed" ? "ошибка" : (failed ? `готово, ошибок ${failed}` : "готово") + dups;
+        }
+    }
+
+    // ждём завершения задачи: SSE, а если не вышло — опрос
+    function watchJob(jobId) {
+        return new Promise(resolve => {
+            const poll = async () => {
+                try {
+                    const resp = await fetch(`/api/collect/jobs/${encodeURIComponent(jobId)}`, {cache: "no-store"});
+                    if (resp.status === 404) return resolve(null);
+                    const job = (await resp.json()).job;
+                    showJobProgress(job);
+                    if (job.status === "done" || job.status === "failed") return resolve(job);
+                } catch {
+                }
+                setTimeout(poll, JOB_POLL_MS);
+            };
+            if (!window.EventSource) return poll();
+            const es = new EventSource(`/api/collect/jobs/${encodeURIComponent(jobId)}/events`);
+            es.addEventListener("progress", e => showJobProgress(JSON.parse(e.data)));
+            es.addEventListener("done", e => {
+                es.close();
+                const job = JSON.parse(e.data);
+                showJobProgress(job);
+                resolve(job);
+            });
+            es.addEventListener("gone", () => {
+                es.close();
+                resolve(null);
+            });
+            es.onerror = () => {
+                es.close();
+                poll();
+            };
+        });
+    }
+
+    function trackJob(res) {
+        const jobId = res?.body?.job_id;
+        if (!jobId) return;
+        showJobProgress(res.body.job);
+        if (state.jobs.has(jobId)) return; // склеено с уже отслеживаемой задачей
+        const p = watchJob(jobId)
+            .then(async job => {
+                await applySyncResult(job?.result);
+                return job;
+            })
+            .finally(() => state.jobs.delete(jobId));
+        state.jobs.set(jobId, p);
+    }
+
+    // --- моментальное обновление счётчиков по числам с бэка
+    async function applySyncResult(body) {
+        const added = Number(body?.added || 0);
+        const removed = Number(body?.removed || 0);
+        const delta = added - removed;
+        if (delta === 0) return;
+
+        const dayEl = document.getElementById("cntDay");
+        const weekEl = document.getElementById("cntWeek");
+
+        const prevDay = Number(dayEl?.textContent || 0);
+        const newDay = Math.max(0, prevDay + delta);
+
+        if (dayEl) dayEl.textContent = String(newDay);
+        if (weekEl) weekEl.textContent = String(Math.max(0, Number(weekEl?.textContent || 0) + delta));
+
+        // огонёк: включить/выключить
+        updateFlameFromCounts();
+
+        // стрик (локально): если пересекли порог вверх — как минимум 1; если вниз — 0
+        if (prevDay < GOAL && newDay >= GOAL) {
+            setStreakNumber(1);
+        } else if (prevDay >= GOAL && newDay < GOAL) {
+            setStreakNumber(0);
+        }
+
+        // подтянуть «истину» с бэка (точный streak_days)
+        try {
+            await fetchMe();
+        } catch {
+        }
+    }
+
+    // ---------- Очередь/воркер: дельты выборки + сверка полным sync при конфликте ----------
+    function pendingCount() {
+        return state.delta.add.size + state.delta.remove.size;
+    }
+
+    function taxonFields() {
         return {
-            version: ++state.snapshotVersion,
             taxon_id: state.inat_taxon_id,
             latin: state.latin || "",
             gbif_id: state.gbif_id || "",
             common_en: state.common_en || "",
-            common_ru: state.common_ru || "",
+            common_ru: state.common_ru || ""
+        };
+    }
+
+    function snapshotSelection() {
+        return {
+            version: ++state.snapshotVersion,
+            ...taxonFields(),
+            base_version: state.serverVersion,
             selected: Array.from(state.picked.values())
         };
     }
 
     function enqueueSync() {
-        const snap = snapshotSelection();
-        state.queue = [snap]; // коалесим до одного «последнего»
         updateBadges();
         if (!state.inflight) processQueue();
     }
 
+    async function postDelta(batch) {
+        const resp = await fetch("/api/collect/delta", {
+            method: "POST",
+            headers: {"Content-Type": "application/json", "Cache-Control": "no-store"},
+            body: JSON.stringify({...taxonFields(), base_version: state.serverVersion, ...batch}),
+            credentials: "same-origin",
+            cache: "no-store"
+        });
+        let js = {};
+        try {
+            js = await resp.json();
+        } catch {
+        }
+        return {ok: resp.ok, status: resp.status, body: js};
+    }
+
+    // сервер ушёл вперёд (другая вкладка/куратор): отправляем всю выборку от его версии и ждём итога
+    async function reconcile(version) {
+        for (let attempt = 0; attempt < 3; attempt++) {
+            state.serverVersion = version;
+            const res = await postSync(snapshotSelection());
+            trackJob(res);
+            const job = res?.body?.job_id ? await state.jobs.get(res.body.job_id) : null;
+            version = Number(job?.result?.version ?? version);
+            state.serverVersion = version;
+            if (job?.result?.error !== "version conflict") return;
+        }
+    }
+
     async function processQueue() {
         if (state.inflight) return;
         state.inflight = true;
         try {
-            while (state.queue.length > 0) {
-                const current = state.queue[0];
+            while (pendingCount() > 0 && state.inat_taxon_id) {
+                const batch = {add: Array.from(state.delta.add.values()), remove: Array.from(state.delta.remove)};
+                state.delta = {add: new Map(), remove: new Set()};
+                updateBadges();
                 try {
-                    const res = await postSync(current);
-
-                    // --- моментальное обновление по числам с бэка
-                    const added = Number(res?.body?.added || 0);
-                    const removed = Number(res?.body?.removed || 0);
-                    const delta = added - removed;
-
-                    if (delta !== 0) {
-                        const dayEl = document.getElementById("cntDay");
-                        const weekEl = document.getElementById("cntWeek");
-
-                        const prevDay = Number(dayEl?.textContent || 0);
-                        const newDay = Math.max(0, prevDay + delta);
-
-                        if (dayEl) dayEl.textContent = String(newDay);
-                        if (weekEl) weekEl.textContent = String(Math.max(0, Number(weekEl?.textContent || 0) + delta));
-
-                        // огонёк: включить/выключить
-                        updateFlameFromCounts();
-
-                        // стрик (локально): если пересекли порог вверх — как минимум 1; если вниз — 0
-                        if (prevDay < GOAL && newDay >= GOAL) {
-                            setStreakNumber(1);
-                        } else if (prevDay >= GOAL && newDay < GOAL) {
-                            setStreakNumber(0);
-                        }
-
-                        // подтянуть «истину» с бэка (точный streak_days)
-                        try {
-                            await fetchMe();
-                        } catch {
-                        }
+                    const res = await postDelta(batch);
+                    if (res.status === 409) {
+                        await reconcile(Number(res.body.version || 0));
+                        continue;
                     }
-
-                    // даже при ok:false снимаем задание, чтобы очередь не висла
-                    state.queue.shift();
-                    updateBadges();
+                    if (!res.ok) {
+                        console.error("delta error", res.status, res.body);
+                        continue; // битый запрос повторять бессмысленно
+                    }
+                    state.serverVersion = Number(res.body.version);
+                    applySyncResult(res.body);
+                    trackJob(res); // загрузка новых фото — фоном
                 } catch (e) {
+                    // сеть: возвращаем пачку в очередь (не затирая более свежие клики)
+                    batch.add.forEach(it => {
+                        const pid = String(it.photo_id);
+                        if (!state.delta.remove.has(pid)) state.delta.add.set(pid, it);
+                    });
+                    batch.remove.forEach(pid => {
+                        if (!state.delta.add.has(pid)) state.delta.remove.add(pid);
+                    });
                     console.error("sync error", e);
                     break;
                 }
             }
         } finally {
             state.inflight = false;
-            if (state.queue.length > 0) setTimeout(processQueue, 0);
+            updateBadges();
         }
     }
 
     document.addEventListener("visibilitychange", () => {
-        if (!document.hidden && state.queue.length > 0 && !state.inflight) {
+        if (!document.hidden && pendingCount() > 0 && !state.inflight) {
             processQueue();
         }
     });
 
+    // уходим со страницы с неотправленными изменениями — отдаём всю выборку маяком (сервер поставит задачу)
+    window.addEventListener("pagehide", () => {
+        if (pendingCount() === 0 || !navigator.sendBeacon) return;
+        navigator.sendBeacon("/api/collect/sync", new Blob([JSON.stringify(snapshotSelection())], {type: "application/json"}));
+    });
+
     // ---------- actions ----------
     btnLoad?.addEventListener("click", async () => {
         try {
             state.picked.clear();
             state.cache.clear();
-            state.queue = [];
+            state.delta = {add: new Map(), remove: new Set()};
+            state.serverVersion = null;
             state.inflight = false;
             updateBadges();
 
@@ -672,7 +796,7 @@
             // init sync без очереди
             const initSnap = snapshotSelection();
             try {
-                await postSync(initSnap);
+                trackJob(await postSync(initSnap));
             } catch (e) {
                 console.error(e);
             }
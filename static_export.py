@@ -0,0 +1,239 @@
+import hashlib, json, os, threading, time
+from pathlib import Path
+from io import BytesIO
+
+from storage import LocalStorage
+from threed import (
+    BASE_DIR, DATA_DIR, safe_rel_path, find_datasets, cache_store, data_store,
+    list_cached_webp, list_cached_webp_raw, encoders, log,
+)
+
+# ---- статическая выгрузка галереи (для nginx/CDN) ----
+# Раскладка OUT:
+#   index.html, static/app.<hash>.js, static/styles.<hash>.css — вьюер в статическом режиме
+#   catalog.json            — как /api/datasets; единственный изменяемый файл (короткий кэш)
+#   m/<hash>.json           — манифест спина набора: {"id", "frames": [...]}
+#   f/<hash>.<ext>          — кадры, постеры, модели; имя = sha256 содержимого, можно кэшировать навсегда
+# URL в catalog.json и манифестах — относительные от корня OUT.
+# nginx:
+#   location /gallery/ { alias /srv/gallery/; }
+#   location ~ ^/gallery/(f|m|static)/ { expires max; add_header Cache-Control "public, immutable"; }
+#   location /api/ { proxy_pass http://127.0.0.1:9013; }   # загрузка/удаление — по-прежнему в Python
+
+POSTER_W = 480
+HASH_LEN = 20
+PRUNE_GRACE_SEC = 24 * 3600  # старые файлы ещё нужны клиентам с прежним catalog.json
+_MEMO_NAME = ".hashes.json"
+
+
+class _Exporter:
+    def __init__(self, out: Path):
+        self.out = out
+        self.memo_path = out / _MEMO_NAME
+        try:
+            self.memo = json.loads(self.memo_path.read_text(encoding="utf-8"))
+        except Exception:
+            self.memo = {}
+        self.used: set[str] = set()
+        self.written = 0
+        self.local = LocalStorage(DATA_DIR)
+
+    # --- файлы с адресацией по содержимому ---
+    def _write_blob(self, data: bytes, sub: str, ext: str) -> str:
+        h = hashlib.sha256(data).hexdigest()[:HASH_LEN]
+        rel = f"{sub}/{h}{ext}"
+        dst = self.out / rel
+        if not dst.exists():
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            tmp = dst.with_name(dst.name + ".part")
+            tmp.write_bytes(data)
+            os.replace(tmp, dst)
+            self.written += 1
+        self.used.add(rel)
+        return rel
+
+    def _copy(self, store, key: str, memo_key: str, transform=None) -> str | None:
+        info = store.stat(key)
+        if info is None:
+            return None
+        sig = [info.size, int(info.mtime)]
+        hit = self.memo.get(memo_key)
+        if hit and hit[:2] == sig and (self.out / hit[2]).exists():
+            self.used.add(hit[2])
+            return hit[2]
+        ext = Path(key).suffix.lower()
+        with store.open(key) as f:
+            if transform is not None:
+                data, ext = transform(f.read())
+                rel = self._write_blob(data, "f", ext)
+            else:
+                rel = self._stream_blob(f, "f", ext)
+        self.memo[memo_key] = sig + [rel]
+        return rel
+
+    def _stream_blob(self, f, sub: str, ext: str) -> str:
+        """Как _write_blob, но потоком (модели бывают большими): хешируем во временный файл."""
+        (self.out / sub).mkdir(parents=True, exist_ok=True)
+        tmp = self.out / sub / f".tmp-{os.getpid()}-{threading.get_ident()}"
+        h = hashlib.sha256()
+        try:
+            with open(tmp, "wb") as w:
+                while True:
+                    chunk = f.read(256 * 1024)
+                    if not chunk: break
+                    h.update(chunk)
+                    w.write(chunk)
+            rel = f"{sub}/{h.hexdigest()[:HASH_LEN]}{ext}"
+            if (self.out / rel).exists():
+                tmp.unlink()
+            else:
+                os.replace(tmp, self.out / rel)
+                self.written += 1
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        self.used.add(rel)
+        return rel
+
+    def _source(self, url: str):
+        """URL приложения (/spin-cache/..., /files/...) -> (хранилище, ключ, ключ мемо)."""
+        if url.startswith("/spin-cache/"):
+            key = url[len("/spin-cache/"):]
+            return cache_store(), key, f"spin:{key}"
+        if url.startswith("/files/"):
+            key = url[len("/files/"):]
+            if self.local.stat(key) is not None:  # оригиналы до сборки кэша — только на диске
+                return self.local, key, f"orig:{key}"
+            return data_store(), key, f"data:{key}"
+        return None, None, None
+
+    def frame(self, url: str) -> str | None:
+        store, key, mk = self._source(url)
+        return self._copy(store, key, mk) if store else None
+
+    def poster(self, url: str) -> str | None:
+        store, key, mk = self._source(url)
+        if store is None:
+            return None
+        if not encoders()["pil"]:
+            return self._copy(store, key, mk)
+        return self._copy(store, key, f"poster{POSTER_W}:{mk}", transform=_make_poster)
+
+    def json_blob(self, obj) -> str:
+        data = json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return self._write_blob(data, "m", ".json")
+
+    def write_file(self, rel: str, data: bytes):
+        dst = self.out / rel
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dst.with_name(dst.name + ".part")
+        tmp.write_bytes(data)
+        os.replace(tmp, dst)
+
+    def save_memo(self):
+        self.memo = {k: v for k, v in self.memo.items() if v[2] in self.used}
+        self.write_file(_MEMO_NAME, json.dumps(self.memo).encode("utf-8"))
+
+
+def _make_poster(data: bytes) -> tuple[bytes, str]:
+    from PIL import Image, ImageOps
+
+    with Image.open(BytesIO(data)) as im:
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail((POSTER_W, POSTER_W * 10), encoders()["resample"])
+        if im.mode not in ("RGB", "RGBA"): im = im.convert("RGB")
+        buf = BytesIO()
+        im.save(buf, "WEBP", quality=75, method=4)
+    return buf.getvalue(), ".webp"
+
+
+def _spin_frames(dataset_id: str) -> list[str]:
+    rel = safe_rel_path(dataset_id)
+    keys = list_cached_webp(rel) if (DATA_DIR / rel).is_dir() else list_cached_webp_raw(rel)
+    return [f"/spin-cache/{k}" for k in keys]
+
+
+def _viewer(ex: _Exporter):
+    """index.html вьюера с хешированными app.js/styles.css и меткой статического режима."""
+    html = (BASE_DIR / "templates" / "index.html").read_text(encoding="utf-8")
+    for name in ("app.js", "styles.css"):
+        data = (BASE_DIR / "static" / name).read_bytes()
+        stem, ext = os.path.splitext(name)
+        rel = f"static/{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LEN]}{ext}"
+        if not (ex.out / rel).exists():
+            ex.write_file(rel, data)
+        ex.used.add(rel)
+        html = html.replace(f'"/static/{name}"', f'"{rel}"')
+    mark = '<meta name="gallery-static" content="./"/>'
+    anchor = '<meta charset="utf-8"/>' if '<meta charset="utf-8"/>' in html else "<head>"
+    html = html.replace(anchor, f"{anchor}\n    {mark}", 1)
+    ex.write_file("index.html", html.encode("utf-8"))
+
+
+def _prune(ex: _Exporter, grace_sec: int) -> int:
+    now, removed = time.time(), 0
+    for sub in ("f", "m", "static"):
+        d = ex.out / sub
+        if not d.is_dir(): continue
+        for p in d.iterdir():
+            rel = f"{sub}/{p.name}"
+            if rel in ex.used or not p.is_file(): continue
+            try:
+                if now - p.stat().st_mtime > grace_sec:
+                    p.unlink()
+                    removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+_export_lock = threading.Lock()
+
+
+def export_static(out_dir: Path, prune: bool = False, grace_sec: int = PRUNE_GRACE_SEC) -> dict:
+    """Полная (инкрементальная) выгрузка: неизменившиеся файлы не перечитываются и не пишутся."""
+    out_dir = Path(out_dir)
+    t0 = time.perf_counter()
+    with _export_lock:
+        out_dir.mkdir(parents=True, exist_ok=True)
+        ex = _Exporter(out_dir)
+        catalog = []
+        for d in find_datasets():
+            item = dict(d)
+            item["thumb"] = (ex.poster(d["thumb"]) or "") if d["thumb"] else ""
+            if d["mode"] == "model" and d["model_url"]:
+                item["model_url"] = ex.frame(d["model_url"]) or ""
+            if d["mode"] == "spin":
+                frames = [f for f in (ex.frame(u) for u in _spin_frames(d["id"])) if f]
+                item["manifest"] = ex.json_blob({"id": d["id"], "frames": frames})
+            catalog.append(item)
+        _viewer(ex)
+        ex.write_file("catalog.json", json.dumps(catalog, ensure_ascii=False).encode("utf-8"))
+        ex.save_memo()
+        removed = _prune(ex, grace_sec) if prune else 0
+    res = {"datasets": len(catalog), "files": len(ex.used), "written": ex.written, "pruned": removed,
+           "ms": round((time.perf_counter() - t0) * 1000.0, 1)}
+    log.info("static export -> %s", out_dir, extra=res)
+    return res
+
+
+# ---- фоновая перевыгрузка после изменений (склеиваем частые события) ----
+_timer: threading.Timer | None = None
+_timer_lock = threading.Lock()
+
+
+def schedule_export(out_dir: Path, delay: float = 2.0):
+    global _timer
+
+    def run():
+        try:
+            export_static(out_dir, prune=True)
+        except Exception as e:
+            log.error("static export failed: %s", e)
+
+    with _timer_lock:
+        if _timer is not None:
+            _timer.cancel()
+        _timer = threading.Timer(delay, run)
+        _timer.daemon = True
+        _timer.start()
@@ -0,0 +1,240 @@
+import os, shutil, stat as _stat
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+# ---- Хранилище наборов и кэша: локальная ФС или S3-совместимое (MinIO, Ceph, AWS) ----
+# Ключи — posix-пути относительно корня хранилища, без ведущего «/».
+
+S3_DELETE_BATCH = 1000  # предел DeleteObjects за один запрос
+
+
+@dataclass
+class ObjInfo:
+    key: str
+    size: int
+    mtime: float
+
+
+class StorageBackend:
+    """Интерфейс: list / stat / open / put / delete / presign."""
+
+    name = "base"
+    can_presign = False
+
+    def list(self, prefix: str = "", recursive: bool = False) -> list[ObjInfo]:
+        """Объекты под prefix (только файлы). recursive=False — лишь прямые потомки."""
+        raise NotImplementedError
+
+    def stat(self, key: str) -> ObjInfo | None:
+        raise NotImplementedError
+
+    def open(self, key: str) -> BinaryIO:
+        """Поток на чтение (вызывающий закрывает). FileNotFoundError, если нет."""
+        raise NotImplementedError
+
+    def put(self, key: str, src: BinaryIO | bytes, content_type: str | None = None):
+        """Запись потоком; объект появляется атомарно."""
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def delete_prefix(self, prefix: str):
+        raise NotImplementedError
+
+    def presign(self, key: str, expires: int = 3600) -> str | None:
+        """Прямая ссылка на объект (None — отдавать через приложение)."""
+        return None
+
+    def local_path(self, key: str) -> Path | None:
+        """Путь на локальном диске, если объект там (для send_file)."""
+        return None
+
+
+def _norm_prefix(prefix: str) -> str:
+    prefix = (prefix or "").strip("/")
+    return prefix + "/" if prefix else ""
+
+
+class LocalStorage(StorageBackend):
+    name = "local"
+
+    def __init__(self, root: Path, skip_top: tuple = ()):
+        self.root = Path(root)
+        self.skip_top = set(skip_top)  # служебные папки верхнего уровня (_cache, _uploads)
+        self._resolved = None
+
+    def _path(self, key: str) -> Path:
+        if self._resolved is None:
+            self._resolved = self.root.resolve()
+        full = (self.root / key).resolve()
+        # по компонентам пути: "../data2/x" под корнем ".../data" — уже снаружи
+        if not full.is_relative_to(self._resolved):
+            raise PermissionError("path traversal")
+        return full
+
+    def list(self, prefix: str = "", recursive: bool = False) -> list[ObjInfo]:
+        prefix = _norm_prefix(prefix)
+        base = self._path(prefix) if prefix else self.root
+        out = []
+        stack = [(base, prefix)]
+        while stack:
+            d, kp = stack.pop()
+            try:
+                it = os.scandir(d)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            with it:
+                for e in it:
+                    if e.is_dir(follow_symlinks=False):
+                        if recursive and not (not kp and e.name in self.skip_top):
+                            stack.append((Path(e.path), f"{kp}{e.name}/"))
+                    elif e.is_file() and not e.name.endswith(".part"):
+                        st = e.stat()
+                        out.append(ObjInfo(f"{kp}{e.name}", st.st_size, st.st_mtime))
+        out.sort(key=lambda o: o.key)
+        return out
+
+    def stat(self, key: str) -> ObjInfo | None:
+        try:
+            st = self._path(key).stat()
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        if _stat.S_ISDIR(st.st_mode):
+            return None
+        return ObjInfo(key, st.st_size, st.st_mtime)
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self._path(key), "rb")
+
+    def put(self, key: str, src: BinaryIO | bytes, content_type: str | None = None):
+        dst = self._path(key)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dst.with_name(dst.name + ".part")
+        try:
+            with open(tmp, "wb") as f:
+                if isinstance(src, (bytes, bytearray, memoryview)):
+                    f.write(src)
+                else:
+                    shutil.copyfileobj(src, f, 256 * 1024)
+            os.replace(tmp, dst)
+        except BaseException:
+            try:
+                tmp.unlink(missing_ok=True)
+            except OSError:
+                pass
+            raise
+
+    def delete(self, key: str):
+        try:
+            self._path(key).unlink(missing_ok=True)
+        except (IsADirectoryError, PermissionError, OSError):
+            pass
+
+    def delete_prefix(self, prefix: str):
+        prefix = _norm_prefix(prefix)
+        if not prefix:
+            raise ValueError("refusing to delete the whole storage")
+        shutil.rmtree(self._path(prefix), ignore_errors=True)
+
+    def local_path(self, key: str) -> Path | None:
+        return self._path(key)
+
+
+class S3Storage(StorageBackend):
+    """
+    S3-совместимое хранилище (boto3 — опциональная зависимость).
+    Для локальной проверки годится MinIO: endpoint_url="http://127.0.0.1:9000".
+    """
+
+    name = "s3"
+    can_presign = True
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: str | None = None,
+                 region: str | None = None, access_key: str | None = None, secret_key: str | None = None):
+        try:
+            import boto3
+            from botocore.config import Config
+        except Exception as e:
+            raise RuntimeError("S3 storage requires boto3 (pip install boto3)") from e
+        self.bucket = bucket
+        self.prefix = _norm_prefix(prefix)
+        self._client = boto3.client(
+            "s3", endpoint_url=endpoint_url, region_name=region,
+            aws_access_key_id=access_key, aws_secret_access_key=secret_key,
+            config=Config(s3={"addressing_style": "path"}, retries={"max_attempts": 5, "mode": "adaptive"},
+                          max_pool_connections=32),
+        )
+        self._missing = (self._client.exceptions.NoSuchKey,)
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key.lstrip("/")
+
+    def list(self, prefix: str = "", recursive: bool = False) -> list[ObjInfo]:
+        full = self.prefix + _norm_prefix(prefix)
+        kw = {"Bucket": self.bucket, "Prefix": full}
+        if not recursive:
+            kw["Delimiter"] = "/"
+        out = []
+        for page in self._client.get_paginator("list_objects_v2").paginate(**kw):
+            for o in page.get("Contents", []) or []:
+                out.append(ObjInfo(o["Key"][len(self.prefix):], int(o["Size"]), o["LastModified"].timestamp()))
+        out.sort(key=lambda o: o.key)
+        return out
+
+    def stat(self, key: str) -> ObjInfo | None:
+        try:
+            h = self._client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except self._client.exceptions.ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return ObjInfo(key, int(h["ContentLength"]), h["LastModified"].timestamp())
+
+    def open(self, key: str) -> BinaryIO:
+        try:
+            return self._client.get_object(Bucket=self.bucket, Key=self._key(key))["Body"]
+        except self._missing as e:
+            raise FileNotFoundError(key) from e
+
+    def put(self, key: str, src: BinaryIO | bytes, content_type: str | None = None):
+        if isinstance(src, (bytes, bytearray, memoryview)):
+            from io import BytesIO
+            src = BytesIO(bytes(src))
+        extra = {"ContentType": content_type} if content_type else None
+        # upload_fileobj — потоковая (multipart) загрузка без буферизации целиком
+        self._client.upload_fileobj(src, self.bucket, self._key(key), ExtraArgs=extra)
+
+    def delete(self, key: str):
+        self._client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def delete_prefix(self, prefix: str):
+        prefix = _norm_prefix(prefix)
+        if not prefix:
+            raise ValueError("refusing to delete the whole storage")
+        keys = [o.key for o in self.list(prefix, recursive=True)]
+        for i in range(0, len(keys), S3_DELETE_BATCH):
+            batch = [{"Key": self._key(k)} for k in keys[i:i + S3_DELETE_BATCH]]
+            self._client.delete_objects(Bucket=self.bucket, Delete={"Objects": batch, "Quiet": True})
+
+    def presign(self, key: str, expires: int = 3600) -> str | None:
+        return self._client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": self._key(key)}, ExpiresIn=expires)
+
+
+def make_storage(cfg: dict | None, local_root: Path, sub: str, skip_top: tuple = ()) -> StorageBackend:
+    """
+    cfg — секция "storage" из config.json. sub — подкаталог/префикс ("spin" или "data").
+    Без cfg (или backend=local) — прежняя раскладка на диске под local_root.
+    """
+    cfg = cfg or {}
+    if (cfg.get("backend") or "local") == "local":
+        return LocalStorage(local_root, skip_top=skip_top)
+    if cfg["backend"] == "s3":
+        return S3Storage(
+            bucket=cfg["bucket"], prefix=_norm_prefix(cfg.get("prefix", "")) + sub,
+            endpoint_url=cfg.get("endpoint_url"), region=cfg.get("region"),
+            access_key=cfg.get("access_key"), secret_key=cfg.get("secret_key"),
+        )
+    raise ValueError(f"unknown storage backend: {cfg['backend']}")
@@ -0,0 +1,98 @@
+import csv, re, sqlite3, threading, time
+from pathlib import Path
+
+# ---- локальный индекс таксонов: GBIF id / iNat id / латынь -> запись ----
+# Запись: {"inat_taxon_id", "latin", "common_en", "common_ru", "gbif_id"}.
+# Сидируется из species.csv собранных видов, пополняется каждым удачным резолвом.
+
+_FIELDS = ("inat_taxon_id", "latin", "common_en", "common_ru", "gbif_id")
+
+
+def norm_latin(name: str) -> str:
+    return re.sub(r"\s+", " ", (name or "").strip().lower())
+
+
+class TaxonIndex:
+    def __init__(self, path: Path, seed_root: Path | None = None):
+        self.path = Path(path)
+        self.seed_root = seed_root
+        self._local = threading.local()
+        self._seed_lock = threading.Lock()
+        self._seeded = False
+
+    def _db(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            con = sqlite3.connect(str(self.path), timeout=10)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.executescript("""
+                CREATE TABLE IF NOT EXISTS taxa (
+                    inat_taxon_id INTEGER PRIMARY KEY, latin TEXT, latin_norm TEXT,
+                    common_en TEXT, common_ru TEXT, gbif_id TEXT, updated REAL);
+                CREATE INDEX IF NOT EXISTS taxa_latin ON taxa(latin_norm);
+                CREATE INDEX IF NOT EXISTS taxa_gbif ON taxa(gbif_id);
+            """)
+            self._local.con = con
+        self._ensure_seeded()
+        return con
+
+    def _ensure_seeded(self):
+        if self._seeded or self.seed_root is None:
+            return
+        with self._seed_lock:
+            if self._seeded:
+                return
+            self._seeded = True  # до seed(): он сам зовёт _db()
+            self.seed(self.seed_root)
+
+    def seed(self, root: Path) -> int:
+        """Записи из <root>/*/species.csv (ничего не затираем — сетевые данные свежее)."""
+        n = 0
+        for p in sorted(Path(root).glob("*/species.csv")):
+            try:
+                with p.open("r", newline="", encoding="utf-8-sig") as f:
+                    for row in csv.DictReader(f):
+                        tid = str(row.get("taxon_id") or "").strip()
+                        if not tid.isdigit():
+                            continue
+                        n += self.put({"inat_taxon_id": int(tid), "latin": row.get("latin") or "",
+                                       "common_en": row.get("common_en") or "", "common_ru": row.get("common_ru") or "",
+                                       "gbif_id": row.get("gbif_id") or ""}, overwrite=False)
+            except (OSError, csv.Error, UnicodeDecodeError):
+                continue
+        return n
+
+    def put(self, rec: dict, overwrite: bool = True) -> int:
+        """Добавить/обновить запись. Пустые поля не затирают известные (gbif_id часто неизвестен)."""
+        tid = int(rec["inat_taxon_id"])
+        con = self._db()
+        with con:
+            old = con.execute("SELECT latin, common_en, common_ru, gbif_id FROM taxa WHERE inat_taxon_id=?",
+                              (tid,)).fetchone()
+            if old is not None and not overwrite:
+                return 0
+            vals = [rec.get(k) or "" for k in _FIELDS[1:]]
+            if old is not None:
+                vals = [v or o or "" for v, o in zip(vals, old)]
+            con.execute("INSERT OR REPLACE INTO taxa (inat_taxon_id, latin, latin_norm, common_en, common_ru, gbif_id,"
+                        " updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (tid, vals[0], norm_latin(vals[0]), vals[1], vals[2], str(vals[3]), time.time()))
+        return 1
+
+    def _one(self, where: str, arg) -> dict | None:
+        row = self._db().execute(f"SELECT {', '.join(_FIELDS)} FROM taxa WHERE {where} LIMIT 1", (arg,)).fetchone()
+        return dict(zip(_FIELDS, row)) if row else None
+
+    def by_inat(self, tid: int) -> dict | None:
+        return self._one("inat_taxon_id=?", int(tid))
+
+    def by_gbif(self, gbif_id: str) -> dict | None:
+        return self._one("gbif_id=?", str(gbif_id))
+
+    def by_latin(self, name: str) -> dict | None:
+        return self._one("latin_norm=?", norm_latin(name))
+
+    def count(self) -> int:
+        return self._db().execute("SELECT COUNT(*) FROM taxa").fetchone()[0]
@@ -0,0 +1,10 @@
+import os, sys, tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# импорт threed/picker настраивает логи (flask.log, slow_requests.jsonl) и данные относительно
+# текущего каталога и GALLERY_DATA_DIR — уводим их из дерева репозитория
+_WORK = tempfile.mkdtemp(prefix="gallery-tests-")
+os.environ.setdefault("GALLERY_DATA_DIR", os.path.join(_WORK, "data"))
+os.chdir(_WORK)
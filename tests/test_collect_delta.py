@@ -0,0 +1,102 @@
+import csv
+
+import pytest
+from flask import Flask
+
+import picker
+from collectdb import CollectDB
+from phash import HashIndex
+from taxindex import TaxonIndex
+
+
+class _Jobs:
+    """Вместо SYNC_JOBS: запоминает задачи докачки, ничего не запускает."""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, payload, user=""):
+        self.submitted.append(payload)
+        return {"id": f"j{len(self.submitted)}"}, False
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    root = tmp_path / "dataset_collect"
+    monkeypatch.setattr(picker, "DATASET_OUT_DIR", root)
+    monkeypatch.setattr(picker, "COLLECT_DB", CollectDB(root / "collect.sqlite"))
+    monkeypatch.setattr(picker, "TAXON_INDEX", TaxonIndex(root / "_cache" / "taxa.sqlite"))
+    monkeypatch.setattr(picker, "PHASH_INDEX", HashIndex())
+    monkeypatch.setattr(picker, "SYNC_JOBS", _Jobs())
+    app = Flask(__name__)
+    app.secret_key = "test"
+    app.register_blueprint(picker.picker_api_bp, url_prefix="/api")
+    return app.test_client()
+
+
+def _photo(pid: str) -> dict:
+    return {"photo_id": pid, "best_url": "", "license": "cc-by"}  # без url — докачка сразу «не удалась»
+
+
+def _delta(client, base_version, add=(), remove=()):
+    return client.post("/api/collect/delta", json={"taxon_id": 7, "latin": "Testus delta", "base_version": base_version,
+                                                   "add": [_photo(p) for p in add], "remove": list(remove)})
+
+
+def test_delta_applies_and_bumps_version(env):
+    r = _delta(env, 0, add=["1", "2"])
+    assert r.status_code == 200
+    assert (r.json["version"], r.json["added"], r.json["removed"]) == (1, 2, 0)
+    assert [row["photo_id"] for row in r.json["rows"]] == ["1", "2"]
+    assert picker.SYNC_JOBS.submitted == [{"taxon_id": 7, "mode": "files"}]
+
+    r = _delta(env, 1, add=["2"])  # повтор без изменения состава — версия та же, задачи нет
+    assert (r.json["version"], r.json["added"], r.json["job_id"]) == (1, 0, None)
+    assert set(picker.COLLECT_DB.selections(7)) == {"1", "2"}
+
+
+def test_delta_stale_version_is_409_and_changes_nothing(env):
+    _delta(env, 0, add=["1"])
+    _delta(env, 1, add=["2"])
+    r = _delta(env, 1, remove=["1"])  # клиент считал от версии 1, а уже 2
+    assert r.status_code == 409
+    assert r.json == {"ok": False, "error": "version conflict", "version": 2}
+    assert set(picker.COLLECT_DB.selections(7)) == {"1", "2"}
+    assert picker.COLLECT_DB.version(7) == 2
+
+
+def test_delta_requires_base_version(env):
+    r = env.post("/api/collect/delta", json={"taxon_id": 7, "add": [_photo("1")]})
+    assert r.status_code == 400
+    assert picker.COLLECT_DB.taxon(7) is None
+
+
+def test_removal_only_delta_exports_csv(env):
+    _delta(env, 0, add=["1", "2"])
+    r = _delta(env, 1, remove=["1", "404"])
+    assert (r.json["version"], r.json["removed_ids"], r.json["job_id"]) == (2, ["1"], None)
+    d = picker.COLLECT_DB.taxon(7)["dir"]
+    with open(f"{d}/selected.csv", encoding="utf-8-sig") as f:
+        assert [row["photo_id"] for row in csv.DictReader(f)] == ["2"]
+
+
+def test_conflict_then_full_sync_reconciles(env):
+    _delta(env, 0, add=["1", "2"])
+    _delta(env, 1, add=["3"])  # другая вкладка ушла вперёд
+    r = _delta(env, 1, remove=["2"])
+    assert r.status_code == 409
+
+    # полная сверка от устаревшей версии тоже отклоняется — чужую дельту не откатываем
+    res = picker._collect_sync({"taxon_id": 7, "base_version": 1, "selected": [_photo("1")]})
+    assert res == {"ok": False, "error": "version conflict", "version": 2}
+    assert set(picker.COLLECT_DB.selections(7)) == {"1", "2", "3"}
+
+    # клиент перечитал выборку (версия 2), применил своё удаление и сверился полным списком
+    res = picker._collect_sync({"taxon_id": 7, "base_version": r.json["version"],
+                                "selected": [_photo("1"), _photo("3"), _photo("4")]})
+    assert (res["version"], res["added"], res["removed"], res["kept"]) == (3, 1, 1, 2)
+    assert sorted(res["failed_ids"]) == ["1", "3", "4"]  # без url файлов нет — но выборка сверена
+    assert set(picker.COLLECT_DB.selections(7)) == {"1", "3", "4"}
+
+    r = _delta(env, res["version"], add=["5"])  # дальше дельты идут от сверенной версии
+    assert (r.status_code, r.json["version"]) == (200, 4)
@@ -0,0 +1,55 @@
+from flask import Flask
+
+from diagnostics import Profiler
+
+
+def _app():
+    app = Flask(__name__)
+
+    @app.get("/api/ping")
+    def ping():
+        return "pong"
+
+    return app
+
+
+def test_middleware_added_after_install_survives_rules(tmp_path):
+    app = _app()
+    prof = Profiler()
+    prof.dir = tmp_path
+    prof.install(app)
+
+    inner = app.wsgi_app
+
+    def tagged(environ, start_response):  # middleware, навешанный после install
+        return inner(environ, lambda st, h, exc=None: start_response(st, h + [("X-Tag", "1")], exc))
+
+    app.wsgi_app = tagged
+    c = app.test_client()
+
+    prof.arm("request", "/api/ping", n=1)
+    r = c.get("/api/ping")
+    assert (r.data, r.headers.get("X-Tag")) == (b"pong", "1")
+    assert len(list(tmp_path.glob("*.prof"))) == 1
+    assert prof.rules() == []  # правило исчерпано
+
+    r = c.get("/api/ping")
+    assert r.headers.get("X-Tag") == "1"  # обёртку никто не снимал
+    assert app.wsgi_app is tagged
+    assert len(list(tmp_path.glob("*.prof"))) == 1
+
+
+def test_cancel_and_non_matching_paths_pass_through(tmp_path):
+    app = _app()
+    prof = Profiler()
+    prof.dir = tmp_path
+    prof.install(app)
+    prof.install(app)  # повторно — не оборачиваем дважды
+    c = app.test_client()
+
+    rule = prof.arm("request", "/api/other")
+    assert c.get("/api/ping").data == b"pong"
+    assert prof.cancel(rule["id"])
+    prof.arm("request", "/api/<path:x>")  # шаблон маршрута не совпадает с /api/ping
+    assert c.get("/api/ping").data == b"pong"
+    assert list(tmp_path.glob("*.prof")) == []
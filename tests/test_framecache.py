@@ -0,0 +1,61 @@
+import pytest
+
+import threed
+from storage import LocalStorage
+from threed import FrameCache
+
+
+class _Store(LocalStorage):
+    """Локальное хранилище; on_open вызывается посреди чтения кадра (гонка с пересборкой)."""
+    on_open = None
+
+    def open(self, key):
+        f = super().open(key)
+        if self.on_open:
+            self.on_open()
+        return f
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    st = _Store(tmp_path)
+    monkeypatch.setattr(threed, "cache_store", lambda: st)
+    return st
+
+
+def _load(fc, store, leaf, frame, data=b"frame"):
+    key = f"{leaf}/{frame}"
+    store.put(key, data)
+    return fc.load(leaf, frame, key, store.stat(key))
+
+
+def test_versions_do_not_outlive_reads(store):
+    fc = FrameCache(1 << 20)
+    for i in range(100):
+        _load(fc, store, f"ds/{i}", "0000.webp")
+        fc.invalidate(f"ds/{i}")
+    fc.invalidate("gone/dataset")  # удалённый набор, кадров в кэше не было
+    assert fc.stats()["items"] == 0
+    assert fc._versions == {} and fc._loading == {}
+
+
+def test_read_racing_invalidate_is_not_cached(store):
+    fc = FrameCache(1 << 20)
+    store.on_open = lambda: fc.invalidate("ds/a")  # кэш листа пересобрали, пока читали
+    entry = _load(fc, store, "ds/a", "0000.webp", b"old")
+    assert entry["data"] == b"old"  # текущему запросу отдаём
+    assert fc.get("ds/a", "0000.webp") is None  # но не кэшируем
+    assert fc._versions == {}
+
+    store.on_open = None
+    _load(fc, store, "ds/a", "0000.webp", b"new")
+    assert fc.get("ds/a", "0000.webp")["data"] == b"new"
+
+
+def test_invalidate_prefix_keeps_siblings(store):
+    fc = FrameCache(1 << 20)
+    _load(fc, store, "ds/a", "0000.webp")
+    _load(fc, store, "ds/ab", "0000.webp")
+    fc.invalidate("ds/a")
+    assert fc.get("ds/a", "0000.webp") is None
+    assert fc.get("ds/ab", "0000.webp") is not None
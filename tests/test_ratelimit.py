@@ -0,0 +1,180 @@
+import threading
+
+import pytest
+
+import ratelimit
+from ratelimit import AdaptiveConcurrency, HostLimiter, RateLimiter, TokenBucket, _SharedBuckets
+
+
+class _Clock:
+    """Подменяет модуль time в ratelimit: часы двигает только тест (и sleep)."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    monotonic = perf_counter = time
+
+    def sleep(self, sec):
+        self.now += sec
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = _Clock()
+    monkeypatch.setattr(ratelimit, "time", c)
+    return c
+
+
+# ---- token bucket ----
+
+def test_bucket_burst_then_debt(clock):
+    b = TokenBucket("h", rate=2.0, burst=3)
+    assert [b.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert b.reserve() == pytest.approx(0.5)  # токен в долг: ждать 1/rate
+    assert b.reserve() == pytest.approx(1.0)  # очередь долгов растёт
+
+
+def test_bucket_refill_capped_by_burst(clock):
+    b = TokenBucket("h", rate=2.0, burst=3)
+    for _ in range(3):
+        b.reserve()
+    clock.now += 1.0  # +2 токена
+    assert [b.reserve() for _ in range(2)] == [0.0, 0.0]
+    assert b.reserve() > 0
+    clock.now += 3600  # простой не копит больше burst
+    assert [b.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert b.reserve() == pytest.approx(0.5)
+
+
+def test_bucket_pause(clock):
+    b = TokenBucket("h", rate=10.0, burst=5)
+    b.pause(3.0)
+    assert b.reserve() == pytest.approx(3.0)
+    b.pause(1.0)  # более короткая пауза не сокращает текущую
+    assert b.reserve() == pytest.approx(3.0)
+    b.pause(10 ** 6)
+    assert b.reserve() == pytest.approx(ratelimit.MAX_PAUSE_SEC)
+
+
+def test_bucket_shared_between_instances(tmp_path, clock):
+    path = tmp_path / "rl.sqlite"
+    a = TokenBucket("api.example", rate=1.0, burst=2, shared=_SharedBuckets(path))
+    b = TokenBucket("api.example", rate=1.0, burst=2, shared=_SharedBuckets(path))  # «другой процесс»
+    other = TokenBucket("static.example", rate=1.0, burst=2, shared=_SharedBuckets(path))
+    assert a.reserve() == 0.0
+    assert b.reserve() == 0.0
+    assert a.reserve() == pytest.approx(1.0)
+    assert other.reserve() == 0.0  # ключи независимы
+    b.pause(5.0)
+    assert a.reserve() == pytest.approx(5.0)
+
+
+def test_bucket_shared_db_unavailable_falls_back_to_local(tmp_path, clock):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    b = TokenBucket("h", rate=1.0, burst=1, shared=_SharedBuckets(blocker / "rl.sqlite"))  # каталог не создать
+    assert b.reserve() == 0.0
+    assert b.reserve() == pytest.approx(1.0)  # ведро этого процесса всё равно ограничивает
+
+
+# ---- AIMD ----
+
+def test_aimd_halves_once_per_cooldown(clock):
+    c = AdaptiveConcurrency(8)
+    for _ in range(3):  # пачка 429 от одной перегрузки
+        c.acquire()
+    for _ in range(3):
+        c.release(overloaded=True)
+    assert (c.limit, c.cuts) == (4.0, 1)
+    clock.now += ratelimit.CUT_COOLDOWN_SEC
+    c.acquire()
+    c.release(overloaded=True)
+    assert (c.limit, c.cuts) == (2.0, 2)
+
+
+def test_aimd_floor_and_recovery(clock):
+    c = AdaptiveConcurrency(4, min_limit=1)
+    for _ in range(5):
+        c.acquire()
+        c.release(overloaded=True)
+        clock.now += ratelimit.CUT_COOLDOWN_SEC
+    assert c.limit == 1.0
+    c.acquire()
+    c.release(overloaded=False)
+    assert c.limit == 2.0  # +1/limit
+    c.acquire()
+    c.release(overloaded=False)
+    assert c.limit == 2.5
+    for _ in range(50):
+        c.acquire()
+        c.release(overloaded=False)
+    assert c.limit == 4.0  # не выше max_limit
+    assert c.inflight == 0
+
+
+def test_aimd_acquire_blocks_at_limit():
+    c = AdaptiveConcurrency(1)
+    assert c.acquire() is False
+    got = threading.Event()
+    blocked = []
+
+    def worker():
+        blocked.append(c.acquire())
+        got.set()
+
+    t = threading.Thread(target=worker)
+    t.start()
+    assert not got.wait(0.2)  # место занято
+    assert c.waiting == 1
+    c.release(overloaded=False)
+    assert got.wait(2)
+    t.join()
+    assert blocked == [True]
+    assert (c.inflight, c.waiting) == (1, 0)
+
+
+# ---- хост целиком ----
+
+def test_host_slot_429_pauses_and_cuts(clock):
+    h = HostLimiter("api.example", rate=100.0, burst=10, max_concurrency=4)
+    with h.slot() as s:
+        s.status, s.retry_after = 429, "7"
+    snap = h.snapshot()
+    assert (snap["throttled"], snap["cuts"], snap["limit"]) == (1, 1, 2.0)
+    t0 = clock.now
+    with h.slot() as s:  # следующий запрос ждёт Retry-After
+        s.status = 200
+    assert clock.now - t0 == pytest.approx(7.0)
+    assert h.snapshot()["waited"] == 1
+
+
+def test_host_slot_no_response_counts_as_overload(clock):
+    h = HostLimiter("api.example", rate=100.0, burst=10, max_concurrency=4)
+    with pytest.raises(ConnectionError):
+        with h.slot():
+            raise ConnectionError  # status остался 0 — ответа не было
+    snap = h.snapshot()
+    assert (snap["errors"], snap["throttled"], snap["cuts"], snap["inflight"]) == (1, 0, 1, 0)
+
+
+def test_retry_after_parsing():
+    assert ratelimit._retry_after("12") == 12.0
+    assert ratelimit._retry_after("0") == 1.0
+    assert ratelimit._retry_after(None) == ratelimit.DEFAULT_PAUSE_SEC
+    assert ratelimit._retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == ratelimit.DEFAULT_PAUSE_SEC
+
+
+def test_rate_limiter_only_limits_configured_hosts(clock):
+    rl = RateLimiter({"api.example": (1.0, 1, 2)})
+    for _ in range(3):
+        with rl.slot("https://other.example/x") as s:
+            s.status = 200
+    assert clock.now == 1_000_000.0
+    for _ in range(2):
+        with rl.slot("https://api.example/v1/taxa") as s:
+            s.status = 200
+    assert clock.now == pytest.approx(1_000_001.0)
+    assert rl.snapshot()["api.example"]["requests"] == 2
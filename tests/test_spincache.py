@@ -0,0 +1,95 @@
+import os
+from pathlib import Path
+
+import pytest
+
+import threed
+
+PIL = pytest.importorskip("PIL.Image")
+
+
+@pytest.fixture
+def data(tmp_path, monkeypatch):
+    data_dir = tmp_path / "data"
+    monkeypatch.setattr(threed, "DATA_DIR", data_dir)
+    monkeypatch.setattr(threed, "CACHE_DIR", data_dir / "_cache" / "spin")
+    monkeypatch.setattr(threed, "_stores", {})
+    monkeypatch.setattr(threed, "SPIN_BUILDER", threed.SpinBuilder())
+    leaf = data_dir / "plants" / "rose"
+    leaf.mkdir(parents=True)
+    for i in range(3):
+        PIL.new("RGB", (64, 48), (40 * i, 90, 200 - 40 * i)).save(leaf / f"{i}.jpg")
+    old = 10 ** 9  # оригиналы «старые» — чистильщик их не щадит по возрасту
+    for f in leaf.iterdir():
+        os.utime(f, (old, old))
+    return data_dir
+
+
+LEAF = Path("plants/rose")
+
+
+def _originals(data_dir) -> list[str]:
+    return sorted(p.name for p in (data_dir / LEAF).iterdir())
+
+
+def test_build_writes_frames_then_mark(data):
+    frames = threed.ensure_spin_cache(LEAF, max_w=64)
+    assert frames == [f"plants/rose/{i:04d}.webp" for i in range(3)]
+    assert threed.spin_cache_state(LEAF) == (frames, True)
+    assert threed._marked_frames(LEAF) == 3
+    assert threed.find_uncached_leafs() == []
+
+
+def test_sweep_during_build_keeps_originals(data):
+    seen = []
+
+    def progress(_leaf, done, total):
+        threed.sweep_originals(data)  # первый кадр уже в кэше, отметки ещё нет
+        seen.append(_originals(data))
+
+    frames = threed.ensure_spin_cache(LEAF, max_w=64, progress=progress)
+    assert len(frames) == 3
+    assert all(s == ["0.jpg", "1.jpg", "2.jpg"] for s in seen)
+
+    threed.sweep_originals(data)  # кэш собран — теперь можно
+    assert _originals(data) == []
+
+
+def test_sweep_skips_queued_or_building_leaf(data):
+    threed.ensure_spin_cache(LEAF, max_w=64)
+    threed.SPIN_BUILDER._state[LEAF.as_posix()] = {"status": "building", "prio": 0, "done": 0, "total": 0, "ts": 0}
+    threed.sweep_originals(data)
+    assert len(_originals(data)) == 3
+
+
+def test_truncated_cache_is_rebuilt(data):
+    store = threed.cache_store()
+    store.put("plants/rose/0000.webp", b"RIFF-partial")  # сборку оборвали после первого кадра
+    store.put("plants/rose/0007.webp", b"RIFF-stale")
+    assert threed.spin_cache_state(LEAF)[1] is False
+    assert threed.find_uncached_leafs() == [LEAF]
+    threed.sweep_originals(data)
+    assert len(_originals(data)) == 3  # недостроенный кэш — оригиналы на месте
+
+    frames = threed.ensure_spin_cache(LEAF, max_w=64)
+    assert frames == [f"plants/rose/{i:04d}.webp" for i in range(3)]
+    with store.open("plants/rose/0000.webp") as f:
+        assert f.read() != b"RIFF-partial"
+    assert threed.spin_cache_state(LEAF)[1] is True
+
+
+def test_mark_with_missing_frames_is_rebuilt(data):
+    threed.ensure_spin_cache(LEAF, max_w=64)
+    threed.cache_store().delete("plants/rose/0002.webp")
+    assert len(threed.ensure_spin_cache(LEAF, max_w=64)) == 3
+
+
+def test_unmarked_cache_without_originals_is_adopted(data):
+    store = threed.cache_store()
+    for i in range(2):
+        store.put(f"plants/rose/{i:04d}.webp", b"RIFF")
+    for f in (data / LEAF).iterdir():
+        f.unlink()
+    (data / LEAF / "model.obj").write_text("o x\n")  # лист остаётся листом
+    assert threed.ensure_spin_cache(LEAF, max_w=64) == ["plants/rose/0000.webp", "plants/rose/0001.webp"]
+    assert threed.spin_cache_state(LEAF)[1] is True
@@ -0,0 +1,128 @@
+import io, time
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import storage
+from storage import LocalStorage, make_storage
+
+
+# ---- LocalStorage ----
+
+@pytest.fixture
+def local(tmp_path):
+    root = tmp_path / "data"
+    root.mkdir()
+    return LocalStorage(root, skip_top=("_cache",))
+
+
+@pytest.mark.parametrize("key", ["../x.webp", "../data2/x.webp", "a/../../data2/x.webp", "/etc/passwd"])
+def test_local_rejects_keys_outside_root(local, tmp_path, key):
+    (tmp_path / "data2").mkdir()
+    with pytest.raises(PermissionError):
+        local.put(key, b"x")
+    assert not (tmp_path / "data2" / "x.webp").exists()
+
+
+def test_local_roundtrip_and_list(local):
+    local.put("a/1.webp", b"one")
+    local.put("a/b/2.webp", io.BytesIO(b"two"))
+    local.put("_cache/skip.bin", b"-")
+    local.put("top.txt", b"t")
+    assert local.stat("a/1.webp").size == 3
+    assert local.stat("a") is None and local.stat("nope") is None
+    with local.open("a/b/2.webp") as f:
+        assert f.read() == b"two"
+    assert [o.key for o in local.list("a")] == ["a/1.webp"]
+    assert [o.key for o in local.list("a", recursive=True)] == ["a/1.webp", "a/b/2.webp"]
+    assert [o.key for o in local.list(recursive=True)] == ["a/1.webp", "a/b/2.webp", "top.txt"]
+    local.delete_prefix("a/")
+    assert local.list("a", recursive=True) == []
+    with pytest.raises(ValueError):
+        local.delete_prefix("")
+
+
+# ---- S3Storage (moto вместо MinIO) ----
+
+@pytest.fixture
+def s3(monkeypatch):
+    moto = pytest.importorskip("moto")
+    boto3 = pytest.importorskip("boto3")
+    for k, v in {"AWS_ACCESS_KEY_ID": "test", "AWS_SECRET_ACCESS_KEY": "test", "AWS_DEFAULT_REGION": "us-east-1"}.items():
+        monkeypatch.setenv(k, v)
+    with moto.mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="gallery")
+        yield boto3.client("s3", region_name="us-east-1")
+
+
+def _store(**cfg):
+    return make_storage({"backend": "s3", "bucket": "gallery", "region": "us-east-1", **cfg}, None, "spin")
+
+
+def _raw_keys(client) -> list[str]:
+    return sorted(o["Key"] for o in client.list_objects_v2(Bucket="gallery").get("Contents", []))
+
+
+def test_make_storage_prefix_composition(s3):
+    assert _store().prefix == "spin/"
+    assert _store(prefix="/env/prod/").prefix == "env/prod/spin/"
+    _store(prefix="env").put("a/1.webp", b"x")
+    assert _raw_keys(s3) == ["env/spin/a/1.webp"]
+    with pytest.raises(ValueError):
+        make_storage({"backend": "ftp"}, None, "spin")
+
+
+def test_s3_put_bytes_and_stream(s3):
+    st = _store()
+    st.put("a/1.webp", b"one", content_type="image/webp")
+    st.put("a/2.bin", io.BytesIO(b"two" * 1000))
+    assert s3.head_object(Bucket="gallery", Key="spin/a/1.webp")["ContentType"] == "image/webp"
+    with st.open("a/2.bin") as body:
+        assert body.read() == b"two" * 1000
+    info = st.stat("a/1.webp")
+    assert (info.key, info.size) == ("a/1.webp", 3) and info.mtime > 0
+
+
+def test_s3_missing_objects(s3):
+    st = _store()
+    assert st.stat("nope.webp") is None  # HEAD -> 404
+    with pytest.raises(FileNotFoundError):
+        st.open("nope.webp")  # GET -> NoSuchKey
+
+
+def test_s3_list_delimited_and_recursive(s3):
+    st = _store()
+    for k in ("a/1.webp", "a/b/2.webp", "a/b/c/3.webp", "ab/4.webp", "top.txt"):
+        st.put(k, b"x")
+    s3.put_object(Bucket="gallery", Key="other/5.webp", Body=b"x")  # чужой префикс
+    assert [o.key for o in st.list("a")] == ["a/1.webp"]
+    assert [o.key for o in st.list("a/", recursive=True)] == ["a/1.webp", "a/b/2.webp", "a/b/c/3.webp"]
+    assert [o.key for o in st.list()] == ["top.txt"]
+    assert len(st.list(recursive=True)) == 5
+
+
+def test_s3_delete_prefix_in_batches(s3, monkeypatch):
+    monkeypatch.setattr(storage, "S3_DELETE_BATCH", 2)
+    st = _store()
+    for i in range(5):
+        st.put(f"a/{i}.webp", b"x")
+    st.put("ab/keep.webp", b"x")
+    calls = []
+    real = st._client.delete_objects
+    monkeypatch.setattr(st._client, "delete_objects", lambda **kw: calls.append(kw) or real(**kw))
+    st.delete_prefix("a")
+    assert [len(c["Delete"]["Objects"]) for c in calls] == [2, 2, 1]
+    assert _raw_keys(s3) == ["spin/ab/keep.webp"]
+    with pytest.raises(ValueError):
+        st.delete_prefix("/")
+
+
+def test_s3_presign(s3):
+    st = _store(endpoint_url="http://127.0.0.1:9000")
+    url = st.presign("a/1.webp", expires=60)
+    assert url.startswith("http://127.0.0.1:9000/gallery/spin/a/1.webp?")  # path-style, как у MinIO
+    q = parse_qs(urlsplit(url).query)
+    if "X-Amz-Expires" in q:  # SigV4 — срок относительный
+        assert q["X-Amz-Expires"] == ["60"]
+    else:  # SigV2 — момент истечения
+        assert abs(int(q["Expires"][0]) - time.time() - 60) < 5
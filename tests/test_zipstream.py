@@ -0,0 +1,89 @@
+import io, shutil, struct, subprocess, zipfile, zlib
+
+import pytest
+
+import zipstream
+from zipstream import StoredZip, ZipEntry
+
+
+def _entries(blobs: dict[str, bytes]) -> list[ZipEntry]:
+    return [ZipEntry(name, len(data), 1_700_000_000, (lambda d=data: io.BytesIO(d)), ident=f"t:{name}")
+            for name, data in blobs.items()]
+
+
+BLOBS = {
+    "a/0000.webp": b"RIFF" + bytes(range(256)) * 40,
+    "a/.meta.json": '{"title": "тест"}'.encode("utf-8"),
+    "b/empty.obj": b"",
+    "b/кадр.webp": bytes(300_000),
+}
+
+
+def _stream_read(data: bytes) -> dict[str, bytes]:
+    """Последовательное чтение по локальным заголовкам, как у потоковых читателей (ZipInputStream)."""
+    out, pos = {}, 0
+    while struct.unpack_from("<I", data, pos)[0] == 0x04034B50:
+        _, _, flags, method, _, _, crc, csize, usize, nlen, xlen = struct.unpack_from("<IHHHHHIIIHH", data, pos)
+        if method == 0 and flags & 0x0008:
+            raise ValueError("only DEFLATED entries can have EXT descriptor")
+        assert method == 0 and csize == usize
+        name = data[pos + 30:pos + 30 + nlen].decode("utf-8" if flags & 0x0800 else "cp437")
+        pos += 30 + nlen + xlen
+        body = data[pos:pos + usize]
+        assert zlib.crc32(body) == crc, name
+        out[name] = body
+        pos += usize
+    assert struct.unpack_from("<I", data, pos)[0] == 0x02014B50  # дальше — центральный каталог
+    return out
+
+
+@pytest.fixture(autouse=True)
+def _clean_memo():
+    zipstream._crc_memo.clear()
+    yield
+    zipstream._crc_memo.clear()
+
+
+@pytest.mark.parametrize("small_max", [zipstream.SMALL_MAX, 1000])
+def test_roundtrip_zipfile_and_stream_reader(monkeypatch, small_max):
+    monkeypatch.setattr(zipstream, "SMALL_MAX", small_max)  # 1000 — крупные файлы читаются дважды
+    zs = StoredZip(_entries(BLOBS))
+    data = b"".join(zs)
+    assert len(data) == zs.size
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        assert z.testzip() is None
+        assert {n: z.read(n) for n in z.namelist()} == BLOBS
+        assert all(not (i.flag_bits & 0x0008) for i in z.infolist())
+    assert _stream_read(data) == BLOBS
+
+
+@pytest.mark.skipif(not shutil.which("unzip"), reason="нет unzip")
+def test_unzip_accepts_archive(tmp_path):
+    p = tmp_path / "x.zip"
+    p.write_bytes(b"".join(StoredZip(_entries(BLOBS))))
+    assert subprocess.run(["unzip", "-tq", str(p)], capture_output=True).returncode == 0
+
+
+def test_range_resume_matches_full_archive():
+    full = b"".join(StoredZip(_entries(BLOBS)))
+    zipstream._crc_memo.clear()  # докачка новым процессом: CRC неизвестны
+    zs = StoredZip(_entries(BLOBS))
+    for start in (0, 1, 35, 200, 10_000, len(full) - 30):
+        assert b"".join(zs.iter_range(start, len(full))) == full[start:]
+    assert b"".join(zs.iter_range(100, 5000)) == full[100:5000]
+
+
+def test_etag_depends_on_manifest():
+    a = StoredZip(_entries(BLOBS)).etag
+    changed = dict(BLOBS, **{"b/empty.obj": b"x"})
+    assert a == StoredZip(_entries(BLOBS)).etag
+    assert a != StoredZip(_entries(changed)).etag
+
+
+@pytest.mark.skipif(not shutil.which("bsdtar"), reason="нет bsdtar")
+def test_bsdtar_streaming_read():
+    # из stdin bsdtar читает zip потоком, по локальным заголовкам (центральный каталог недоступен)
+    data = b"".join(StoredZip(_entries(BLOBS)))
+    r = subprocess.run(["bsdtar", "-xOf", "-", "b/кадр.webp"], input=data, capture_output=True)
+    assert r.returncode == 0, r.stderr
+    assert r.stdout == BLOBS["b/кадр.webp"]
@@ -1,34 +1,42 @@
-import os, re, json, time, shutil, zipfile, threading, logging, tempfile, subprocess
+import os, re, json, time, shutil, zipfile, threading, logging, tempfile, subprocess, hashlib, itertools, queue
+from collections import OrderedDict
+from io import BytesIO
 from pathlib import Path
+from typing import BinaryIO
 
-# ---- Pillow / WebP detection ----
-try:
-    from PIL import Image, ImageOps, ImageFile, features as PIL_features
+from storage import StorageBackend, ObjInfo, make_storage
+from diagnostics import PROFILER
+from logsetup import setup_logging, setup_slow_log
+from timing import span, timed
+from zipstream import ZipEntry, StoredZip
 
-    ImageFile.LOAD_TRUNCATED_IMAGES = True
-    PIL_OK = True
-    WEBP_OK = bool(PIL_features.check("webp"))
-    RESAMPLE = getattr(getattr(Image, "Resampling", Image), "LANCZOS")
-except Exception:
-    PIL_OK = False
-    WEBP_OK = False
-    RESAMPLE = None
+# ---- Pillow / WebP detection (лениво: при первом кодировании или в прогреве) ----
+_ENC: dict | None = None
+_enc_lock = threading.Lock()
 
 
-def _which(exe: str) -> str | None:
-    from shutil import which
-    return which(exe)
+def _probe_encoders() -> dict:
+    enc = {"pil": False, "webp": False, "resample": None, "cwebp": shutil.which("cwebp")}
+    try:
+        from PIL import Image, ImageFile, features as PIL_features
 
+        ImageFile.LOAD_TRUNCATED_IMAGES = True
+        enc["pil"] = True
+        enc["webp"] = bool(PIL_features.check("webp"))
+        enc["resample"] = getattr(getattr(Image, "Resampling", Image), "LANCZOS")
+    except Exception:
+        pass
+    return enc
 
-CWEBP = _which("cwebp")
 
-# ---- logging ----
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s %(message)s",
-    handlers=[logging.FileHandler("flask.log", encoding="utf-8"), logging.StreamHandler()]
-)
-log = logging.getLogger("spin")
+def encoders() -> dict:
+    global _ENC
+    if _ENC is None:
+        with _enc_lock:
+            if _ENC is None:
+                _ENC = _probe_encoders()
+    return _ENC
+
 
 # ---- Config ----
 BASE_DIR = Path(__file__).resolve().parent
@@ -46,12 +54,14 @@ def _load_config() -> dict:
 
 CFG = _load_config()
 
+# ---- logging (очередь + поток-писатель, JSON, ротация; см. logsetup.py) ----
+setup_logging(CFG.get("log"))
+log = logging.getLogger("spin")
+
 
 def _load_data_dir() -> Path:
     dd = CFG.get("data_dir") or os.environ.get("GALLERY_DATA_DIR")
-    p = Path(dd).expanduser().resolve() if dd else (BASE_DIR / "data").resolve()
-    p.mkdir(parents=True, exist_ok=True)
-    return p
+    return Path(dd).expanduser().resolve() if dd else (BASE_DIR / "data").resolve()
 
 
 def _load_port() -> int:
@@ -70,14 +80,56 @@ UPLOAD_PASSWORD = str(CFG.get("upload_password", "admin67"))
 DATA_DIR = _load_data_dir()
 UPLOADS_DIR = DATA_DIR / "_uploads"
 CACHE_DIR = DATA_DIR / "_cache" / "spin"
-UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
-CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+
+def ensure_dirs():
+    UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+
+# ---- хранилище кадров и опубликованных файлов наборов (см. storage.py) ----
+# Оригиналы при приёме всегда живут на локальном диске (DATA_DIR); в хранилище
+# попадают webp-кадры (cache_store) и модели/.meta.json (data_store).
+STORAGE_CFG = CFG.get("storage") or {}
+STORAGE_REDIRECT = STORAGE_CFG.get("serve", "redirect") == "redirect"  # presign-редирект вместо проксирования
+PRESIGN_TTL = int(STORAGE_CFG.get("presign_ttl", 3600))
+_stores: dict[str, StorageBackend] = {}
+_stores_lock = threading.Lock()
+
+
+def _store(kind: str) -> StorageBackend:
+    st = _stores.get(kind)
+    if st is None:
+        with _stores_lock:
+            st = _stores.get(kind)
+            if st is None:
+                if kind == "spin":
+                    st = make_storage(STORAGE_CFG, CACHE_DIR, "spin")
+                else:
+                    st = make_storage(STORAGE_CFG, DATA_DIR, "data", skip_top=("_uploads", "_cache"))
+                _stores[kind] = st
+    return st
+
+
+def cache_store() -> StorageBackend:
+    return _store("spin")
+
+
+def data_store() -> StorageBackend:
+    return _store("data")
+
 
 ALLOWED_IMAGE_EXT = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp"}
 ORIGINAL_IMAGE_EXT = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff"}
 ALLOWED_MODEL_EXT = {".glb", ".gltf", ".obj", ".ply"}
 MAX_ZIP_MB = 2048
 CLEAN_DELAY_SEC = 300
+SLOW_REQUEST_MS = int(CFG.get("slow_request_ms", 500))  # медленнее — в slow log
+SLOW_LOG_PATH = Path(CFG.get("slow_log", "slow_requests.jsonl"))
+setup_slow_log(SLOW_LOG_PATH)  # строки пишет поток-писатель, не поток запроса
+FRAME_CACHE_MB = int(CFG.get("frame_cache_mb", 256))  # 0 — без кэша кадров в памяти
+DIAG_DIR = Path(CFG.get("diagnostics_dir") or DATA_DIR / "_cache" / "diagnostics")  # дампы профилировщика
+PROFILER.dir = DIAG_DIR
 
 
 # ---- Utils ----
@@ -169,26 +221,37 @@ def detect_model_files_direct(dir_path: Path) -> dict:
     return {}
 
 
-def read_meta_title(dir_path: Path, fallback: str) -> str:
-    meta = dir_path / ".meta.json"
-    if meta.exists():
-        try:
-            data = json.loads(meta.read_text(encoding="utf-8"))
-            t = (data.get("display_name") or "").strip()
-            if t: return t
-        except Exception:
-            pass
-    return fallback
+def _meta_key(dir_path: Path | str) -> str:
+    if isinstance(dir_path, Path) and dir_path.is_absolute():
+        dir_path = dir_path.relative_to(DATA_DIR).as_posix()
+    return f"{dir_path}/.meta.json"
+
+
+def read_meta(dir_path: Path | str) -> dict:
+    """dir_path — абсолютный путь под DATA_DIR или id набора."""
+    try:
+        with data_store().open(_meta_key(dir_path)) as f:
+            data = json.loads(f.read().decode("utf-8"))
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
 
 
-def write_meta(dir_path: Path, display_name: str | None):
-    meta = dir_path / ".meta.json"
+def read_meta_title(dir_path: Path | str, fallback: str) -> str:
+    t = (read_meta(dir_path).get("display_name") or "").strip()
+    return t or fallback
+
+
+def write_meta(dir_path: Path, display_name: str | None, **extra):
     data = {"display_name": (display_name or "").strip() or dir_path.name,
             "created_at": int(time.time())}
-    meta.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    data.update({k: v for k, v in extra.items() if v is not None})
+    body = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+    data_store().put(_meta_key(dir_path), body, content_type="application/json")
 
 
 # ---- «лист» (разворачиваем одиночную обёртку) ----
+@timed("resolve_leaf_rel")
 def resolve_leaf_rel(dataset_rel: Path) -> Path:
     cur = safe_join_under(DATA_DIR, dataset_rel)
     rel_cur = dataset_rel
@@ -203,48 +266,136 @@ def resolve_leaf_rel(dataset_rel: Path) -> Path:
         return rel_cur
 
 
+SPIN_DONE_MARK = ".complete"  # пишется последним: кэш листа собран целиком ({"frames": N})
+
+
+def _leaf_listing(leaf: Path) -> tuple[list[str], bool]:
+    """(кадры листа, есть ли отметка о завершённой сборке) — одним листингом."""
+    frames, done = [], False
+    for o in cache_store().list(leaf.as_posix()):
+        if o.key.endswith(".webp"):
+            frames.append(o.key)
+        elif o.key.rpartition("/")[2] == SPIN_DONE_MARK:
+            done = True
+    return frames, done
+
+
+def _cached_frames(leaf: Path) -> list[str]:
+    return _leaf_listing(leaf)[0]
+
+
+@timed("list_cached_webp")
 def list_cached_webp(dataset_rel: Path) -> list[str]:
-    leaf = resolve_leaf_rel(dataset_rel)
-    cdir = safe_join_under(CACHE_DIR, leaf)
-    if not cdir.exists(): return []
-    files = sorted([p for p in cdir.glob("*.webp")], key=lambda p: p.name)
-    return [str(p.relative_to(CACHE_DIR)).replace("\\", "/") for p in files]
+    return _cached_frames(resolve_leaf_rel(dataset_rel))
+
+
+@timed("list_cached_webp")
+def spin_cache_state(dataset_rel: Path) -> tuple[list[str], bool]:
+    """(кадры, собран ли кэш целиком); кадры без отметки — сборка идёт или оборвалась."""
+    return _leaf_listing(resolve_leaf_rel(dataset_rel))
 
 
 def list_cached_webp_raw(rel_under_cache: Path) -> list[str]:
-    cdir = safe_join_under(CACHE_DIR, rel_under_cache)
-    if not cdir.exists(): return []
-    files = sorted([p for p in cdir.glob("*.webp")], key=lambda p: p.name)
-    return [str((rel_under_cache / p.name).as_posix()) for p in files]
+    return _cached_frames(rel_under_cache)
+
+
+class _Tree:
+    """Дерево каталогов по плоскому листингу хранилища (ключи вида a/b/file)."""
+
+    def __init__(self, objs: list[ObjInfo]):
+        self.files: dict[str, list[ObjInfo]] = {}  # каталог -> прямые файлы
+        self.subdirs: dict[str, set] = {}  # каталог -> имена подкаталогов
+        for o in objs:
+            d = o.key.rpartition("/")[0]
+            self.files.setdefault(d, []).append(o)
+            while d:
+                parent, _, name = d.rpartition("/")
+                kids = self.subdirs.setdefault(parent, set())
+                if name in kids:
+                    break
+                kids.add(name)
+                d = parent
+
+    def dirs(self) -> list[str]:
+        return sorted((set(self.files) | set(self.subdirs) | {
+            f"{p}/{n}" if p else n for p, ns in self.subdirs.items() for n in ns}) - {""})
+
+    def has(self, d: str) -> bool:
+        return d in self.files or d in self.subdirs
+
+    def rfiles(self, d: str) -> list[ObjInfo]:
+        out, stack = [], [d]
+        while stack:
+            cur = stack.pop()
+            out += self.files.get(cur, [])
+            stack += [f"{cur}/{n}" for n in self.subdirs.get(cur, ())]
+        return out
+
+    def images_direct(self, d: str) -> list[str]:
+        return [o.key.rpartition("/")[2] for o in self.files.get(d, [])
+                if Path(o.key).suffix.lower() in ALLOWED_IMAGE_EXT]
+
+    def model(self, d: str, recursive: bool) -> dict:
+        direct = {o.key.rpartition("/")[2]: o for o in self.files.get(d, [])}
+        for ext in [".glb", ".gltf", ".obj", ".ply"]:
+            if f"model{ext}" in direct: return {"type": ext[1:], "key": direct[f"model{ext}"].key}
+        pool = self.rfiles(d) if recursive else self.files.get(d, [])
+        for o in sorted(pool, key=lambda q: q.key):
+            if Path(o.key).suffix.lower() in ALLOWED_MODEL_EXT:
+                return {"type": Path(o.key).suffix.lower()[1:], "key": o.key}
+        return {}
+
+    def leaf(self, d: str) -> str:
+        # как resolve_leaf_rel: разворачиваем одиночные обёртки
+        while True:
+            if self.images_direct(d) or self.model(d, recursive=False):
+                return d
+            subs = self.subdirs.get(d, ())
+            if len(subs) != 1:
+                return d
+            d = f"{d}/{next(iter(subs))}"
 
 
 def find_datasets() -> list[dict]:
     items = []
     seen_ids = set()
 
+    with span("find_datasets_list"):
+        data = _Tree(data_store().list("", recursive=True))
+        cache = _Tree(cache_store().list("", recursive=True))
+
     # 1) По данным в DATA_DIR
-    for root, dirs, files in os.walk(DATA_DIR):
-        p = Path(root)
-        if p == DATA_DIR:
-            for skip in ("_uploads", "_cache"):
-                if skip in dirs: dirs.remove(skip)
-            continue
+    with span("find_datasets_data"):
+        _find_in_data(data, cache, items, seen_ids)
+
+    # 2) Добавляем «осиротевшие» наборы по кэшу
+    with span("find_datasets_cache"):
+        _find_in_cache(data, cache, items, seen_ids)
+
+    with span("find_datasets_sort"):
+        items.sort(key=lambda d: d["id"].lower())
+    return items
+
+
+def _webps(cache: _Tree, d: str) -> list[ObjInfo]:
+    return [o for o in cache.files.get(d, []) if o.key.endswith(".webp")]
 
-        imgs_direct = list_images_direct(p)
-        model_direct = detect_model_files_direct(p)
+
+def _find_in_data(data: _Tree, cache: _Tree, items: list, seen_ids: set):
+    for rel_id in data.dirs():
+        imgs_direct = data.images_direct(rel_id)
+        model_direct = data.model(rel_id, recursive=False)
         has_direct = bool(imgs_direct or model_direct)
-        if not has_direct:
-            subdirs = [d for d in p.iterdir() if d.is_dir()]
-            if len(subdirs) == 1:
-                continue  # пропускаем «обёртку»
-
-        imgs_rec = list_images_recursive(p)
-        model_any = model_direct or detect_model_files(p)
-        rel = Path(p.relative_to(DATA_DIR))
-        rel_id = rel.as_posix()
-        title = read_meta_title(p, fallback=p.name)
-
-        cached = list_cached_webp(rel)  # уже по листу
+        if not has_direct and len(data.subdirs.get(rel_id, ())) == 1:
+            continue  # пропускаем «обёртку»
+
+        n = len(rel_id) + 1
+        imgs_rec = sorted((o.key[n:] for o in data.rfiles(rel_id)
+                           if Path(o.key).suffix.lower() in ALLOWED_IMAGE_EXT), key=_numeric_path_key)
+        model_any = model_direct or data.model(rel_id, recursive=True)
+
+        webps = _webps(cache, data.leaf(rel_id))  # уже по листу
+        cached = [o.key for o in webps]
         images_total = len(imgs_rec) if imgs_rec else len(cached)
 
         if imgs_rec or cached or model_any:
@@ -256,36 +407,153 @@ def find_datasets() -> list[dict]:
                 thumb = ""
             mode = "model" if model_any else ("spin" if images_total > 0 else "empty")
             items.append({
-                "id": rel_id, "title": title, "images": images_total, "mode": mode,
+                "id": rel_id, "title": read_meta_title(rel_id, fallback=rel_id.rpartition("/")[2]),
+                "images": images_total, "mode": mode,
+                "bytes": sum(o.size for o in webps),  # вес кадров — оценка загрузки вьюера
                 "thumb": thumb,
-                "model_url": f"/files/{rel_id}/{model_any['path'].name}" if model_any else "",
+                "model_url": f"/files/{rel_id}/{model_any['key'].rpartition('/')[2]}" if model_any else "",
                 "model_type": model_any.get("type", "") if model_any else ""
             })
             seen_ids.add(rel_id)
 
-    # 2) Добавляем «осиротевшие» наборы по кэшу
-    for root, dirs, files in os.walk(CACHE_DIR):
-        p = Path(root)
-        if p == CACHE_DIR:
-            continue
-        webps = sorted([f for f in p.glob("*.webp")], key=lambda q: q.name)
+
+def _find_in_cache(data: _Tree, cache: _Tree, items: list, seen_ids: set):
+    for rel_id in cache.dirs():
+        webps = _webps(cache, rel_id)
         if not webps:
             continue
-        rel = p.relative_to(CACHE_DIR)  # путь набора относительно CACHE_DIR (он же ID)
-        rel_id = rel.as_posix()
-        if rel_id in seen_ids:
+        if rel_id in seen_ids:  # путь набора относительно CACHE_DIR (он же ID)
             continue
-        data_node = DATA_DIR / rel
-        title = read_meta_title(data_node, fallback=rel.name) if data_node.exists() else rel.name
-        thumb = f"/spin-cache/{rel_id}/{webps[0].name}"
+        name = rel_id.rpartition("/")[2]
+        title = read_meta_title(rel_id, fallback=name) if data.has(rel_id) else name
+        thumb = f"/spin-cache/{webps[0].key}"
         items.append({
             "id": rel_id, "title": title, "images": len(webps), "mode": "spin",
+            "bytes": sum(o.size for o in webps),
             "thumb": thumb, "model_url": "", "model_type": ""
         })
         seen_ids.add(rel_id)
 
-    items.sort(key=lambda d: d["id"].lower())
-    return items
+
+# ---- горячий кэш кадров (в памяти процесса) ----
+class FrameCache:
+    """
+    LRU закодированных кадров с бюджетом по байтам. Ключ — (лист, кадр); пересборка/удаление
+    кэша листа выбрасывает его кадры, а чтения, начатые до этого, не кэшируются: версия листа
+    растёт, пока есть такие чтения, и забывается с последним из них — словарь версий не больше
+    числа листов, читаемых прямо сейчас. Попадание не делает ни одного syscall.
+    """
+
+    def __init__(self, max_bytes: int, max_paths: int = 50_000):
+        self.max_bytes = max(0, int(max_bytes))
+        self.max_item = self.max_bytes // 8
+        self.max_paths = max_paths
+        self._lock = threading.Lock()
+        self._items: OrderedDict = OrderedDict()  # (leaf, frame) -> entry
+        self._paths: OrderedDict = OrderedDict()  # subpath -> (leaf, frame, ключ в cache_store)
+        self._loading: dict[str, int] = {}  # лист -> чтений в процессе
+        self._versions: dict[str, int] = {}  # лист -> версия (только пока есть чтения)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    # --- мемоизация safe_rel_path ---
+    def resolve(self, subpath: str) -> tuple[str, str, str]:
+        with self._lock:
+            hit = self._paths.get(subpath)
+            if hit is not None:
+                self._paths.move_to_end(subpath)
+                return hit
+        rel = safe_rel_path(subpath)
+        res = (rel.parent.as_posix(), rel.name, rel.as_posix())
+        with self._lock:
+            self._paths[subpath] = res
+            if len(self._paths) > self.max_paths:
+                self._paths.popitem(last=False)
+        return res
+
+    def get(self, leaf: str, frame: str) -> dict | None:
+        with self._lock:
+            key = (leaf, frame)
+            entry = self._items.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def load(self, leaf: str, frame: str, key: str, info: ObjInfo) -> dict | None:
+        """Читаем кадр из хранилища и кладём в кэш (если влезает в бюджет)."""
+        if info.size > self.max_item:
+            return None
+        with self._lock:
+            ver = self._versions.get(leaf, 0)
+            self._loading[leaf] = self._loading.get(leaf, 0) + 1
+        try:
+            with cache_store().open(key) as f:
+                data = f.read()
+        except BaseException:
+            with self._lock:
+                self._done_loading(leaf)
+            raise
+        entry = {
+            "data": data,
+            "etag": hashlib.md5(data).hexdigest(),
+            "mtime": int(info.mtime),
+        }
+        with self._lock:
+            stale = self._versions.get(leaf, 0) != ver
+            self._done_loading(leaf)
+            if stale:
+                return entry  # лист пересобрали, пока читали — отдаём, но не кэшируем
+            key = (leaf, frame)
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old["data"])
+            self._items[key] = entry
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and self._items:
+                _, ev = self._items.popitem(last=False)
+                self._bytes -= len(ev["data"])
+        return entry
+
+    def _done_loading(self, leaf: str):
+        # под self._lock
+        n = self._loading.pop(leaf) - 1
+        if n:
+            self._loading[leaf] = n
+        else:
+            self._versions.pop(leaf, None)  # чтений листа не осталось — версия больше не нужна
+
+    def invalidate(self, rel: Path | str):
+        """Сбрасываем все кадры листов под rel (включая сам rel); идущие чтения их листов не кэшируются."""
+        prefix = rel.as_posix() if isinstance(rel, Path) else str(rel)
+        under = lambda leaf: leaf == prefix or leaf.startswith(prefix + "/")
+        with self._lock:
+            for leaf in [lf for lf in self._loading if under(lf)]:
+                self._versions[leaf] = self._versions.get(leaf, 0) + 1
+            for key in [k for k in self._items if under(k[0])]:
+                self._bytes -= len(self._items.pop(key)["data"])
+            for sp in [sp for sp, v in self._paths.items() if under(v[0])]:
+                del self._paths[sp]
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits, "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "items": len(self._items), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                "paths": len(self._paths), "loading": len(self._loading),
+            }
+
+
+FRAME_CACHE = FrameCache(FRAME_CACHE_MB * 1024 * 1024)
 
 
 # ---- очистки ----
@@ -344,83 +612,446 @@ def cleanup_empty_dirs(start_dir: Path, stop_at: Path):
 
 
 # ---- WebP helpers ----
-def _encode_webp_via_pillow(img: "Image.Image", dst: Path, quality=85):
+def _encode_webp_via_pillow(img: "Image.Image", dst: Path | BinaryIO, quality=85, method=6):
     if img.mode not in ("RGB", "RGBA"): img = img.convert("RGB")
-    img.save(dst, "WEBP", quality=quality, method=6)
+    img.save(dst, "WEBP", quality=quality, method=method)
 
 
-def _encode_webp_via_cwebp(src_path: Path, dst_path: Path, max_w: int, quality=85):
-    if not CWEBP: raise RuntimeError("cwebp not found in PATH")
-    cmd = [CWEBP, str(src_path), "-q", str(quality), "-m", "6", "-mt"]
+def _encode_webp_via_cwebp(src_path: Path, dst_path: Path | BinaryIO, max_w: int, quality=85):
+    """dst_path — файл или поток (тогда cwebp пишет в stdout: «-o -»)."""
+    cwebp = encoders()["cwebp"]
+    if not cwebp: raise RuntimeError("cwebp not found in PATH")
+    cmd = [cwebp, str(src_path), "-q", str(quality), "-m", "6", "-mt"]
     if max_w > 0:
         cmd.extend(["-resize", str(max_w), "0"])
-    cmd.extend(["-o", str(dst_path)])
-    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    to_stream = not isinstance(dst_path, (str, Path))
+    cmd.extend(["-o", "-" if to_stream else str(dst_path)])
+    res = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if to_stream:
+        dst_path.write(res.stdout)
+
+
+def _prepare_frame(im: "Image.Image", max_w: int) -> "Image.Image":
+    from PIL import ImageOps
+
+    im = ImageOps.exif_transpose(im)
+    if max_w and max(im.size) > max_w:
+        im.thumbnail((max_w, max_w * 10), encoders()["resample"])
+    return im
 
 
-def _encode_webp_with_exif_fix(src_path: Path, dst_path: Path, max_w: int, quality=85):
-    if PIL_OK:
+def _encode_image_to_webp(im: "Image.Image", dst_path: Path | BinaryIO, max_w: int, quality=85):
+    enc = encoders()
+    im = _prepare_frame(im, max_w)
+    if enc["webp"]:
+        _encode_webp_via_pillow(im, dst_path, quality=quality)
+    else:
+        if not enc["cwebp"]:
+            raise RuntimeError("no webp backend")
+        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
+            tmp_path = Path(tmp.name)
+        try:
+            im.save(tmp_path, "PNG", optimize=True)
+            _encode_webp_via_cwebp(tmp_path, dst_path, 0, quality=quality)
+        finally:
+            _safe_unlink(tmp_path)
+
+
+def _encode_webp_with_exif_fix(src_path: Path, dst_path: Path | BinaryIO, max_w: int, quality=85):
+    if encoders()["pil"]:
+        from PIL import Image
+
         with Image.open(src_path) as im:
-            im = ImageOps.exif_transpose(im)
-            if max_w and max(im.size) > max_w:
-                im.thumbnail((max_w, max_w * 10), RESAMPLE)
-            if WEBP_OK:
-                _encode_webp_via_pillow(im, dst_path, quality=quality)
-            else:
-                if not CWEBP:
-                    raise RuntimeError("no webp backend")
-                with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
-                    tmp_path = Path(tmp.name)
-                try:
-                    im.save(tmp_path, "PNG", optimize=True)
-                    _encode_webp_via_cwebp(tmp_path, dst_path, 0, quality=85)
-                finally:
-                    _safe_unlink(tmp_path)
+            _encode_image_to_webp(im, dst_path, max_w, quality=quality)
     else:
-        _encode_webp_via_cwebp(src_path, dst_path, max_w, quality=85)
+        _encode_webp_via_cwebp(src_path, dst_path, max_w, quality=quality)
+
+
+# ---- качество под бюджет байт («~60 КБ на кадр при 1280w») ----
+SPIN_QUALITY = int(CFG.get("spin_quality", 85))
+SPIN_TARGET_KB = float(CFG.get("spin_target_kb", 0))  # 0 — фиксированное SPIN_QUALITY
+SPIN_TARGET_REF_W = 1280  # бюджет задан для этой ширины, для другой — масштабируем по площади
+SPIN_TARGET_SAMPLES = max(2, int(CFG.get("spin_target_samples", 3)))  # кадров на калибровку листа
+SPIN_Q_MIN, SPIN_Q_MAX, SPIN_Q_STEP = 30, 95, 5
+
+
+def spin_target_kb(leaf: Path) -> float:
+    """Бюджет набора: target_kb из .meta.json листа или его родителей, иначе spin_target_kb."""
+    for p in [leaf, *leaf.parents]:
+        if p == Path("."): break
+        v = read_meta(p).get("target_kb")
+        if v is not None:
+            try:
+                return float(v)
+            except (TypeError, ValueError):
+                break
+    return SPIN_TARGET_KB
+
+
+def _target_bytes(target_kb: float, max_w: int) -> int:
+    scale = (max_w / SPIN_TARGET_REF_W) ** 2 if max_w else 1.0
+    return int(target_kb * 1024 * scale)
+
+
+def _open_image(src) -> "Image.Image":
+    from PIL import Image
+
+    return Image.open(src)
+
+
+def _calibrate_quality(open_frames: list, max_w: int, target: int) -> int:
+    """
+    Один раз на лист: на нескольких кадрах ищем бинпоиском максимальное качество,
+    при котором средний размер кадра укладывается в target. Пробы — method=4 (быстрее,
+    а итоговый method=6 даёт файл не больше), кадры готовим (поворот/уменьшение) один раз.
+    """
+    samples = []
+    for open_fn in open_frames:
+        with open_fn() as im:
+            im = _prepare_frame(im, max_w)
+            im.load()
+            samples.append(im)
+
+    def avg_size(q: int) -> float:
+        total = 0
+        for im in samples:
+            buf = BytesIO()
+            _encode_webp_via_pillow(im, buf, quality=q, method=4)
+            total += buf.tell()
+        return total / len(samples)
+
+    # бинпоиск по сетке с шагом SPIN_Q_STEP: ~4 пробы вместо ~7
+    grid = list(range(SPIN_Q_MIN, SPIN_Q_MAX + 1, SPIN_Q_STEP))
+    lo, hi, best = 0, len(grid) - 1, grid[0]
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        if avg_size(grid[mid]) <= target:
+            best, lo = grid[mid], mid + 1
+        else:
+            hi = mid - 1
+    return best
+
+
+def _leaf_quality(leaf: Path, open_frames: list, max_w: int) -> int:
+    """open_frames — функции, открывающие PIL-кадры листа (уже отобранные)."""
+    target_kb = spin_target_kb(leaf)
+    enc = encoders()
+    if target_kb <= 0 or not (enc["pil"] and enc["webp"]) or not open_frames:
+        return SPIN_QUALITY
+    picks = [open_frames[i] for i in _sample_indices(len(open_frames), SPIN_TARGET_SAMPLES)]
+    t0 = time.perf_counter()
+    try:
+        with span("calibrate_quality"):
+            q = _calibrate_quality(picks, max_w, _target_bytes(target_kb, max_w))
+    except Exception as e:
+        log.error("quality calibration failed for %s -> %s", leaf, e, extra={"dataset": leaf.as_posix()})
+        return SPIN_QUALITY
+    log.info("spin quality %s q=%d", leaf.as_posix(), q, extra={
+        "dataset": leaf.as_posix(), "quality": q, "target_kb": target_kb, "samples": len(picks),
+        "ms": round((time.perf_counter() - t0) * 1000.0, 1)})
+    return q
+
+
+def _put_frame(key: str, encode) -> bool:
+    """encode(buf) пишет webp в буфер; кадр кладётся в cache_store целиком (атомарно)."""
+    buf = BytesIO()
+    encode(buf)
+    buf.seek(0)
+    cache_store().put(key, buf, content_type="image/webp")
+    return True
+
+
+def _marked_frames(leaf: Path) -> int:
+    """Сколько кадров записано в отметке о сборке (0 — не прочитать)."""
+    try:
+        with cache_store().open(f"{leaf.as_posix()}/{SPIN_DONE_MARK}") as f:
+            return int(json.loads(f.read()).get("frames", 0))
+    except Exception:
+        return 0
+
+
+def _cache_usable(leaf: Path, existing: list[str], done: bool) -> bool:
+    return bool(existing) and done and len(existing) >= _marked_frames(leaf)
+
+
+def _begin_build(leaf: Path, existing: list[str]):
+    """Пересборка недостроенного кэша: снимаем отметку, чтобы никто не счёл его готовым."""
+    if existing:
+        log.warning("spin cache incomplete for %s (%d frames), rebuilding", leaf.as_posix(), len(existing),
+                    extra={"dataset": leaf.as_posix()})
+    cache_store().delete(f"{leaf.as_posix()}/{SPIN_DONE_MARK}")
+
+
+def _finish_build(leaf: Path, written: list[str], existing: list[str]) -> list[str]:
+    """Лишние кадры прошлой сборки — прочь; отметка о завершении — последней записью."""
+    if written:
+        keep = set(written)
+        for key in existing:
+            if key not in keep:
+                cache_store().delete(key)
+        cache_store().put(f"{leaf.as_posix()}/{SPIN_DONE_MARK}",
+                          json.dumps({"frames": len(written), "ts": round(time.time(), 3)}).encode("utf-8"),
+                          content_type="application/json")
+    FRAME_CACHE.invalidate(leaf)
+    return _cached_frames(leaf)
 
 
 # ---- WebP кэш (СТРОГО на листе) ----
-def ensure_spin_cache(dataset_rel: Path, max_w: int = 1280, max_frames: int = 90) -> list[str]:
+def ensure_spin_cache(dataset_rel: Path, max_w: int = 1280, max_frames: int = 90,
+                      progress=None) -> list[str]:
+    """progress(leaf, готово, всего) — вызывается после каждого кадра (для фоновой сборки)."""
     leaf = resolve_leaf_rel(dataset_rel)
     src_dir = safe_join_under(DATA_DIR, leaf)
-    out_dir = safe_join_under(CACHE_DIR, leaf)
-    out_dir.mkdir(parents=True, exist_ok=True)
+    safe_join_under(CACHE_DIR, leaf)  # проверка пути
 
-    existing = sorted([p for p in out_dir.glob("*.webp")], key=lambda p: p.name)
-    if existing:
-        return [str(p.relative_to(CACHE_DIR)).replace("\\", "/") for p in existing]
+    existing, done = _leaf_listing(leaf)
+    if _cache_usable(leaf, existing, done):
+        return existing
 
     src_files = list_images_direct(src_dir)
     src_files = [f for f in src_files if Path(f).suffix.lower() != ".webp"]
     src_files.sort(key=_numeric_path_key)
+    if existing and not src_files:
+        # оригиналов уже нет (кэш прежних версий, без отметки) — пересобрать не из чего, принимаем как есть
+        return _finish_build(leaf, existing, existing)
     if not src_files:
         subdirs = [d for d in src_dir.iterdir() if d.is_dir()]
         all_written = []
         for sd in subdirs:
             sub_rel = (leaf / sd.name)
-            all_written += ensure_spin_cache(sub_rel, max_w=max_w, max_frames=max_frames)
+            all_written += ensure_spin_cache(sub_rel, max_w=max_w, max_frames=max_frames, progress=progress)
         return all_written
 
     if max_frames and len(src_files) > max_frames:
         idxs = _sample_indices(len(src_files), max_frames)
         src_files = [src_files[i] for i in idxs]
 
+    _begin_build(leaf, existing)
+    quality = _leaf_quality(leaf, [lambda p=src_dir / n: _open_image(p) for n in src_files], max_w)
+    written = []
     for i, name in enumerate(src_files):
         src = src_dir / name
-        dst = out_dir / f"{i:04d}.webp"
-        dst.parent.mkdir(parents=True, exist_ok=True)
+        key = f"{leaf.as_posix()}/{i:04d}.webp"
+        # кадр появляется атомарно (put) — его могут читать во время сборки
         try:
-            _encode_webp_with_exif_fix(src, dst, max_w, quality=85)
+            with span("ensure_spin_cache"):
+                _put_frame(key, lambda buf: _encode_webp_with_exif_fix(src, buf, max_w, quality=quality))
+            written.append(key)
         except Exception as e:
-            log.error("webp encode failed for %s -> %s", src, e)
-            _safe_unlink(dst)
+            log.error("webp encode failed for %s -> %s", src, e, extra={"dataset": leaf.as_posix()})
+        if progress:
+            progress(leaf, i + 1, len(src_files))
+    return _finish_build(leaf, written, existing)
 
-    result = sorted([p for p in out_dir.glob("*.webp")], key=lambda p: p.name)
-    return [str(p.relative_to(CACHE_DIR)).replace("\\", "/") for p in result]
+
+# ---- потоковый приём ZIP: кадры прямо из архива, без распаковки оригиналов ----
+def zip_stream_supported() -> bool:
+    enc = encoders()
+    return enc["pil"] and (enc["webp"] or bool(enc["cwebp"]))
+
+
+def ensure_spin_cache_from_zip(zf: zipfile.ZipFile, leaf_rel: Path, members: list,
+                               max_w: int = 1280, max_frames: int = 90) -> list[str]:
+    """
+    members — [(ZipInfo, имя файла)] оригиналов одного листа.
+    Декодируем выбранные кадры из памяти и пишем только webp в cache_store (leaf_rel/NNNN.webp).
+    """
+    safe_join_under(CACHE_DIR, leaf_rel)  # проверка пути
+
+    existing, done = _leaf_listing(leaf_rel)
+    if _cache_usable(leaf_rel, existing, done):
+        return existing
+
+    from PIL import Image
+
+    members = sorted(members, key=lambda mn: _numeric_path_key(mn[1]))
+    if max_frames and len(members) > max_frames:
+        idxs = _sample_indices(len(members), max_frames)
+        members = [members[i] for i in idxs]
+
+    _begin_build(leaf_rel, existing)
+    quality = _leaf_quality(leaf_rel, [lambda m=m: _open_image(BytesIO(zf.read(m))) for m, _ in members], max_w)
+    written = []
+    for i, (m, name) in enumerate(members):
+        key = f"{leaf_rel.as_posix()}/{i:04d}.webp"
+        try:
+            with span("ensure_spin_cache"), Image.open(BytesIO(zf.read(m))) as im:
+                _put_frame(key, lambda buf: _encode_image_to_webp(im, buf, max_w, quality=quality))
+            written.append(key)
+        except Exception as e:
+            log.error("webp encode failed for zip:%s -> %s", m.filename, e, extra={"dataset": leaf_rel.as_posix()})
+    return _finish_build(leaf_rel, written, existing)
+
+
+# ---- экспорт наборов: ZIP без сжатия потоком (см. zipstream.py) ----
+def _export_opener(store: StorageBackend, key: str):
+    return lambda: store.open(key)
+
+
+def export_zip(dataset_ids: list[str]) -> StoredZip:
+    """
+    Кадры, модели и .meta.json наборов в раскладке DATA_DIR: <id>/model.obj,
+    _cache/spin/<id>/0000.webp — архив можно распаковать прямо в DATA_DIR.
+    KeyError — если у набора нечего отдавать.
+    """
+    entries, seen = [], set()
+    for ds in dataset_ids:
+        rel = safe_rel_path(ds).as_posix()
+        found = 0
+        for store, prefix in ((data_store(), ""), (cache_store(), "_cache/spin/")):
+            for o in store.list(rel, recursive=True):
+                fname = o.key.rpartition("/")[2]
+                if prefix:
+                    if not fname.endswith(".webp"): continue
+                elif fname != ".meta.json" and Path(fname).suffix.lower() not in ALLOWED_MODEL_EXT:
+                    continue
+                found += 1
+                name = prefix + o.key
+                if name in seen: continue  # вложенные id в одном запросе
+                seen.add(name)
+                entries.append(ZipEntry(name, o.size, o.mtime, _export_opener(store, o.key),
+                                        ident=f"{store.name}:{prefix}{o.key}"))
+        if not found:
+            raise KeyError(rel)
+    return StoredZip(entries)
+
+
+# ---- фоновая сборка кэша (приоритетная очередь) ----
+PRIO_ON_DEMAND, PRIO_WARM, PRIO_SCAN = 0, 1, 2  # меньше — раньше
+SPIN_BUILD_WORKERS = max(1, int(CFG.get("spin_build_workers", 1)))
+SPIN_FAIL_RETRY_SEC = 60
+
+
+class SpinBuilder:
+    """
+    Очередь сборки webp-кэша по листам. Источники: стартовый скан (PRIO_SCAN),
+    явный прогрев (PRIO_WARM) и запросы зрителей (PRIO_ON_DEMAND — всегда первыми).
+    Повторная постановка листа не дублирует работу, а лишь повышает приоритет.
+    """
+
+    def __init__(self, workers: int = 1):
+        self.workers = workers
+        self._q: queue.PriorityQueue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._state: dict[str, dict] = {}  # лист -> {"status", "prio", "done", "total", "ts"}
+        self._threads: list[threading.Thread] = []
+        self.built = 0
+        self.failed = 0
+        self.on_built: list = []  # колбэки fn(key) после успешной сборки (например, статическая выгрузка)
+
+    def submit(self, leaf: Path, prio: int = PRIO_ON_DEMAND, max_w: int = 1280, max_frames: int = 90) -> dict:
+        key = leaf.as_posix()
+        with self._lock:
+            st = self._state.get(key)
+            if st and st["status"] == "failed" and time.time() - st["ts"] < SPIN_FAIL_RETRY_SEC:
+                return dict(st)
+            if st and st["status"] in ("queued", "building"):
+                if st["status"] == "queued" and prio < st["prio"]:
+                    st["prio"] = prio  # старая запись в очереди станет «устаревшей» и будет пропущена
+                    self._q.put((prio, next(self._seq), key, max_w, max_frames))
+                return dict(st)
+            st = {"status": "queued", "prio": prio, "done": 0, "total": 0, "ts": time.time()}
+            self._state[key] = st
+            self._q.put((prio, next(self._seq), key, max_w, max_frames))
+            self._ensure_workers()
+            return dict(st)
+
+    def status(self, leaf: Path) -> dict | None:
+        with self._lock:
+            st = self._state.get(leaf.as_posix())
+            return dict(st) if st else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            by = {}
+            for st in self._state.values():
+                by[st["status"]] = by.get(st["status"], 0) + 1
+            return {"queue": self._q.qsize(), "built": self.built, "failed": self.failed, **by}
+
+    def _ensure_workers(self):
+        # под self._lock; потоки поднимаем лениво (после fork)
+        while len(self._threads) < self.workers:
+            t = threading.Thread(target=self._loop, name=f"spin-build-{len(self._threads)}", daemon=True)
+            self._threads.append(t)
+            t.start()
+
+    def _progress(self, key: str):
+        def cb(_leaf, done, total):
+            with self._lock:
+                st = self._state.get(key)
+                if st:
+                    st["done"], st["total"] = done, total
+
+        return cb
+
+    def _loop(self):
+        while True:
+            prio, _, key, max_w, max_frames = self._q.get()
+            with self._lock:
+                st = self._state.get(key)
+                if not st or st["status"] != "queued" or st["prio"] != prio:
+                    continue
+                st["status"] = "building"
+            t0 = time.perf_counter()
+            try:
+                with PROFILER.job("ensure_spin_cache", key):
+                    urls = ensure_spin_cache(Path(key), max_w=max_w, max_frames=max_frames,
+                                             progress=self._progress(key))
+            except Exception as e:
+                log.error("spin build failed for %s -> %s", key, e, extra={"dataset": key})
+                urls = []
+            log.info("spin build %s", key, extra={
+                "dataset": key, "frames": len(urls), "prio": prio,
+                "ms": round((time.perf_counter() - t0) * 1000.0, 1)})
+            with self._lock:
+                if urls:
+                    self._state.pop(key, None)  # готово — дальше отдаёт list_cached_webp
+                    self.built += 1
+                else:
+                    self._state[key] = {"status": "failed", "prio": prio, "done": 0, "total": 0, "ts": time.time()}
+                    self.failed += 1
+            if urls:
+                for fn in self.on_built:
+                    try:
+                        fn(key)
+                    except Exception as e:
+                        log.error("spin build hook failed: %s", e)
+
+
+SPIN_BUILDER = SpinBuilder(SPIN_BUILD_WORKERS)
+
+
+def find_uncached_leafs() -> list[Path]:
+    """Листья с оригиналами без собранного целиком webp-кэша (для стартового прогрева)."""
+    cached = {o.key.rpartition("/")[0] for o in cache_store().list("", recursive=True)
+              if o.key.rpartition("/")[2] == SPIN_DONE_MARK}
+    out = []
+    for root, dirs, files in os.walk(DATA_DIR):
+        p = Path(root)
+        if p == DATA_DIR:
+            for skip in ("_uploads", "_cache"):
+                if skip in dirs: dirs.remove(skip)
+            continue
+        if not any(Path(f).suffix.lower() in ORIGINAL_IMAGE_EXT for f in files):
+            continue
+        rel = p.relative_to(DATA_DIR)
+        if rel.as_posix() not in cached:
+            out.append(rel)
+    out.sort(key=lambda r: r.as_posix())
+    return out
+
+
+def warm_uncached(max_w: int = 1280, max_frames: int = 90) -> int:
+    leafs = find_uncached_leafs()
+    for rel in leafs:
+        SPIN_BUILDER.submit(rel, PRIO_SCAN, max_w=max_w, max_frames=max_frames)
+    return len(leafs)
 
 
 # ---- периодическая чистка оригиналов (после успешного кэша) ----
+# Только у листьев с отметкой SPIN_DONE_MARK и не стоящих в очереди/сборке: первые кадры
+# появляются задолго до конца сборки, а удалённые на полпути оригиналы не вернуть.
 def sweep_originals(data_dir: Path, older_than_sec: int = CLEAN_DELAY_SEC):
     now = time.time()
     for root, dirs, files in os.walk(data_dir):
@@ -433,7 +1064,11 @@ def sweep_originals(data_dir: Path, older_than_sec: int = CLEAN_DELAY_SEC):
             rel = p.relative_to(data_dir)
         except Exception:
             continue
-        if list_cached_webp(rel):
+        leaf = resolve_leaf_rel(rel)
+        st = SPIN_BUILDER.status(leaf)
+        if st and st["status"] in ("queued", "building"):
+            continue
+        if spin_cache_state(leaf)[1]:
             for f in p.iterdir():
                 try:
                     if f.is_file() and f.suffix.lower() in ORIGINAL_IMAGE_EXT and now - f.stat().st_mtime > older_than_sec:
@@ -0,0 +1,78 @@
+import json, logging, time, threading
+from contextlib import contextmanager
+from functools import wraps
+
+from logsetup import SLOW_LOGGER
+
+# ---- именованные интервалы запроса (для Server-Timing и лога медленных запросов) ----
+# Вне запроса (фоновые потоки) span() ничего не записывает.
+_local = threading.local()
+_slow_log = logging.getLogger(SLOW_LOGGER)
+
+
+def begin():
+    _local.spans = {}  # имя -> [суммарно мс, количество]
+    _local.t0 = time.perf_counter()
+
+
+def end() -> tuple[dict, float]:
+    """Возвращает (spans, полное время запроса в мс) и выключает запись."""
+    spans = getattr(_local, "spans", None) or {}
+    t0 = getattr(_local, "t0", None)
+    _local.spans = None
+    total = (time.perf_counter() - t0) * 1000.0 if t0 is not None else 0.0
+    return spans, total
+
+
+def add(name: str, ms: float):
+    spans = getattr(_local, "spans", None)
+    if spans is None:
+        return
+    acc = spans.get(name)
+    if acc is None:
+        spans[name] = [ms, 1]
+    else:
+        acc[0] += ms
+        acc[1] += 1
+
+
+@contextmanager
+def span(name: str):
+    if getattr(_local, "spans", None) is None:
+        yield
+        return
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(name, (time.perf_counter() - t) * 1000.0)
+
+
+def timed(name: str):
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*a, **k):
+            with span(name):
+                return fn(*a, **k)
+
+        return wrapper
+
+    return deco
+
+
+def server_timing_header(spans: dict, total_ms: float) -> str:
+    parts = []
+    for name, (ms, n) in spans.items():
+        item = f"{name};dur={ms:.1f}"
+        if n > 1:
+            item += f';desc="x{n}"'
+        parts.append(item)
+    parts.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(parts)
+
+
+def log_slow(record: dict, spans: dict):
+    """Медленный запрос одной JSON-строкой (с разбивкой по интервалам) — в очередь SLOW_LOGGER."""
+    rec = dict(record)
+    rec["spans"] = {name: {"ms": round(ms, 1), "n": n} for name, (ms, n) in spans.items()}
+    _slow_log.info("%s", json.dumps(rec, ensure_ascii=False))
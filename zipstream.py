@@ -0,0 +1,218 @@
+import hashlib, struct, threading, time, zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, Iterator
+
+# ---- ZIP «на лету» без сжатия (stored) ----
+# Раскладка архива детерминирована и известна заранее (размер, смещения), поэтому
+# отдаём его потоком с постоянной памятью, без временного файла и с поддержкой Range.
+# CRC32 и размеры — прямо в локальном заголовке (без data descriptor: потоковые читатели,
+# напр. Java ZipInputStream, не принимают его у stored-записей). CRC нужен до данных: берём
+# из мемо, иначе файл до SMALL_MAX читаем в память один раз (CRC + данные), крупный — дважды.
+
+CHUNK = 256 * 1024
+SMALL_MAX = 8 * 1024 * 1024
+_U32 = 0xFFFFFFFF
+_FLAGS = 0x0800  # имена в UTF-8
+
+
+@dataclass
+class ZipEntry:
+    name: str  # путь внутри архива (posix)
+    size: int
+    mtime: float
+    open: Callable[[], BinaryIO]
+    ident: str = ""  # ключ мемо CRC; пусто — не мемоизировать
+
+
+# CRC по (ident, size, mtime): кадры неизменяемы, докачка не перечитывает пропущенное дважды
+_crc_memo: OrderedDict = OrderedDict()
+_crc_lock = threading.Lock()
+_CRC_MEMO_MAX = 100_000
+
+
+def _memo_key(e: ZipEntry):
+    return (e.ident, e.size, int(e.mtime)) if e.ident else None
+
+
+def _crc_get(e: ZipEntry) -> int | None:
+    k = _memo_key(e)
+    if k is None: return None
+    with _crc_lock:
+        v = _crc_memo.get(k)
+        if v is not None: _crc_memo.move_to_end(k)
+        return v
+
+
+def _crc_put(e: ZipEntry, crc: int):
+    k = _memo_key(e)
+    if k is None: return
+    with _crc_lock:
+        _crc_memo[k] = crc
+        _crc_memo.move_to_end(k)
+        while len(_crc_memo) > _CRC_MEMO_MAX:
+            _crc_memo.popitem(last=False)
+
+
+def _dos_time(mtime: float) -> tuple[int, int]:
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1  # 1980-01-01 00:00
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), \
+           ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+def _read_exact(f: BinaryIO, n: int) -> Iterator[bytes]:
+    while n > 0:
+        chunk = f.read(min(CHUNK, n))
+        if not chunk:
+            raise IOError("file shrank while zipping")
+        n -= len(chunk)
+        yield chunk
+
+
+def _skip(f: BinaryIO, n: int):
+    if n <= 0: return
+    try:
+        f.seek(n, 1)
+        return
+    except (AttributeError, OSError, ValueError):
+        pass
+    for _ in _read_exact(f, n):  # не умеет seek (поток S3) — читаем вхолостую
+        pass
+
+
+class StoredZip:
+    """
+    entries — список ZipEntry (размеры и mtime берутся из листинга, данные читаются лениво).
+    size — точный размер архива, etag — по манифесту (имена, размеры, mtime).
+    """
+
+    def __init__(self, entries: list[ZipEntry]):
+        self.entries = entries
+        self._segs = []  # (offset, length, kind, idx)
+        self._offsets = []
+        self._zip64 = []
+        self._crc = [None] * len(entries)
+        self._held: tuple[int, bytes] | None = None  # (idx, данные), прочитанные ради CRC
+        off = 0
+        for i, e in enumerate(entries):
+            z64 = e.size >= _U32 or off >= _U32
+            lh_len = 30 + len(e.name.encode("utf-8")) + (20 if z64 else 0)
+            self._offsets.append(off)
+            self._zip64.append(z64)
+            for kind, n in (("lh", lh_len), ("data", e.size)):
+                self._segs.append((off, n, kind, i))
+                off += n
+        self._cd_offset = off
+        self._cd_size = sum(46 + len(e.name.encode("utf-8")) + len(self._central_extra(i))
+                            for i, e in enumerate(entries))
+        self._segs.append((off, self._cd_size, "cd", -1))
+        off += self._cd_size
+        tail = self._end_records()
+        self._tail = tail
+        self._segs.append((off, len(tail), "end", -1))
+        self.size = off + len(tail)
+        h = hashlib.md5(b"stored-v2\n")  # v2: CRC в локальном заголовке — старые байты не докачивать
+        for e in entries:
+            h.update(f"{e.name}\t{e.size}\t{int(e.mtime)}\n".encode("utf-8"))
+        self.etag = h.hexdigest()
+
+    # --- заголовки ---
+    def _local_header(self, i: int) -> bytes:
+        e, z64 = self.entries[i], self._zip64[i]
+        name = e.name.encode("utf-8")
+        t, d = _dos_time(e.mtime)
+        extra = struct.pack("<HHQQ", 0x0001, 16, e.size, e.size) if z64 else b""
+        size = _U32 if z64 else e.size
+        return struct.pack("<IHHHHHIIIHH", 0x04034B50, 45 if z64 else 20, _FLAGS, 0, t, d,
+                           self._get_crc(i, hold=True), size, size, len(name), len(extra)) + name + extra
+
+    def _central_extra(self, i: int) -> bytes:
+        e = self.entries[i]
+        vals = []
+        if e.size >= _U32: vals += [e.size, e.size]
+        if self._offsets[i] >= _U32: vals.append(self._offsets[i])
+        if not vals: return b""
+        return struct.pack(f"<HH{len(vals)}Q", 0x0001, 8 * len(vals), *vals)
+
+    def _central(self) -> bytes:
+        out = bytearray()
+        for i, e in enumerate(self.entries):
+            name = e.name.encode("utf-8")
+            t, d = _dos_time(e.mtime)
+            extra = self._central_extra(i)
+            ver = 45 if self._zip64[i] else 20
+            size = _U32 if e.size >= _U32 else e.size
+            off = _U32 if self._offsets[i] >= _U32 else self._offsets[i]
+            out += struct.pack("<IHHHHHHIIIHHHHHII", 0x02014B50, (3 << 8) | ver, ver, _FLAGS, 0, t, d,
+                               self._get_crc(i), size, size, len(name), len(extra), 0, 0, 0,
+                               0o100644 << 16, off)
+            out += name + extra
+        return bytes(out)
+
+    def _end_records(self) -> bytes:
+        n = len(self.entries)
+        out = b""
+        if n >= 0xFFFF or self._cd_offset >= _U32 or self._cd_size >= _U32:
+            eocd64_off = self._cd_offset + self._cd_size
+            out += struct.pack("<IQHHIIQQQQ", 0x06064B50, 44, 45, 45, 0, 0, n, n,
+                               self._cd_size, self._cd_offset)
+            out += struct.pack("<IIQI", 0x07064B50, 0, eocd64_off, 1)
+        out += struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, min(n, 0xFFFF), min(n, 0xFFFF),
+                           min(self._cd_size, _U32), min(self._cd_offset, _U32), 0)
+        return out
+
+    # --- CRC ---
+    def _get_crc(self, i: int, hold: bool = False) -> int:
+        crc = self._crc[i]
+        if crc is None:
+            crc = _crc_get(self.entries[i])
+        if crc is None:
+            e = self.entries[i]
+            if hold and e.size <= SMALL_MAX:  # данные следом понадобятся — держим, чтобы не читать дважды
+                with e.open() as f:
+                    data = b"".join(_read_exact(f, e.size))
+                crc = zlib.crc32(data)
+                self._held = (i, data)
+            else:
+                crc = 0
+                with e.open() as f:
+                    for chunk in _read_exact(f, e.size):
+                        crc = zlib.crc32(chunk, crc)
+            _crc_put(e, crc)
+        self._crc[i] = crc
+        return crc
+
+    def _data(self, i: int, a: int, b: int) -> Iterator[bytes]:
+        held, self._held = self._held, None
+        if held is not None and held[0] == i:
+            mv = memoryview(held[1])
+            for p in range(a, b, CHUNK):
+                yield bytes(mv[p:min(p + CHUNK, b)])
+            return
+        with self.entries[i].open() as f:
+            _skip(f, a)
+            yield from _read_exact(f, b - a)
+
+    # --- отдача ---
+    def iter_range(self, start: int = 0, stop: int | None = None) -> Iterator[bytes]:
+        """Байты архива [start, stop)."""
+        stop = self.size if stop is None else min(stop, self.size)
+        for off, n, kind, i in self._segs:
+            if off + n <= start or n == 0: continue
+            if off >= stop: break
+            a, b = max(start - off, 0), min(stop - off, n)
+            if kind == "data":
+                yield from self._data(i, a, b)
+                continue
+            if kind == "lh":
+                blob = self._local_header(i)
+            elif kind == "cd":
+                blob = self._central()
+            else:
+                blob = self._tail
+            yield blob[a:b]
+
+    def __iter__(self):
+        return self.iter_range()